@@ -1,20 +1,33 @@
 # %% Import + setup
+import time
+BOOT_STARTED = time.perf_counter()  # Worker boot time (imports included) is logged once the app is built
+
 import dash
-from dash import html, Input, Output, State, ctx, dcc, Dash
+from dash import html, Input, Output, State, ctx, dcc, Dash, Patch
 import dash_bootstrap_components as dbc
 import pandas as pd
-import numpy as np
-from sqlalchemy import create_engine, text
-from credentials import sql_engine_string_generator
+from credentials import connection_params, get_secret_provider
+import queries
+import ingest
+import validation
+import datetimes
+from session_store import SESSION_STORE, create_session_store
+from journal import create_edit_journal
+from export import register_export_route
+from database import create_pooled_engine, pool_stats
+import metrics
+from logconfig import configure_logging
+from kit_events import create_kit_event_hub, register_events_route
+from reference_data import LocationCache, ReferenceDataCache
+from jobs import JOB_PROGRESS_HIDDEN, JOB_PROGRESS_VISIBLE, create_background_manager, progress_reporter
 from flask import request
-from datetime import datetime
 import os
 import logging
 from dash_breakpoints import WindowBreakpoints
 import socket
 import dash.exceptions
 import dash_ag_grid as dag
-import re
+import uuid
 
 # Local dev boolean
 computer = socket.gethostname()
@@ -26,16 +39,8 @@ else:
 # Version number to display
 version = "3.8"
 
-# Setup logger
-if not os.path.exists('logs'):
-    os.mkdir('logs')
-
-logging.basicConfig(
-    format='%(message)s',
-    filename='logs/log.log',
-    filemode='w+',
-    level=20
-)
+# Setup logger: JSON lines, appended (never truncated) and rotated, written by a background thread
+configure_logging()
 
 logging.getLogger("azure").setLevel(logging.ERROR)
 
@@ -49,6 +54,9 @@ external_scripts = [
     "https://cdn.jsdelivr.net/npm/inputmask/dist/inputmask.min.js"
 ]
 
+# Runs the long database jobs (uploads, overwrites, returned kits) outside the request workers
+background_callback_manager = create_background_manager(__name__, shared_state=SESSION_STORE != "memory")
+
 # Initialize the dash app as 'app'
 if not local:
     app = Dash(__name__,
@@ -56,30 +64,114 @@ if not local:
                external_scripts=external_scripts,
                requests_pathname_prefix="/app/AQPD/",
                routes_pathname_prefix="/app/AQPD/",
-               suppress_callback_exceptions=True)
+               suppress_callback_exceptions=True,
+               background_callback_manager=background_callback_manager)
 else:
     app = Dash(__name__,
                external_stylesheets=external_stylesheets, 
                external_scripts=external_scripts,
-               suppress_callback_exceptions=True)
+               suppress_callback_exceptions=True,
+               background_callback_manager=background_callback_manager)
+
+# Pooled engines live for the lifetime of the worker process. Both databases share one host/user/password,
+# resolved from Key Vault (or .env locally) on the first connection and cached (see credentials.py)
+def datahub_connect_params():
+    return connection_params('DATAHUB_PSQL_SERVER', 'DATAHUB_PSQL_USER', 'DATAHUB_PSQL_PASSWORD', local)
+
+dcp_sql_engine = create_pooled_engine("postgresql:///dcp?sslmode=require", datahub_connect_params)
+mercury_sql_engine = create_pooled_engine("postgresql:///mercury_passive?sslmode=require", datahub_connect_params)
+
+
+# Users, stations and site labels shared across page loads and callbacks
+reference_cache = ReferenceDataCache(dcp_sql_engine)
+
+# Distinct shipped locations for the Update modal dropdown (refreshed after uploads)
+location_cache = LocationCache(mercury_sql_engine)
+
+# Maximum number of locations sent to the dropdown per search
+LOCATION_OPTIONS_LIMIT = 100
+
+# Location searches with more rows than this are shown in the infinite (SQL paged) grid
+INFINITE_ROW_THRESHOLD = 1000
+
+# Rows per block requested by the infinite grid
+GRID_BLOCK_ROWS = 100
+
+GRID_CONTAINER_VISIBLE = {"padding": "0 40px"}
+GRID_CONTAINER_HIDDEN = {"padding": "0 40px", "display": "none"}
+
+
+# Columns of the working dataframe shown in the table
+DATABASE_COLUMNS = queries.TRACKING_COLUMNS
+
+# Per-session storage for the working dataframe (keyed by the session-id store created in serve_layout)
+session_store = create_session_store()
+
+
+def get_session_df(session_id):
+    df = session_store.get(session_id, "database_df")
+    return df if df is not None else pd.DataFrame(columns=DATABASE_COLUMNS)
+
+
+def set_session_df(session_id, df):
+    session_store.set(session_id, "database_df", df)
+
+
+def get_session_rows(session_id, rowids):
+    # Only these rows of the session dataframe (rows it does not hold are left out)
+    df = session_store.get_rows(session_id, "database_df", rowids)
+    return df if df is not None else pd.DataFrame(columns=DATABASE_COLUMNS)
+
+
+def update_session_rows(session_id, rows):
+    # Writes only these rows: rows with the same index are replaced, new ones appended
+    session_store.set_rows(session_id, "database_df", rows)
+
+
+def to_row_data(df):
+    # _rowid ties each grid row (getRowId) to its index in the session dataframe
+    return df.assign(_rowid=df.index.astype(str)).to_dict("records")
+
+
+def get_grid_source(session_id):
+    # {"location": ...} while the infinite grid pages through a location search, otherwise None
+    return session_store.get(session_id, "grid_source")
+
+
+def set_grid_source(session_id, source):
+    session_store.set(session_id, "grid_source", source)
+
+
+def get_loaded_rows(session_id):
+    # The session's rows as they were read from pas_tracking, with their row_version, under the same index as in the
+    # session dataframe. Uploads compare the session dataframe against them to find the edited cells
+    loaded = session_store.get(session_id, "loaded_rows")
+    return loaded if loaded is not None else pd.DataFrame(columns=DATABASE_COLUMNS + ["row_version"])
+
+
+def set_loaded_rows(session_id, loaded):
+    session_store.set(session_id, "loaded_rows", loaded)
+
 
-# Global variable to store headers
-request_headers = {}
+def add_loaded_rows(session_id, rows):
+    # Loaded rows with the same index are replaced, e.g. once they were saved or refreshed. Only these rows are written
+    session_store.set_rows(session_id, "loaded_rows", rows)
 
-# Get connection string
-dcp_sql_engine_string = sql_engine_string_generator('DATAHUB_PSQL_SERVER', 'dcp', 'DATAHUB_PSQL_USER', 'DATAHUB_PSQL_PASSWORD', local)
-dcp_sql_engine = create_engine(dcp_sql_engine_string)
 
-mercury_sql_engine_string = sql_engine_string_generator('DATAHUB_PSQL_SERVER', 'mercury_passive', 'DATAHUB_PSQL_USER', 'DATAHUB_PSQL_PASSWORD', local)
-mercury_sql_engine = create_engine(mercury_sql_engine_string)
+def to_grid_frame(df):
+    # Rows read from pas_tracking as the grid shows them: formatted datetimes and site labels
+    # instead of raw siteids (unknown ids are kept as they are)
+    datetimes.format_datetimes(df)
+    siteid_to_label = reference_cache.get().siteid_to_label
+    df["siteid"] = df["siteid"].map(siteid_to_label).fillna(df["siteid"])
+    return df
 
 
-# Global storage for the new dataframe
-database_df = pd.DataFrame(columns=[
-    'sample_start', 'sample_end', 'sampleid', 'kitid', 'samplerid',
-    'siteid', 'shipped_location', 'shipped_date', 'return_date',
-    'sample_type', 'note', 'screen_sampling_rate'
-])
+# Optional journal of table edits, written off the request path
+edit_journal = create_edit_journal()
+
+# Pushes kits written by one tab to the others (KIT_EVENTS, see kit_events.py)
+kit_event_hub = create_kit_event_hub(mercury_sql_engine)
 
 # Global table headers dict
 headerNames = {
@@ -100,77 +192,81 @@ headerNames = {
 # Define the placeholder for date/time columns
 DATE_TIME_PLACEHOLDER = "YYYY-MM-DD HH:MM"
 
-# Table div
-global tablehtml
 
+# %% Table div
+def create_table(infinite=False):
+    # Pull required data from the reference cache (only hits the database once the TTL expires)
+    sites_clean = reference_cache.get().site_labels
+
+    column_defs = [
+        {"field": "sample_start", "headerName": "Sample Start", "editable": True,"cellEditor": {"function": "DateTimePicker"}, "suppressSizeToFit": True, "width": 145},
+        {"field": "sample_end", "headerName": "Sample End", "editable": True,"cellEditor": {"function": "DateTimePicker"}, "suppressSizeToFit": True, "width": 145},
+        {"field": "sampleid", "headerName": "Sample ID", "editable": False, "suppressSizeToFit": True, "width": 156,"hide": True},
+        {"field": "kitid", "headerName": "Kit ID", "editable": True, "suppressSizeToFit": True, "width": 100},
+        {"field": "samplerid", "headerName": "Sampler ID", "editable": True, "suppressSizeToFit": True, "width": 127},
+        #{"field": "siteid", "headerName": "Site ID", "editable": True, "suppressSizeToFit": True, "width": 150,
+        # "cellEditor": "agRichSelectCellEditor","cellEditorParams": {"values": sites_clean,"searchEnabled": True,"filterList": True,}},
+        {"field": "siteid", "headerName": "Site", "editable": True, "suppressSizeToFit": True, "width": 150,
+         "cellEditor": {"function": "SearchableDropdownEditor"},"cellEditorParams": {"values": sites_clean}},
+        {"field": "shipped_location", "headerName": "Shipped Location", "editable": True, "suppressSizeToFit": True, "width": 165},
+        {"field": "shipped_date","headerName": "Shipped Date","editable": True,"cellEditor": {"function": "DatePicker"},"suppressSizeToFit": True, "width": 146},
+        {"field": "return_date", "headerName": "Return Date", "editable": True,"cellEditor": {"function": "DatePicker"},"suppressSizeToFit": True, "width": 133},
+        {"field": "sample_type", "headerName": "Sample Type", "editable": True, "cellEditor": "agSelectCellEditor", "cellEditorParams": {"values": ["Sample", "Blank"]}, "suppressSizeToFit": True, "width": 130},
+        {"field": "note", "headerName": "Note", "editable": True, "suppressSizeToFit": True, "width": 200}
+    ]
+    grid_options = {"rowSelection":"single",
+                    "animateRows": True,
+                    "editable": True,
+                    "enableRangeSelection": True,
+                    "enableFillHandle": True,
+                    "undoRedoCellEditing": True,
+                    "undoRedoCellEditingLimit": 20,
+                    "suppressClipboardPaste": False,
+                    "components":{},
+                    "loading": False
+    }
 
-# %% Layout function, useful for having two UI options (e.g., mobile vs desktop)
-def serve_layout():
-    global databases
-    global users
-    global sites
-    global sites_clean
-    global tablehtml
-    
-    # Pull required data from tables
-    users = pd.read_sql_table("users", dcp_sql_engine)
-    sites = pd.read_sql_query("select * from stations", dcp_sql_engine)
-    
-    sites_clean = sorted([
-        f"{row.description} ({row.siteid})"
-        for _, row in sites.query("projectid == 'MERCURY_PASSIVE'").iterrows()
-    ])
-    
-    dcp_sql_engine.dispose()
-    mercury_sql_engine.dispose()
-    
-    
-    tablehtml = html.Div(
+    if infinite:
+        # Large location searches: the grid requests blocks of rows and serve_location_block pages, sorts
+        # and filters them in SQL, so only the visible rows are sent
+        for col in column_defs:
+            col["filter"] = "agDateColumnFilter" if col["field"] in datetimes.DISPLAY_FORMATS else "agTextColumnFilter"
+        grid_options.update({
+            "cacheBlockSize": GRID_BLOCK_ROWS,
+            "maxBlocksInCache": 10,
+            # One block request at a time, so each getRowsResponse answers the pending getRowsRequest
+            "maxConcurrentDatasourceRequests": 1,
+        })
+
+    return html.Div(
         dag.AgGrid(
-            id="database-table",
+            id="location-table" if infinite else "database-table",
             enableEnterpriseModules=True,
-            columnDefs=[
-                {"field": "sample_start", "headerName": "Sample Start", "editable": True,"cellEditor": {"function": "DateTimePicker"}, "suppressSizeToFit": True, "width": 145},
-                {"field": "sample_end", "headerName": "Sample End", "editable": True,"cellEditor": {"function": "DateTimePicker"}, "suppressSizeToFit": True, "width": 145},
-                {"field": "sampleid", "headerName": "Sample ID", "editable": False, "suppressSizeToFit": True, "width": 156,"hide": True},
-                {"field": "kitid", "headerName": "Kit ID", "editable": True, "suppressSizeToFit": True, "width": 100},
-                {"field": "samplerid", "headerName": "Sampler ID", "editable": True, "suppressSizeToFit": True, "width": 127},
-                #{"field": "siteid", "headerName": "Site ID", "editable": True, "suppressSizeToFit": True, "width": 150,
-                # "cellEditor": "agRichSelectCellEditor","cellEditorParams": {"values": sites_clean,"searchEnabled": True,"filterList": True,}},
-                {"field": "siteid", "headerName": "Site", "editable": True, "suppressSizeToFit": True, "width": 150,
-                 "cellEditor": {"function": "SearchableDropdownEditor"},"cellEditorParams": {"values": sites_clean}},
-                {"field": "shipped_location", "headerName": "Shipped Location", "editable": True, "suppressSizeToFit": True, "width": 165},
-                {"field": "shipped_date","headerName": "Shipped Date","editable": True,"cellEditor": {"function": "DatePicker"},"suppressSizeToFit": True, "width": 146},
-                {"field": "return_date", "headerName": "Return Date", "editable": True,"cellEditor": {"function": "DatePicker"},"suppressSizeToFit": True, "width": 133},
-                {"field": "sample_type", "headerName": "Sample Type", "editable": True, "cellEditor": "agSelectCellEditor", "cellEditorParams": {"values": ["Sample", "Blank"]}, "suppressSizeToFit": True, "width": 130},
-                {"field": "note", "headerName": "Note", "editable": True, "suppressSizeToFit": True, "width": 200}
-            ],
+            columnDefs=column_defs,
             defaultColDef={"resizable": True, "sortable": True,"editable": True},
+            getRowId="params.data._rowid",
             columnSize="sizeToFit",
-            dashGridOptions={"rowSelection":"single",
-                             "animateRows": True,
-                             "editable": True,
-                             "enableRangeSelection": True,
-                             "enableFillHandle": True,
-                             "undoRedoCellEditing": True,
-                             "undoRedoCellEditingLimit": 20,
-                             "suppressClipboardPaste": False,
-                             "components":{},
-                             "loading": False
-            },
+            rowModelType="infinite" if infinite else "clientSide",
+            dashGridOptions=grid_options,
             className="ag-theme-alpine-dark",
             style={"height": "400px", "width": "100%"}
         ),
-        style={"padding": "0 40px"}
+        id="location-table-container" if infinite else "database-table-container",
+        style=GRID_CONTAINER_HIDDEN if infinite else GRID_CONTAINER_VISIBLE
     )
-    
+
+
+# %% Layout function, useful for having two UI options (e.g., mobile vs desktop)
+def serve_layout():
     return html.Div([
         html.Div(id="display", style={'textAlign': 'center'}),
         WindowBreakpoints(
             id="breakpoints",
             widthBreakpointThresholdsPx=[768],
             widthBreakpointNames=["sm", "lg"]
-        )
+        ),
+        # New id on every page load, so each browser tab gets its own server-side state
+        dcc.Store(id="session-id", data=str(uuid.uuid4()))
     ])
 
 # %% Desktop layout
@@ -232,6 +328,22 @@ def change_layout(breakpoint_name: str, window_width: int):
                     ], size="md"),
                     dbc.Tooltip("Create new sample entry", target="btn-new", placement="top"),
                     dbc.Tooltip("Update existing sample entry", target="btn-update", placement="top"),
+                    dcc.Upload(
+                        dbc.Button("Import", id="btn-import-kits", color="info", size="md"),
+                        id="kit-file-upload",
+                        accept=".csv,.xlsx,.xls",
+                        multiple=False,
+                        style={"display": "inline-block", "marginLeft": "10px"}
+                    ),
+                    dbc.Tooltip("Import new kits from a CSV or Excel file (columns: Kit ID, Sampler ID, Sample Type, ...)", target="btn-import-kits", placement="top"),
+                    dcc.Upload(
+                        dbc.Button("Returns", id="btn-import-returns", color="info", size="md"),
+                        id="return-file-upload",
+                        accept=".csv,.xlsx,.xls",
+                        multiple=False,
+                        style={"display": "inline-block", "marginLeft": "10px"}
+                    ),
+                    dbc.Tooltip("Apply a returned-kit sheet (columns: Sample ID, Return Date, Sample End, Note, Screen Sampling Rate)", target="btn-import-returns", placement="top"),
                 ]),
                 width="auto",
             ),
@@ -244,7 +356,10 @@ def change_layout(breakpoint_name: str, window_width: int):
             children=html.Div(id="db-loading-output", style={"display": "inline-block"})
         ),
         html.Hr(),
-        tablehtml,
+        create_table(),
+        create_table(infinite=True),
+        dcc.Store(id="grid-mode", data="client"),
+        dcc.Store(id="location-table-refresh", data=None),
         html.Div(id="edit-confirmation", style={"textAlign": "center", "color": "green", "marginTop": "10px"}),
         dbc.Modal(
             id="new-entry-modal",
@@ -338,12 +453,10 @@ def change_layout(breakpoint_name: str, window_width: int):
                 )
             ]
         ),
-        dcc.Store(id="entry-store", data=[]),
         dcc.Store(id="editing", data=False),
         dcc.Store(id="entry-counter", data=1),
-        dcc.Store(id='database-store', data=[]),
+        dcc.Store(id="entry-row-request", data=None),
         dcc.Store(id="kitid-filtered-data", data=None),
-        dcc.Interval(id='log_updater', interval=5000),
         html.Div(
             dbc.Button(
                 "Upload Data to Database",
@@ -354,18 +467,46 @@ def change_layout(breakpoint_name: str, window_width: int):
             ),
             className="d-flex justify-content-center"
         ),
+        # Progress of the running background job (upload, overwrite or returned kits)
+        html.Div(
+            [
+                dbc.Progress(id="job-progress", value=0, label="", striped=True, animated=True, style={"width": "300px"}),
+                dbc.Button("Cancel", id="btn-cancel-job", color="secondary", size="sm", className="ms-2"),
+            ],
+            id="job-progress-container",
+            style=JOB_PROGRESS_HIDDEN
+        ),
+        dcc.Store(id="tracking-updated", data=None),
+        # Set when a previewed returned-kit sheet is handed to its background job, and when the job is done with it
+        dcc.Store(id="return-apply", data=None),
+        dcc.Store(id="return-applied", data=None),
+        # Kits written from other tabs, pushed or polled from the server (assets/kitEvents.js), and those shown in this tab's grid
+        dcc.Store(id="kit-events", data=None),
+        dcc.Store(id="kit-refresh", data=None),
         
         html.Div(
-            dbc.Button(
-                "Download Database as CSV",
-                id="btn-download-db",
-                color="info",
-                className="mt-2",
-            ),
+            dbc.ButtonGroup([
+                # Plain links to the streaming export endpoint, so the browser downloads while rows are read
+                dbc.Button(
+                    "Download Database as CSV",
+                    id="btn-download-db",
+                    color="info",
+                    href=app.get_relative_path("/export/pas_tracking?format=csv"),
+                    external_link=True,
+                ),
+                dbc.DropdownMenu(
+                    [
+                        dbc.DropdownMenuItem("CSV (gzip)", href=app.get_relative_path("/export/pas_tracking?format=csv.gz"), external_link=True),
+                        dbc.DropdownMenuItem("Parquet", href=app.get_relative_path("/export/pas_tracking?format=parquet"), external_link=True),
+                    ],
+                    label="Other formats",
+                    color="info",
+                    group=True,
+                ),
+            ], className="mt-2"),
             className="d-flex justify-content-center"
         ),
         
-        dcc.Download(id="download-db-csv"),
         dbc.Modal(
             id="overwrite-confirm-modal",
             is_open=False,
@@ -379,7 +520,21 @@ def change_layout(breakpoint_name: str, window_width: int):
             ]
         ),
         dcc.Store(id="duplicate-rows", data=[]),
-        dcc.Store(id="overwrite-confirmed", data=False)
+        dcc.Store(id="overwrite-confirmed", data=False),
+        dbc.Modal(
+            id="return-preview-modal",
+            is_open=False,
+            size="xl",
+            scrollable=True,
+            children=[
+                dbc.ModalHeader("Returned Kits Preview"),
+                dbc.ModalBody(id="return-preview-body"),
+                dbc.ModalFooter([
+                    dbc.Button("Apply Changes", id="confirm-return-apply", color="success", className="me-2"),
+                    dbc.Button("Cancel", id="cancel-return-apply", color="secondary")
+                ])
+            ]
+        )
     ]
 
 # %% Function to create textbox rows
@@ -418,79 +573,68 @@ def create_text_row(index: int, value="", editable=True, selection=None):
 @app.callback(
     Output("new-entry-modal", "is_open"),
     Output("entry-container", "children", allow_duplicate=True),
-    Output("entry-store", "data", allow_duplicate=True),
     Output("editing", "data", allow_duplicate=True),
     Output("entry-counter", "data"),
     Input("btn-new", "n_clicks"),
-    Input("new-done-button", "n_clicks"),
     State("new-entry-modal", "is_open"),
     prevent_initial_call=True
 )
-def toggle_modal(new_clicks, done_clicks, is_open):
+def toggle_modal(new_clicks, is_open):
     triggered_id = ctx.triggered_id
     if triggered_id == "btn-new":
-        return True, [create_text_row(1)], [{"index": 1, "value": "", "editable": True, "radio": None}], False, 2
-    elif triggered_id == "new-done-button":
-        return False, [], [], False, 1
-    return is_open, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        return True, [create_text_row(1)], False, 2
+    return is_open, dash.no_update, dash.no_update, dash.no_update
 
 
 # %% Create text boxes dynamically in "New" modal
+# Keystrokes are checked in the browser; the server is only asked for a row once the last ID is complete
+app.clientside_callback(
+    """
+    function(values, ids, counter) {
+        if (!values || !values.length) {
+            return window.dash_clientside.no_update;
+        }
+        const last = values[values.length - 1];
+        const seen = ids.some(id => id.index === counter);
+        if (typeof last === "string" && last.length === 8 && !seen) {
+            return counter;
+        }
+        return window.dash_clientside.no_update;
+    }
+    """,
+    Output("entry-row-request", "data"),
+    Input({'type': 'entry-input', 'index': dash.ALL}, 'value'),
+    State({'type': 'entry-input', 'index': dash.ALL}, 'id'),
+    State("entry-counter", "data"),
+    prevent_initial_call=True
+)
+
 @app.callback(
     Output("entry-container", "children", allow_duplicate=True),
-    Output("entry-store", "data", allow_duplicate=True),
     Output("entry-counter", "data", allow_duplicate=True),
-    Input({'type': 'entry-input', 'index': dash.ALL}, 'value'),
-    Input({'type': 'entry-radio', 'index': dash.ALL}, 'value'),
+    Input("entry-row-request", "data"),
     State({'type': 'entry-input', 'index': dash.ALL}, 'id'),
     State("entry-counter", "data"),
     prevent_initial_call=True
 )
-def update_entry_store_and_ui(values, radios, ids, counter):
-    if not values or not ids:
+def append_entry_row(requested_index, ids, counter):
+    if requested_index != counter or any(id_obj['index'] == counter for id_obj in ids):
         raise dash.exceptions.PreventUpdate
 
-    new_data = []
-    new_components = []
-    seen_indices = set()
-
-    for i, id_obj in enumerate(ids):
-        idx = id_obj['index']
-        seen_indices.add(idx)
-        value = values[i] if i < len(values) else ""
-        radio = radios[i] if i < len(radios) else None
-
-        new_data.append({
-            "index": idx,
-            "value": value,
-            "editable": True,
-            "radio": radio
-        })
-
-        new_components.append(create_text_row(idx, value=value, editable=True, selection=radio))
-
-    if isinstance(values[-1], str) and len(values[-1]) == 8 and counter not in seen_indices:
-        new_data.append({
-            "index": counter,
-            "value": "",
-            "editable": True,
-            "radio": None
-        })
-        new_components.append(create_text_row(counter, value="", editable=True))
-        counter += 1
-
-    return new_components, new_data, counter
+    # Append only the new row; existing rows are left untouched in the browser
+    children = Patch()
+    children.append(create_text_row(counter, value="", editable=True))
+    return children, counter + 1
 
 
 # %% Delete row callback
 @app.callback(
     Output("entry-container", "children", allow_duplicate=True),
-    Output("entry-store", "data", allow_duplicate=True),
     Input({'type': 'delete-row', 'index': dash.ALL}, 'n_clicks'),
-    State("entry-store", "data"),
+    State({'type': 'delete-row', 'index': dash.ALL}, 'id'),
     prevent_initial_call=True
 )
-def delete_row(delete_clicks, entry_data):
+def delete_row(delete_clicks, ids):
     if not any(delete_clicks):
         raise dash.exceptions.PreventUpdate
 
@@ -498,13 +642,10 @@ def delete_row(delete_clicks, entry_data):
     if not triggered:
         raise dash.exceptions.PreventUpdate
 
-    delete_index = triggered['index']
-    new_data = [row for row in entry_data if row['index'] != delete_index]
-    new_components = [
-        create_text_row(row['index'], row['value'], editable=True, selection=row['radio'])
-        for row in new_data
-    ]
-    return new_components, new_data
+    # Rows are rendered in the same order as the ids, so remove just that position
+    children = Patch()
+    del children[ids.index(triggered)]
+    return children
 
 
 # %% "Done" button callback for new entries
@@ -515,27 +656,27 @@ def delete_row(delete_clicks, entry_data):
     Output("new-kitid-feedback", "style"),
     Output("new-entry-modal", "is_open", allow_duplicate=True),
     Output("entry-container", "children", allow_duplicate=True),
-    Output("entry-store", "data", allow_duplicate=True),
+    Output("grid-mode", "data", allow_duplicate=True),
     Input("new-done-button", "n_clicks"),
     State("static-kit-id-input", "value"),
-    State("entry-store", "data"),
-    State("entry-container", "children"),
+    State({'type': 'entry-input', 'index': dash.ALL}, 'value'),
+    State({'type': 'entry-radio', 'index': dash.ALL}, 'value'),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def validate_and_build_df(n_clicks, kit_id_value, entry_data, current_components):
-    global database_df
+def validate_and_build_df(n_clicks, kit_id_value, values, radios, session_id):
+    # Entries are read from the inputs once, here, rather than mirrored into a store on every keystroke
+    entry_data = [{"value": value or "", "radio": radio} for value, radio in zip(values, radios)]
 
     # Validate Kit ID
-    if not kit_id_value or not re.fullmatch(r"EC-\d{4}", kit_id_value.strip()):
-        return dash.no_update, dash.no_update, "Invalid Kit ID format. Expected EC-####.", {"color": "red"}, True, current_components, entry_data
+    if not validation.is_valid("kitid", kit_id_value):
+        return dash.no_update, dash.no_update, "Invalid Kit ID format. Expected EC-####.", {"color": "red"}, True, dash.no_update, dash.no_update
 
-    # Validate Sample IDs
-    invalid_samples = [
-        entry["value"] for entry in entry_data
-        if entry.get("value") and not re.fullmatch(r"ECCC\d{4}", entry["value"].strip())
-    ]
+    # Validate Sample IDs (blank rows are skipped below)
+    sampler_values = pd.Series([entry["value"] for entry in entry_data], dtype=object)
+    invalid_samples = sampler_values[validation.validate_column(sampler_values, "samplerid")].tolist()
     if invalid_samples:
-        return dash.no_update, dash.no_update, f"Invalid Sample ID(s): {', '.join(invalid_samples)}. Expected ECCC####.", {"color": "red"}, True, current_components, entry_data
+        return dash.no_update, dash.no_update, f"Invalid Sample ID(s): {', '.join(invalid_samples)}. Expected ECCC####.", {"color": "red"}, True, dash.no_update, dash.no_update
 
     # Proceed with building the DataFrame
     valid_entries = [entry for entry in entry_data if entry.get("value", "").strip() != ""]
@@ -559,76 +700,463 @@ def validate_and_build_df(n_clicks, kit_id_value, entry_data, current_components
         })
 
     database_df = pd.DataFrame(records)
-    return database_df.to_dict("records"), {'display': 'block', 'margin-top': '20px'}, "", {"color": "green"}, False, current_components, entry_data
+    with session_store.lock(session_id):
+        set_session_df(session_id, database_df)
+        set_grid_source(session_id, None)
+        set_loaded_rows(session_id, None)
+    return to_row_data(database_df), {'display': 'block', 'margin-top': '20px'}, "", {"color": "green"}, False, [], "client"
+
+
+# %% Bulk kit import from CSV/Excel
+@app.callback(
+    Output("database-table", "rowData", allow_duplicate=True),
+    Output("btn-upload-data", "style", allow_duplicate=True),
+    Output("edit-confirmation", "children", allow_duplicate=True),
+    Output("kit-file-upload", "contents"),
+    Output("grid-mode", "data", allow_duplicate=True),
+    Input("kit-file-upload", "contents"),
+    State("kit-file-upload", "filename"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def import_kit_file(contents, filename, session_id):
+    if not contents:
+        raise dash.exceptions.PreventUpdate
+
+    try:
+        df, errors = ingest.parse_kit_file(contents, filename)
+    except Exception as e:
+        logging.error(f"Kit import error: {e}")
+        return dash.no_update, dash.no_update, html.Div(f"Error reading '{filename}': {e}", style={"color": "red"}), None, dash.no_update
+
+    if errors:
+        shown = errors[:ingest.MAX_REPORTED_ERRORS]
+        if len(errors) > len(shown):
+            shown.append(f"... and {len(errors) - len(shown)} more.")
+        message = [html.Div(f"'{filename}' was not imported:")] + [html.Div(error) for error in shown]
+        return dash.no_update, dash.no_update, html.Div(message, style={"color": "red"}), None, dash.no_update
+
+    # Show site labels in the grid, as the Update flow does
+    siteid_to_label = reference_cache.get().siteid_to_label
+    df["siteid"] = df["siteid"].map(siteid_to_label).fillna(df["siteid"])
+
+    with session_store.lock(session_id):
+        set_session_df(session_id, df)
+        set_grid_source(session_id, None)
+        set_loaded_rows(session_id, None)
+    message = f"Imported {len(df)} entries from '{filename}'. Review them in the table, then click Upload Data to Database."
+    return to_row_data(df), {'display': 'block', 'margin-top': '20px'}, html.Div(message, style={"color": "green"}), None, "client"
+
+
+# %% Background job settings shared by the upload, overwrite and returned-kit callbacks
+JOB_PROGRESS = [Output("job-progress", "value"), Output("job-progress", "label")]
+JOB_RUNNING = [
+    (Output("btn-upload-data", "disabled"), True, False),
+    (Output("job-progress-container", "style"), JOB_PROGRESS_VISIBLE, JOB_PROGRESS_HIDDEN),
+]
+# Cancelling terminates the job process; its open transaction is rolled back with the connection
+JOB_CANCEL = [Input("btn-cancel-job", "n_clicks")]
+
+
+def tracking_update(kitids, session_id, locations=()):
+    # Reported by jobs through the tracking-updated store once their write has committed. Locations are the shipped
+    # locations the written rows have or had, so tabs showing a location search can tell whether it changed
+    return {
+        "at": time.time(),
+        "kitids": sorted({str(kitid) for kitid in kitids if pd.notna(kitid) and kitid != ""}),
+        "locations": sorted({str(location) for location in locations if pd.notna(location) and location != ""}),
+        "origin": session_id,
+    }
+
+
+# Jobs run in a separate process, so the worker's location cache is refreshed here once a job reports a write,
+# and other tabs showing the written kits are told about it. This tab re-reads the written rows too
+# (refresh_changed_kits), so its next upload compares against what was saved and its new row_version
+@app.callback(
+    Output("kit-refresh", "data", allow_duplicate=True),
+    Input("tracking-updated", "data"),
+    prevent_initial_call=True
+)
+def after_tracking_update(updated):
+    location_cache.invalidate()
+    if not updated or not updated.get("kitids"):
+        raise dash.exceptions.PreventUpdate
+
+    try:
+        kit_event_hub.publish(updated["kitids"], updated["origin"], updated.get("locations"))
+    except Exception as e:
+        logging.error(f"Could not publish kit changes: {e}")
+    return {"kitids": updated["kitids"], "at": updated["at"], "own": True}
+
+
+# %% Returned-kit sheet: diff against pas_tracking by sampleid, then apply only the changed cells
+RETURN_PREVIEW_ROWS = 50
+
+
+def format_return_value(value, col):
+    if col in datetimes.DISPLAY_FORMATS:
+        return datetimes.format_value(value, col)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    return str(value)
+
+
+def build_return_preview(diff, columns):
+    counts = diff["status"].value_counts()
+    changed = diff[diff["status"] == "changed"]
+    missing = diff.loc[diff["status"] == "missing", "sampleid"]
+
+    summary = html.Div([
+        html.Span(f"{counts.get('changed', 0)} changed", style={"color": "green", "marginRight": "15px"}),
+        html.Span(f"{counts.get('unchanged', 0)} unchanged", style={"marginRight": "15px"}),
+        html.Span(f"{counts.get('missing', 0)} not found in database", style={"color": "orange"}),
+    ], className="mb-3")
+
+    rows = []
+    for _, row in changed.head(RETURN_PREVIEW_ROWS).iterrows():
+        cells = [html.Td(row["sampleid"])]
+        for col in columns:
+            if row[f"{col}_changed"]:
+                cells.append(html.Td(f"{format_return_value(row[f'{col}_current'], col)} \u2192 {format_return_value(row[col], col)}", style={"color": "green"}))
+            else:
+                cells.append(html.Td(format_return_value(row[f"{col}_current"], col)))
+        rows.append(html.Tr(cells))
+
+    children = [summary]
+    if rows:
+        children.append(dbc.Table(
+            [html.Thead(html.Tr([html.Th("sampleid")] + [html.Th(col) for col in columns])), html.Tbody(rows)],
+            bordered=True, size="sm", striped=True
+        ))
+        if len(changed) > RETURN_PREVIEW_ROWS:
+            children.append(html.Div(f"... and {len(changed) - RETURN_PREVIEW_ROWS} more changed rows."))
+    if not missing.empty:
+        shown = ", ".join(missing.head(RETURN_PREVIEW_ROWS))
+        children.append(html.Div(f"Not found (skipped): {shown}{' ...' if len(missing) > RETURN_PREVIEW_ROWS else ''}", style={"color": "orange"}))
+    return children
+
+
+@app.callback(
+    Output("return-preview-body", "children"),
+    Output("return-preview-modal", "is_open"),
+    Output("edit-confirmation", "children", allow_duplicate=True),
+    Output("return-file-upload", "contents"),
+    Input("return-file-upload", "contents"),
+    State("return-file-upload", "filename"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def preview_return_file(contents, filename, session_id):
+    if not contents:
+        raise dash.exceptions.PreventUpdate
+
+    try:
+        incoming, columns, errors = ingest.parse_return_file(contents, filename)
+        if errors:
+            shown = errors[:ingest.MAX_REPORTED_ERRORS]
+            if len(errors) > len(shown):
+                shown.append(f"... and {len(errors) - len(shown)} more.")
+            message = [html.Div(f"'{filename}' was not imported:")] + [html.Div(error) for error in shown]
+            return dash.no_update, False, html.Div(message, style={"color": "red"}), None
+
+        current = queries.fetch_by_sampleids(mercury_sql_engine, incoming["sampleid"], columns)
+        diff = ingest.diff_return_sheet(incoming, current, columns)
+    except Exception as e:
+        logging.error(f"Return sheet error: {e}")
+        return dash.no_update, False, html.Div(f"Error reading '{filename}': {e}", style={"color": "red"}), None
+
+    session_store.set(session_id, "return_sheet", {"diff": diff, "columns": columns, "filename": filename})
+    return build_return_preview(diff, columns), True, "", None
+
+
+# The pending sheet is taken out of the session here and released in release_return_sheet, both in the worker: a
+# background job may run in a forked copy of the memory session store, where clearing it would not reach the worker,
+# and the same sheet could be applied twice
+@app.callback(
+    Output("return-apply", "data"),
+    Input("confirm-return-apply", "n_clicks"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def claim_return_sheet(n_clicks, session_id):
+    with session_store.lock(session_id):
+        pending = session_store.get(session_id, "return_sheet")
+        if not n_clicks or pending is None:
+            raise dash.exceptions.PreventUpdate
+        session_store.set(session_id, "return_sheet", None)
+        session_store.set(session_id, "return_sheet_applying", pending)
+    return {"at": time.time()}
+
+
+@app.callback(
+    Output("edit-confirmation", "children", allow_duplicate=True),
+    Output("tracking-updated", "data", allow_duplicate=True),
+    Output("return-applied", "data"),
+    Input("return-apply", "data"),
+    State("session-id", "data"),
+    background=True,
+    progress=JOB_PROGRESS,
+    progress_default=[0, ""],
+    running=JOB_RUNNING + [(Output("return-preview-modal", "is_open"), False, False)],
+    cancel=JOB_CANCEL,
+    prevent_initial_call=True
+)
+def apply_return_sheet(set_progress, claimed, session_id):
+    # Only reads the session: the sheet was claimed by claim_return_sheet
+    pending = session_store.get(session_id, "return_sheet_applying")
+    if not claimed or pending is None:
+        raise dash.exceptions.PreventUpdate
+
+    diff, columns = pending["diff"], pending["columns"]
+    changed = diff[diff["status"] == "changed"]
+    if changed.empty:
+        return html.Div("No changes to apply.", style={"color": "orange"}), dash.no_update, claimed
+
+    # A single UPDATE statement, so progress only moves from start to finish
+    set_progress((0, f"Updating {len(changed)} entries"))
+    try:
+        updated = queries.update_changed_columns(mercury_sql_engine, changed, columns)
+    except Exception as e:
+        logging.error(f"Return sheet update failed: {e}")
+        return html.Div(f"Error applying returned kits: {e}", style={"color": "red"}), dash.no_update, claimed
+
+    message = f"Updated {updated} entries from '{pending['filename']}'."
+    # Sample IDs are "<kitid>_<samplerid>"
+    kitids = changed["sampleid"].astype(str).str.rsplit("_", n=1).str[0]
+    return html.Div(message, style={"color": "green"}), tracking_update(kitids, session_id), claimed
+
+
+@app.callback(
+    Output("return-applied", "data", allow_duplicate=True),
+    Input("return-applied", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def release_return_sheet(applied, session_id):
+    if not applied:
+        raise dash.exceptions.PreventUpdate
+    session_store.set(session_id, "return_sheet_applying", None)
+    return None
+
+
+@app.callback(
+    Output("return-preview-modal", "is_open", allow_duplicate=True),
+    Input("cancel-return-apply", "n_clicks"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def cancel_return_sheet(n, session_id):
+    session_store.set(session_id, "return_sheet", None)
+    return False
 
 
 # %% Update df whenever user edits the datatable
 @app.callback(
     Output("edit-confirmation", "children",allow_duplicate=True),
-    Output("database-table", "rowData"),
+    Output("database-table", "rowTransaction"),
+    Output("location-table-refresh", "data", allow_duplicate=True),
     Input("database-table", "cellValueChanged"),
-    State("database-table", "rowData"),
+    Input("location-table", "cellValueChanged"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def sync_table_edits(cellValueChanged, current_grid_data):
-    global database_df
+def sync_table_edits(clientCellValueChanged, infiniteCellValueChanged, session_id):
+    infinite = ctx.triggered_id == "location-table"
+    cellValueChanged = infiniteCellValueChanged if infinite else clientCellValueChanged
     if not cellValueChanged:
         raise dash.exceptions.PreventUpdate
 
-    changed_col = cellValueChanged[0]['colId']
-    user_friendly_col = headerNames.get(changed_col, changed_col)
-    changed_row_index = cellValueChanged[0]['rowIndex']
-    user_friendly_row = changed_row_index + 1
-    new_value_raw = cellValueChanged[0]['value']
-    old_value = cellValueChanged[0]['oldValue']
+    # Edits are applied as patches to the session dataframe; the browser only sends the changed cells, and only
+    # the rows they touch are read and written
+    rowids = {change['rowId'] if infinite else int(change['rowId']) for change in cellValueChanged}
+    fetched = None
+    if infinite:
+        # The infinite grid is keyed by sampleid and the session dataframe only holds edited rows,
+        # so rows edited for the first time are read from the database (before the session is locked)
+        new_ids = rowids - set(get_session_rows(session_id, rowids).index)
+        if new_ids:
+            fetched = queries.fetch_by_sampleids(mercury_sql_engine, new_ids)
+            fetched = to_grid_frame(fetched).set_index("sampleid", drop=False).rename_axis(None)
+
+    # Overlapping edits of the same session (fast typing, several cells pasted) are applied one after the other
+    with session_store.lock(session_id):
+        database_df = get_session_rows(session_id, rowids)
+        if fetched is not None:
+            # Another edit may have added some of them meanwhile
+            fetched = fetched[~fetched.index.isin(database_df.index)]
+            database_df = fetched[DATABASE_COLUMNS] if database_df.empty else pd.concat([database_df, fetched[DATABASE_COLUMNS]])
+            add_loaded_rows(session_id, fetched)
+
+        feedback_messages = []
+        feedback_style = {"color": "green"}
+        rows_to_refresh = set()
+
+        # Every changed cell is checked against its column's rule in one pass
+        invalid = validation.validate_changes(pd.DataFrame(cellValueChanged, columns=["colId", "value"]))
+
+        for i, change in enumerate(cellValueChanged):
+            changed_col = change['colId']
+            user_friendly_col = headerNames.get(changed_col, changed_col)
+            changed_row_id = change['rowId'] if infinite else int(change['rowId'])
+            user_friendly_row = change['rowIndex'] + 1
+            new_value_raw = change['value']
+            old_value = change['oldValue']
+
+            if changed_row_id not in database_df.index or changed_col not in database_df.columns:
+                continue
+            if database_df[changed_col].dtype != object:
+                database_df[changed_col] = database_df[changed_col].astype(object)
+
+            # Update the value in the session data first
+            if invalid[i]:
+                # Send the previous value back to the grid
+                database_df.at[changed_row_id, changed_col] = old_value if old_value is not None else ""
+                rows_to_refresh.add(changed_row_id)
+                feedback_messages.append(f"Invalid {user_friendly_col} at Row {user_friendly_row}. {validation.RULES[changed_col].hint}")
+                feedback_style = {"color": "red"}
+                continue
+            if changed_col in ['sample_start', 'sample_end'] and not new_value_raw:
+                database_df.at[changed_row_id, changed_col] = "" # Keep as empty string if user clears it in UI
+                feedback_messages.append(f"{user_friendly_col} at Row {user_friendly_row}, value cleared.")
+            else:
+                database_df.at[changed_row_id, changed_col] = new_value_raw
+                feedback_messages.append(f"{user_friendly_col} at Row {user_friendly_row}, changed from '{old_value}' to '{new_value_raw}'.")
+
+            edit_journal.record(session_id, changed_row_id, changed_col, old_value, new_value_raw)
+
+            # After updating the changed cell, check if sampleid needs to be updated
+            if changed_col in ['kitid', 'samplerid']:
+                row = database_df.loc[changed_row_id]
+                current_kitid = row.get('kitid') if row.get('kitid') is not None else ""
+                current_samplerid = row.get('samplerid') if row.get('samplerid') is not None else ""
+
+                # Construct the new sampleid
+                new_sampleid = f"{current_kitid}_{current_samplerid}"
+
+                # Only update if the sampleid actually changes to avoid unnecessary re-renders
+                if row.get('sampleid') != new_sampleid:
+                    database_df.at[changed_row_id, 'sampleid'] = new_sampleid
+                    rows_to_refresh.add(changed_row_id)
+                    # Also update feedback message to indicate sampleid was updated
+                    feedback_messages[-1] += f" Sample ID updated to '{new_sampleid}'."
+
+        update_session_rows(session_id, database_df)
+
+    # Only rows whose values differ from what the grid shows are sent back. The infinite grid has no
+    # client-side row store, so it re-requests its cached blocks instead
+    if not rows_to_refresh:
+        row_transaction, refresh = dash.no_update, dash.no_update
+    elif infinite:
+        row_transaction, refresh = dash.no_update, {"purge": False, "at": time.time()}
+    else:
+        row_transaction, refresh = {"update": to_row_data(database_df.loc[sorted(rows_to_refresh)])}, dash.no_update
 
-    updated_grid_data = list(current_grid_data)
+    return html.Div(" ".join(feedback_messages), style=feedback_style), row_transaction, refresh
 
-    feedback_message = ""
-    feedback_style = {"color": "green"}
 
-    # Update the value in the grid data first
-    if changed_col in ['sample_start', 'sample_end']:
-        if new_value_raw:
-            strict_dt_regex = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$"
+# %% Live updates: kits written from another tab are refreshed in this tab's grid
+# Events for kits this grid does not show stay in the browser. kit-events holds {events: [...]}: one event when pushed,
+# all those received since the last poll when polled. The infinite grid keeps no rows in the browser, so its events
+# go to the server, which checks them against the searched location
+app.clientside_callback(
+    """
+    function(update, rowData, gridMode, sessionId) {
+        if (!update) {
+            return window.dash_clientside.no_update;
+        }
+        const events = update.events.filter(event => event.origin !== sessionId);
+        if (gridMode === "infinite") {
+            if (!events.length) {
+                return window.dash_clientside.no_update;
+            }
+            return {
+                kitids: [...new Set(events.flatMap(event => event.kitids))],
+                locations: [...new Set(events.flatMap(event => event.locations || []))],
+                at: Date.now()
+            };
+        }
+        if (!rowData || !rowData.length) {
+            return window.dash_clientside.no_update;
+        }
+        const changed = new Set(events.flatMap(event => event.kitids));
+        const shown = [...new Set(rowData.map(row => row.kitid).filter(kitid => changed.has(kitid)))];
+        if (!shown.length) {
+            return window.dash_clientside.no_update;
+        }
+        return {kitids: shown, at: Date.now()};
+    }
+    """,
+    Output("kit-refresh", "data"),
+    Input("kit-events", "data"),
+    State("database-table", "rowData"),
+    State("grid-mode", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
 
-            if not re.fullmatch(strict_dt_regex, str(new_value_raw)):
-                updated_grid_data[changed_row_index][changed_col] = old_value if old_value is not None else ""
-                feedback_message = f"Invalid datetime format for {user_friendly_col} at Row {user_friendly_row}. Expected format: YYYY-MM-DD HH:MM."
-                feedback_style = {"color": "red"}
-            else:
-                updated_grid_data[changed_row_index][changed_col] = new_value_raw
-                feedback_message = f"{user_friendly_col} at Row {user_friendly_row}, changed from '{old_value}' to '{new_value_raw}'."
-                feedback_style = {"color": "green"}
-        else:
-            updated_grid_data[changed_row_index][changed_col] = "" # Keep as empty string if user clears it in UI
-            feedback_message = f"{user_friendly_col} at Row {user_friendly_row}, value cleared."
-            feedback_style = {"color": "green"}
-    else:
-        updated_grid_data[changed_row_index][changed_col] = new_value_raw
-        feedback_message = f"{user_friendly_col} at Row {user_friendly_row}, changed from '{old_value}' to '{new_value_raw}'."
-        feedback_style = {"color": "green"}
+@app.callback(
+    Output("database-table", "rowTransaction", allow_duplicate=True),
+    Output("location-table-refresh", "data", allow_duplicate=True),
+    Output("edit-confirmation", "children", allow_duplicate=True),
+    Input("kit-refresh", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def refresh_changed_kits(refresh, session_id):
+    if not refresh:
+        raise dash.exceptions.PreventUpdate
 
-    # After updating the changed cell, check if sampleid needs to be updated
-    if changed_col in ['kitid', 'samplerid']:
-        row = updated_grid_data[changed_row_index]
-        current_kitid = row.get('kitid') if row.get('kitid') is not None else ""
-        current_samplerid = row.get('samplerid') if row.get('samplerid') is not None else ""
-        
-        # Construct the new sampleid
-        new_sampleid = f"{current_kitid}_{current_samplerid}"
-        
-        # Only update if the sampleid actually changes to avoid unnecessary re-renders
-        if row.get('sampleid') != new_sampleid:
-            updated_grid_data[changed_row_index]['sampleid'] = new_sampleid
-            # Also update feedback message to indicate sampleid was updated
-            feedback_message += f" Sample ID updated to '{new_sampleid}'."
+    try:
+        fresh = to_grid_frame(queries.fetch_by_kitids(mercury_sql_engine, refresh["kitids"]))
+    except Exception as e:
+        logging.error(f"Error refreshing changed kits: {e}")
+        return dash.no_update, dash.no_update, html.Div(f"Kits {', '.join(refresh['kitids'])} were changed elsewhere but could not be reloaded: {e}", style={"color": "red"})
+
+    # The merge runs under the session lock, so edits made meanwhile are not overwritten
+    with session_store.lock(session_id):
+        database_df = get_session_df(session_id)
+        # The infinite grid's session dataframe only holds the rows edited in it, keyed by sampleid. Another
+        # session's change reloads its blocks when it concerns the searched location: rows may have been added to
+        # it, changed or moved out of it
+        grid_source = get_grid_source(session_id)
+        infinite = grid_source is not None
+        reload = infinite and not refresh.get("own") and ingest.touches_location(fresh, grid_source["location"], refresh.get("locations"))
+        if database_df.empty and not reload:
+            raise dash.exceptions.PreventUpdate
+
+        # After this tab's own upload only the rows it shows are refreshed
+        refreshed, added, loaded, kept, conflicts = ingest.merge_refreshed_rows(
+            database_df, get_loaded_rows(session_id), fresh, own=bool(refresh.get("own")),
+            add_new=not (infinite or refresh.get("own"))
+        )
+        add_loaded_rows(session_id, loaded)
 
+        # Raised once the lock is released, so the loaded rows above are kept
+        unchanged = refreshed.empty and added.empty and not conflicts
+        if not unchanged:
+            update_session_rows(session_id, pd.concat([refreshed, added]).astype(object))
 
-    database_df = pd.DataFrame(updated_grid_data)
-    database_df.to_csv("debug_database_df.csv",index =False)
+    if unchanged and not reload:
+        raise dash.exceptions.PreventUpdate
 
-    return html.Div(feedback_message, style=feedback_style), updated_grid_data
+    if refresh.get("own"):
+        message = f"{len(refreshed)} rows were refreshed from the database."
+    elif infinite:
+        message = f"Kits at {grid_source['location']} were changed in another session: the table was reloaded."
+    else:
+        message = f"Kit {', '.join(refresh['kitids'])} was changed in another session: {len(refreshed)} rows refreshed, {len(added)} added."
+    if kept:
+        message += f" {kept} cells edited here were kept."
+    if conflicts:
+        message += f" {conflicts} of them were also changed there; uploading will report the conflict."
+    if reload:
+        # The location's row count may have changed, so the blocks are dropped rather than re-requested
+        return dash.no_update, {"purge": True, "at": time.time()}, html.Div(message, style={"color": "orange"})
+    if refreshed.empty and added.empty:
+        return dash.no_update, dash.no_update, html.Div(message, style={"color": "orange"})
+    if infinite:
+        return dash.no_update, {"purge": False, "at": time.time()}, html.Div(message, style={"color": "orange"})
+    return {"update": to_row_data(refreshed), "add": to_row_data(added)}, dash.no_update, html.Div(message, style={"color": "orange"})
 
 
 # %% Grab user email from headers
@@ -639,16 +1167,12 @@ def sync_table_edits(cellValueChanged, current_grid_data):
     Input('user', 'id')
 )
 def display_headers(_):
-    if request_headers.get('Dh-User'):
+    # Read from the current request, so concurrent users never see each other's headers
+    if request.headers.get('Dh-User'):
         return [request.headers.get('Dh-User'), True, {'display': 'none'}]
     else:
         return [None, False, {'display': 'none'}]
 
-@app.server.before_request
-def before_request():
-    global request_headers
-    request_headers = dict(request.headers)  # Capture headers before processing any request
-
 
 # %% javascript used to autofocus newly created textboxes in "New" modal
 app.clientside_callback(
@@ -665,7 +1189,7 @@ app.clientside_callback(
                 }
             }, 100);
         });
-        return children;
+        return window.dash_clientside.no_update;
     }
     """,
     Output("entry-container", "children", allow_duplicate=True),
@@ -673,128 +1197,149 @@ app.clientside_callback(
     prevent_initial_call=True
 )
 
+# %% Prepare the grid data for upload (drop empty rows, normalize datetimes, map site labels to siteid)
+def prepare_upload(df):
+    siteid_map = reference_cache.get().label_to_siteid
+
+    df_to_upload = df[df['samplerid'].astype(str).str.strip() != ''].copy()
+    df_to_upload = df_to_upload.where(df_to_upload != '', None)
+
+    # Native timestamps all the way to the driver; the grid strings are parsed once, here
+    datetimes.normalize_datetimes(df_to_upload)
+
+    df_to_upload['siteid'] = df_to_upload['siteid'].map(siteid_map).fillna(df_to_upload['siteid']) # change column to only contain siteid
+    return df_to_upload
+
+# Columns compared with the loaded rows to find the edited cells, key columns included
+def upload_columns(df_to_upload):
+    return [col for col in DATABASE_COLUMNS if col in df_to_upload.columns]
+
+
+def read_upload(session_id):
+    # The session's rows prepared for upload and its loaded rows, read together so an edit landing in between
+    # cannot pair one with the other's previous state
+    with session_store.lock(session_id):
+        df, loaded = get_session_df(session_id), get_loaded_rows(session_id)
+    return prepare_upload(df), prepare_upload(loaded)
+
+
+def split_upload(df_to_upload, loaded):
+    # (rows not read from pas_tracking, to insert or overwrite; loaded rows with edited cells, flagged per column)
+    diff = ingest.diff_edited_rows(df_to_upload, loaded, upload_columns(df_to_upload))
+    return diff[diff["status"] == "new"], diff[diff["status"] == "changed"]
+
 # %% Upload Data button with duplicates checking
 @app.callback(
     Output("edit-confirmation", "children", allow_duplicate=True),
     Output("overwrite-confirm-modal", "is_open"),
     Output("duplicate-rows", "data"),
+    Output("tracking-updated", "data", allow_duplicate=True),
     Input("btn-upload-data", "n_clicks"),
+    State("session-id", "data"),
+    background=True,
+    progress=JOB_PROGRESS,
+    progress_default=[0, ""],
+    running=JOB_RUNNING,
+    cancel=JOB_CANCEL,
     prevent_initial_call=True
 )
-def upload_data_to_database(n_clicks):
-    global database_df 
-
+def upload_data_to_database(set_progress, n_clicks, session_id):
     if n_clicks is None:
         raise dash.exceptions.PreventUpdate
     
-    
-    siteid_map = {
-        f"{row.description} ({row.siteid})": row.siteid
-        for _, row in sites.query("projectid == 'MERCURY_PASSIVE'").iterrows()
-    }
-
-    
     # Check if table is empty
-    df_to_upload = database_df[database_df['samplerid'].astype(str).str.strip() != ''].copy()
+    df_to_upload, loaded = read_upload(session_id)
     if df_to_upload.empty:
-        return html.Div("No valid data to upload. All entries are empty or have empty Sampler IDs.", style={"color": "orange"}), False, []
-    
-    # Convert columns to datetime
-    for col in ['sample_start', 'sample_end', 'shipped_date', 'return_date']:
-        df_to_upload[col] = pd.to_datetime(df_to_upload[col], errors='coerce')
-
-        # Convert any timezone-aware datetimes to naive
-        if pd.api.types.is_datetime64tz_dtype(df_to_upload[col]):
-            df_to_upload[col] = df_to_upload[col].dt.tz_convert(None)
-    
-        # Drop tzinfo even from objects that were naive-but-strange
-        df_to_upload[col] = df_to_upload[col].dt.tz_localize(None)
-    
-        # Format to ensure no millisecond or tzinfo remnants
-        df_to_upload[col] = df_to_upload[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        return html.Div("No valid data to upload. All entries are empty or have empty Sampler IDs.", style={"color": "orange"}), False, [], dash.no_update
         
     # Upload
     try:
-        existing_sampleids_df = pd.read_sql_query("SELECT sampleid FROM pas_tracking", mercury_sql_engine)
-        existing_sampleids = set(existing_sampleids_df['sampleid'].dropna().astype(str).tolist())
+        new_rows, edited = split_upload(df_to_upload, loaded)
+        if new_rows.empty and edited.empty:
+            return html.Div("No changes to upload.", style={"color": "orange"}), False, [], dash.no_update
 
-        df_to_upload_sampleids = df_to_upload['sampleid'].astype(str)
-        duplicate_mask = df_to_upload_sampleids.isin(existing_sampleids)
+        existing_sampleids = queries.fetch_existing_sampleids(mercury_sql_engine, new_rows['sampleid'])
+        duplicate_mask = new_rows['sampleid'].astype(str).isin(existing_sampleids)
 
-        if duplicate_mask.any():
-            duplicate_df = df_to_upload[duplicate_mask].copy()
-            return dash.no_update, True, duplicate_df.to_dict("records")
+        # Existing entries are only written once confirmed: edited rows and new rows whose Sample ID already exists
+        if duplicate_mask.any() or not edited.empty:
+            duplicate_df = pd.concat([edited[df_to_upload.columns], new_rows.loc[duplicate_mask, df_to_upload.columns]])
+            return dash.no_update, True, duplicate_df.to_dict("records"), dash.no_update
         
-        df_to_upload['siteid'] = df_to_upload['siteid'].map(siteid_map).fillna(df_to_upload['siteid']) # change column to only contain siteid
-        df_to_upload.to_sql('pas_tracking', mercury_sql_engine, if_exists='append', index=False)
-        return html.Div(f"Successfully uploaded {len(df_to_upload)} new entries to 'pas_tracking' table!", style={"color": "green"}), False, []
+        inserted, updated = queries.upsert_tracking_rows(
+            mercury_sql_engine, new_rows[df_to_upload.columns], progress=progress_reporter(set_progress, "Uploading")
+        )
+        message = html.Div(f"Successfully uploaded {inserted} new entries to 'pas_tracking' table!", style={"color": "green"})
+        return message, False, [], tracking_update(new_rows["kitid"], session_id, new_rows["shipped_location"])
 
     except Exception as e:
         logging.error(f"Database upload error: {e}")
-        return html.Div(f"Error uploading data: {e}.", style={"color": "red"}), False, []
+        return html.Div(f"Error uploading data: {e}.", style={"color": "red"}), False, [], dash.no_update
     
 # %% Update button callback
 @app.callback(
     Output("update-kitid-modal", "is_open", allow_duplicate=True),
-    Output("database-store", "data"),
     Output("db-loading-output", "children"),
     Input("btn-update", "n_clicks"),
     Input("update-done-button", "n_clicks"),
     State("update-kitid-modal", "is_open"),
-    State("database-store", "data"),
     prevent_initial_call=True
 )
-def toggle_update_modal(open_clicks, done_clicks, is_open, db_tracking_data):
+def toggle_update_modal(open_clicks, done_clicks, is_open):
     triggered = ctx.triggered_id
 
     if triggered == "btn-update":
-        # Show loading while querying database
-        try:
-            db_df = pd.read_sql_query("SELECT * FROM pas_tracking", mercury_sql_engine)
-            for col in ["sample_start", "sample_end"]:
-                if col in db_df.columns:
-                    db_df[col] = pd.to_datetime(db_df[col], errors='coerce').dt.strftime("%Y-%m-%d %H:%M:%S")
-            loading_msg = ""  # Hide loading spinner
-        except Exception as e:
-            logging.error(f"Error loading pas_tracking table: {e}")
-            db_df = pd.DataFrame()
-            loading_msg = ""  # Hide loading even on error
-
-        return True, db_df.to_dict("records"), loading_msg
+        return True, ""
 
     elif triggered == "update-done-button":
-        return False, db_tracking_data, ""  # Closing modal, no DB call = no spinner
+        return False, ""
 
-    return is_open, db_tracking_data, ""
+    return is_open, ""
 
 # %% Confirm overwrite
 @app.callback(
     Output("edit-confirmation", "children",allow_duplicate=True),
-    Output("overwrite-confirm-modal", "is_open",allow_duplicate=True),
+    Output("tracking-updated", "data", allow_duplicate=True),
     Input("confirm-overwrite", "n_clicks"),
     State("duplicate-rows", "data"),
+    State("session-id", "data"),
+    background=True,
+    progress=JOB_PROGRESS,
+    progress_default=[0, ""],
+    # The modal closes as soon as the job starts, so the progress bar is visible
+    running=JOB_RUNNING + [(Output("overwrite-confirm-modal", "is_open"), False, False)],
+    cancel=JOB_CANCEL,
     prevent_initial_call=True
 )
-def confirm_overwrite(n_clicks, duplicates_data):
+def confirm_overwrite(set_progress, n_clicks, duplicates_data, session_id):
     if not duplicates_data:
         raise dash.exceptions.PreventUpdate
 
     try:
-        df_overwrite = pd.DataFrame(duplicates_data)
-        df_overwrite.replace('', np.nan, inplace=True)
-
-        with mercury_sql_engine.begin() as conn:
-            sampleids = df_overwrite['sampleid'].dropna().tolist()
-            for sid in sampleids:
-                conn.execute(text("DELETE FROM pas_tracking WHERE sampleid = :sid"), {"sid": sid})
+        # Only the edited cells of loaded rows are written; other rows are inserted or overwritten. All or nothing
+        df_overwrite, loaded = read_upload(session_id)
+        new_rows, edited = split_upload(df_overwrite, loaded)
+        inserted, overwritten, updated = queries.save_tracking_changes(
+            mercury_sql_engine, new_rows[df_overwrite.columns], edited, upload_columns(df_overwrite),
+            progress=progress_reporter(set_progress, "Uploading")
+        )
 
-        df_overwrite.to_sql('pas_tracking', mercury_sql_engine, if_exists='append', index=False)
+        message = html.Div(f"Successfully updated {updated} edited entries, overwrote {overwritten} entries and uploaded {inserted} new entries.", style={"color": "green"})
+        # Kits that rows were moved out of changed too; sample IDs are "<kitid>_<samplerid>"
+        loaded_kitids = edited["loaded_sampleid"].astype(str).str.rsplit("_", n=1).str[0]
+        # and so did the locations they were moved out of
+        locations = pd.concat([new_rows["shipped_location"], edited["shipped_location"], loaded["shipped_location"].reindex(edited.index)])
+        return message, tracking_update(pd.concat([new_rows["kitid"], edited["kitid"], loaded_kitids]), session_id, locations)
 
-        return html.Div(f"Successfully overwrote {len(df_overwrite)} entries.", style={"color": "green"}), False
+    except queries.StaleRowsError as e:
+        shown = ", ".join(e.sampleids[:ingest.MAX_REPORTED_ERRORS])
+        more = f" and {len(e.sampleids) - ingest.MAX_REPORTED_ERRORS} more" if len(e.sampleids) > ingest.MAX_REPORTED_ERRORS else ""
+        message = f"Nothing was saved: {e} ({shown}{more}). Search the kit again with Update and re-apply your edits."
+        return html.Div(message, style={"color": "red"}), dash.no_update
 
     except Exception as e:
         logging.error(f"Overwrite failed: {e}")
-        return html.Div(f"Error overwriting: {e}", style={"color": "red"}), False
+        return html.Div(f"Error overwriting: {e}", style={"color": "red"}), dash.no_update
 
 # %% Cancel overwrite
 @app.callback(
@@ -813,65 +1358,70 @@ def cancel_overwrite(n):
     Output("database-table", "rowData", allow_duplicate=True),
     Output("kitid-filtered-data", "data"),
     Output("btn-upload-data", "style", allow_duplicate=True),
+    Output("grid-mode", "data", allow_duplicate=True),
+    Output("location-table-refresh", "data", allow_duplicate=True),
     Input("update-done-button", "n_clicks"),
     State("update-kitid-textinput", "value"),
     State("update-kitid-dropdown", "value"),
-    State("database-store", "data"),
     State("update-search-mode", "value"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def validate_and_display_kitid(n_clicks, text_value, dropdown_value, db_tracking_data, search_mode):
+def validate_and_display_kitid(n_clicks, text_value, dropdown_value, search_mode, session_id):
     entered_id = dropdown_value if search_mode == "location" else text_value
-    
-    db_tracking_data = pd.DataFrame(db_tracking_data)
-    
-    # Kit ID search logic
-    if search_mode == "kit":
-        if not re.fullmatch(r"EC-\d{4}", entered_id.strip()):
-            return "Invalid Kit ID", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update
-        filtered_df = db_tracking_data[db_tracking_data['kitid'] == entered_id]
-    #Location search logic
-    elif search_mode == "location":
-        if not entered_id.strip():
-            return "Shipped Location cannot be empty.", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update
-    
-        matches = db_tracking_data[
-            db_tracking_data["shipped_location"].str.strip().str.lower() == entered_id.strip().lower()
-        ].copy()
-    
-        if matches.empty:
-            return f"No entries found for shipped location '{entered_id}'.", {"color": "orange"}, True, dash.no_update, dash.no_update, dash.no_update
-    
-        filtered_df = matches
-    # Sampler ID search logic 
-    else:
-        if not re.fullmatch(r"ECCC\d{4}", entered_id.strip()):
-            return "Invalid Sampler ID", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update
-    
-        matches = db_tracking_data[db_tracking_data['samplerid'] == entered_id].copy()
-    
-        if matches.empty:
-            return "No entries found for this Sampler ID.", {"color": "orange"}, True, dash.no_update, dash.no_update, dash.no_update
-    
-        # Most recent sample_start (fallback to index if missing)
-        if "sample_start" in matches.columns:
-            matches["sample_start"] = pd.to_datetime(matches["sample_start"], errors="coerce")
-            matches = matches.sort_values("sample_start", ascending=False)
-        
-        recent_kitid = matches["kitid"].dropna().iloc[0]
-        filtered_df = db_tracking_data[db_tracking_data["kitid"] == recent_kitid]
+
+    try:
+        # Kit ID search logic
+        if search_mode == "kit":
+            if not validation.is_valid("kitid", entered_id):
+                return "Invalid Kit ID", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+            filtered_df = queries.fetch_by_kitid(mercury_sql_engine, entered_id)
+        #Location search logic
+        elif search_mode == "location":
+            if not entered_id.strip():
+                return "Shipped Location cannot be empty.", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+            total = queries.count_by_location(mercury_sql_engine, entered_id)
+
+            if total == 0:
+                return f"No entries found for shipped location '{entered_id}'.", {"color": "orange"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+            if total > INFINITE_ROW_THRESHOLD:
+                # Too many rows to send at once: the infinite grid requests them block by block
+                # (serve_location_block). The session dataframe then only holds the rows edited in the grid
+                with session_store.lock(session_id):
+                    set_grid_source(session_id, {"location": entered_id})
+                    set_session_df(session_id, pd.DataFrame(columns=DATABASE_COLUMNS))
+                    set_loaded_rows(session_id, None)
+                return "", {}, False, [], None, {"display": "block", "margin-top": "20px"}, "infinite", {"purge": True, "at": time.time()}
+
+            filtered_df = queries.fetch_by_location(mercury_sql_engine, entered_id)
+        # Sampler ID search logic
+        else:
+            if not validation.is_valid("samplerid", entered_id):
+                return "Invalid Sampler ID", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+            # Rows of the most recent kit (by sample_start) containing this sampler
+            filtered_df = queries.fetch_latest_kit_for_samplerid(mercury_sql_engine, entered_id)
+
+            if filtered_df.empty:
+                return "No entries found for this Sampler ID.", {"color": "orange"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    except Exception as e:
+        logging.error(f"Error searching pas_tracking: {e}")
+        return f"Error searching database: {e}", {"color": "red"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
     if filtered_df.empty:
-        return "No entries found for this Kit ID.", {"color": "orange"}, True, dash.no_update, dash.no_update, dash.no_update
-    
-    # Update global dataframe
-    filtered_df["sample_start"] = filtered_df["sample_start"].str.slice(stop=16)
-    filtered_df["sample_end"] = filtered_df["sample_end"].str.slice(stop=16)
-    filtered_df["siteid"] = [site_clean for x in filtered_df["siteid"] for site_clean in sites_clean if x in site_clean]
-    global database_df
-    database_df = filtered_df
+        return "No entries found for this Kit ID.", {"color": "orange"}, True, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
-    return "", {}, False, database_df.to_dict("records"), filtered_df.to_dict("records"),{"display": "block", "margin-top": "20px"}
+    # Update session dataframe, and keep the rows as loaded to find the edited cells on upload
+    loaded = to_grid_frame(filtered_df)
+    database_df = loaded.drop(columns="row_version")
+    with session_store.lock(session_id):
+        set_session_df(session_id, database_df)
+        set_grid_source(session_id, None)
+        set_loaded_rows(session_id, loaded)
+
+    return "", {}, False, to_row_data(database_df), filtered_df.to_dict("records"),{"display": "block", "margin-top": "20px"}, "client", dash.no_update
 
 
 
@@ -881,18 +1431,20 @@ def validate_and_display_kitid(n_clicks, text_value, dropdown_value, db_tracking
     Output("update-kitid-dropdown", "style"),
     Output("update-kitid-textinput", "placeholder"),
     Output("update-kitid-dropdown", "options"),
-    Input("update-search-mode", "value"),
-    State("database-store", "data")
+    Input("update-search-mode", "value")
 )
-def toggle_update_input(search_mode, db_data):
+def toggle_update_input(search_mode):
     show_text = {'width': '150px', 'margin': '0 auto', 'display': 'block'}
     hide_text = {'width': '150px', 'margin': '0 auto', 'display': 'none'}
     show_dropdown = {'width': '250px', 'margin': '0 auto', 'display': 'block'}
     hide_dropdown = {'width': '250px', 'margin': '0 auto', 'display': 'none'}
 
     if search_mode == "location":
-        db_df = pd.DataFrame(db_data)
-        locations = sorted(db_df["shipped_location"].dropna().unique().tolist())
+        try:
+            locations = location_cache.search("", limit=LOCATION_OPTIONS_LIMIT)
+        except Exception as e:
+            logging.error(f"Error loading shipped locations: {e}")
+            locations = []
         return hide_text, show_dropdown, dash.no_update, [{"label": loc, "value": loc} for loc in locations]
 
     elif search_mode == "sampler":
@@ -901,30 +1453,117 @@ def toggle_update_input(search_mode, db_data):
     # default to Kit ID
     return show_text, hide_dropdown, "EC-XXXX", []
 
-# %% Callback to trigger download of most recent database contents
+# %% Server-side typeahead for the Shipped Location dropdown
+@app.callback(
+    Output("update-kitid-dropdown", "options", allow_duplicate=True),
+    Input("update-kitid-dropdown", "search_value"),
+    State("update-kitid-dropdown", "value"),
+    prevent_initial_call=True
+)
+def search_shipped_locations(search_value, current_value):
+    if not search_value:
+        raise dash.exceptions.PreventUpdate
+
+    try:
+        locations = location_cache.search(search_value, limit=LOCATION_OPTIONS_LIMIT)
+    except Exception as e:
+        logging.error(f"Error searching shipped locations: {e}")
+        raise dash.exceptions.PreventUpdate
+
+    # Keep the current selection available so the dropdown doesn't clear it
+    if current_value and current_value not in locations:
+        locations = [current_value] + locations
+    return [{"label": loc, "value": loc} for loc in locations]
+
+# %% Infinite grid for large location searches
+@app.callback(
+    Output("database-table-container", "style"),
+    Output("location-table-container", "style"),
+    Input("grid-mode", "data")
+)
+def switch_grid(grid_mode):
+    if grid_mode == "infinite":
+        return GRID_CONTAINER_HIDDEN, GRID_CONTAINER_VISIBLE
+    return GRID_CONTAINER_VISIBLE, GRID_CONTAINER_HIDDEN
+
+
+# Drop the cached blocks after a new search (purge) or re-request them after edits were reverted (refresh)
+app.clientside_callback(
+    """
+    function(refresh) {
+        const api = dash_ag_grid.getApi("location-table");
+        if (refresh && api) {
+            refresh.purge ? api.purgeInfiniteCache() : api.refreshInfiniteCache();
+        }
+    }
+    """,
+    Input("location-table-refresh", "data"),
+    prevent_initial_call=True
+)
+
+
 @app.callback(
-    Output("download-db-csv", "data"),
-    Input("btn-download-db", "n_clicks"),
+    Output("location-table", "getRowsResponse"),
+    Input("location-table", "getRowsRequest"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def download_db_csv(n_clicks):
+def serve_location_block(rows_request, session_id):
+    grid_source = get_grid_source(session_id)
+    if not rows_request or not grid_source:
+        raise dash.exceptions.PreventUpdate
+
+    start_row = rows_request.get("startRow", 0)
     try:
-        db_df = pd.read_sql_query("SELECT * FROM pas_tracking", mercury_sql_engine)
-        for col in ["sample_start", "sample_end"]:
-            if col in db_df.columns:
-                db_df[col] = pd.to_datetime(db_df[col], errors='coerce').dt.strftime("%Y-%m-%d %H:%M:%S")
-        now_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"pas_tracking_{now_str}.csv"
-        return dcc.send_data_frame(db_df.to_csv, filename=filename, index=False)
+        block, total = queries.fetch_location_block(
+            mercury_sql_engine,
+            grid_source["location"],
+            start_row,
+            rows_request.get("endRow", start_row + GRID_BLOCK_ROWS),
+            rows_request.get("sortModel"),
+            rows_request.get("filterModel"),
+        )
     except Exception as e:
-        logging.error(f"Error exporting pas_tracking to CSV: {e}")
-        return dash.no_update
+        logging.error(f"Error loading location block: {e}")
+        return {"rowData": [], "rowCount": start_row}
+
+    # Rows are keyed by sampleid; rows already edited in this session show their pending values
+    block = to_grid_frame(block).set_index("sampleid", drop=False).rename_axis(None)[DATABASE_COLUMNS]
+    edited = get_session_rows(session_id, block.index)
+    overlap = block.index.intersection(edited.index)
+    if len(overlap):
+        block = block.astype(object)
+        block.loc[overlap] = edited.loc[overlap, DATABASE_COLUMNS].to_numpy()
+
+    return {"rowData": to_row_data(block), "rowCount": total if total is not None else start_row}
+
 
+# %% Streaming export of the database contents (see export.py)
+register_export_route(app.server, mercury_sql_engine, app.config.routes_pathname_prefix)
+
+
+# %% Server-sent events for live kit updates (see kit_events.py)
+register_events_route(app.server, kit_event_hub, app.config.routes_pathname_prefix)
+
+# %% Prometheus metrics (see metrics.py). Registered last so every callback above is timed
+metrics.instrument_callbacks(app)
+metrics.instrument_engine(dcp_sql_engine, pool_stats)
+metrics.instrument_engine(mercury_sql_engine, pool_stats)
+metrics.register_stats("reference_cache", reference_cache.stats)
+metrics.register_stats("location_cache", location_cache.stats)
+metrics.register_stats("session_store", session_store.stats)
+metrics.register_stats("secret_cache", get_secret_provider(local).stats)
+metrics.register_stats("kit_events", kit_event_hub.stats)
+metrics.register_metrics_route(app.server, app.config.routes_pathname_prefix)
 
 
 # %% Run app
 app.layout = serve_layout
 
+BOOT_SECONDS = time.perf_counter() - BOOT_STARTED
+metrics.register_stats("worker", lambda: {"boot_seconds": BOOT_SECONDS})
+logging.info(f"Worker {os.getpid()} booted in {BOOT_SECONDS:.2f}s")
+
 if not local:
     server = app.server
 else:
@@ -0,0 +1,64 @@
+// assets/kitEvents.js
+// Kits written by other tabs are pushed over server-sent events (see kit_events.py) into the "kit-events" store.
+// The browser sends no requests while nothing changes. When the server has no stream to spare (it answers 204)
+// or the browser has no EventSource, the tab polls events/recent instead
+(function () {
+  const POLL_MS = 15000;
+  const config = JSON.parse(document.getElementById("_dash-config").textContent);
+  const prefix = config.requests_pathname_prefix;
+
+  function publish(events) {
+    // The store only exists once the desktop layout is rendered
+    try {
+      window.dash_clientside.set_props("kit-events", { data: { events: events } });
+    } catch (err) {
+      console.debug("kit event ignored", err);
+    }
+  }
+
+  function poll() {
+    // The first answer only gives the server time to ask from; later ones the events received since
+    let since = null;
+    let timer = null;
+    function check() {
+      fetch(prefix + "events/recent" + (since === null ? "" : "?since=" + since), { cache: "no-store" })
+        .then(function (response) {
+          if (response.status === 204) {
+            // Live updates are off
+            clearInterval(timer);
+            return null;
+          }
+          return response.ok ? response.json() : null;
+        })
+        .then(function (body) {
+          if (!body) {
+            return;
+          }
+          since = body.now;
+          if (body.events.length) {
+            publish(body.events);
+          }
+        })
+        .catch(function (err) {
+          console.debug("kit event poll failed", err);
+        });
+    }
+    check();
+    timer = setInterval(check, POLL_MS);
+  }
+
+  if (!window.EventSource) {
+    poll();
+    return;
+  }
+  const source = new EventSource(prefix + "events");
+  source.onmessage = function (e) {
+    publish([JSON.parse(e.data)]);
+  };
+  source.onerror = function () {
+    // A dropped stream reconnects by itself (CONNECTING); a 204 or an HTTP error closes it for good
+    if (source.readyState === EventSource.CLOSED) {
+      poll();
+    }
+  };
+})();
@@ -0,0 +1,282 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Callbacks are identified by their exact Input list, as listed by _dash-dependencies
+CALLBACK_INPUTS = {
+    "change_layout": ("breakpoints.widthBreakpoint",),
+    "display_headers": ("user.id",),
+    "toggle_modal": ("btn-new.n_clicks",),
+    "append_entry_row": ("entry-row-request.data",),
+    "validate_and_build_df": ("new-done-button.n_clicks",),
+    "sync_table_edits": ("database-table.cellValueChanged", "location-table.cellValueChanged"),
+    "toggle_update_modal": ("btn-update.n_clicks", "update-done-button.n_clicks"),
+    "validate_and_display_kitid": ("update-done-button.n_clicks",),
+    "serve_location_block": ("location-table.getRowsRequest",),
+    "upload_data_to_database": ("btn-upload-data.n_clicks",),
+    "confirm_overwrite": ("confirm-overwrite.n_clicks",),
+}
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Background jobs are abandoned (and counted as errors) after this many seconds
+JOB_TIMEOUT = 300
+
+
+def _prop_key(spec):
+    return f"{spec['id']}.{spec['property']}"
+
+
+def _parse_outputs(output):
+    # "..a.children@hash...b.data.." -> [{"id": "a", "property": "children"}, ...]
+    multi = output.startswith("..")
+    outputs = []
+    for item in output.strip(".").split("...") if multi else [output]:
+        component_id, prop = item.split("@")[0].rsplit(".", 1)
+        outputs.append({"id": json.loads(component_id) if component_id.startswith("{") else component_id, "property": prop})
+    return outputs if multi else outputs[0]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok, error=None):
+        with self._lock:
+            self.samples.setdefault(name, []).append((seconds, ok))
+            if error:
+                # Distinct error messages per callback, with how often each was seen
+                messages = self.errors.setdefault(name, {})
+                messages[error] = messages.get(error, 0) + 1
+
+    def summary(self):
+        report = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds for seconds, ok in samples)
+            errors = sum(1 for seconds, ok in samples if not ok)
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+            report[name] = {
+                "count": len(samples),
+                "errors": errors,
+                "error_rate": errors / len(samples),
+                "p50_s": cuts[49],
+                "p95_s": cuts[94],
+                "p99_s": cuts[98],
+                "max_s": latencies[-1],
+                "error_messages": self.errors.get(name, {}),
+            }
+        return report
+
+
+class DashClient:
+    # One browser tab: its own session id and Dh-User header, talking to _dash-update-component
+    def __init__(self, base_url, user, recorder, dependencies=None):
+        self.base_url = base_url
+        self.headers = {"Content-Type": "application/json", "Dh-User": user}
+        self.recorder = recorder
+        self.session_id = str(uuid.uuid4())
+        self.dependencies = dependencies
+
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=self.headers)
+        try:
+            with urllib.request.urlopen(req, timeout=JOB_TIMEOUT) as response:
+                content = response.read()
+                return response.status, json.loads(content) if content and response.status == 200 and body is not None else content
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def page_load(self):
+        start = time.perf_counter()
+        ok = True
+        for path in ("", "_dash-layout", "_dash-dependencies"):
+            status, content = self._request(path)
+            ok = ok and status == 200
+            if path == "_dash-dependencies" and status == 200:
+                self.dependencies = json.loads(content)
+        self.recorder.record("page_load", time.perf_counter() - start, ok)
+        return ok
+
+    def _dependency(self, name):
+        for dependency in self.dependencies:
+            if tuple(_prop_key(spec) for spec in dependency["inputs"]) == CALLBACK_INPUTS[name]:
+                return dependency
+        raise KeyError(f"Callback '{name}' not found in _dash-dependencies")
+
+    def _payload(self, specs, values):
+        # values maps "id.prop" to a value; pattern-matching (ALL) props take a list of (id, value) pairs
+        payload = []
+        for spec in specs:
+            value = values.get(_prop_key(spec))
+            if spec["id"].startswith("{"):
+                payload.append([{"id": item_id, "property": spec["property"], "value": item} for item_id, item in value or []])
+            else:
+                payload.append({"id": spec["id"], "property": spec["property"], "value": value})
+        return payload
+
+    def callback(self, name, values, changed=None):
+        # Returns the callback's response dict ({} when the server raised PreventUpdate), or None on error
+        dependency = self._dependency(name)
+        values = {"session-id.data": self.session_id, **values}
+        body = {
+            "output": dependency["output"],
+            "outputs": _parse_outputs(dependency["output"]),
+            "inputs": self._payload(dependency["inputs"], values),
+            "state": self._payload(dependency["state"], values),
+            "changedPropIds": [changed or CALLBACK_INPUTS[name][0]],
+        }
+
+        start = time.perf_counter()
+        status, content = self._request("_dash-update-component", body)
+
+        # Background callbacks answer with a job to poll, the way the renderer does
+        if status == 200 and "cacheKey" in content:
+            interval = (dependency.get("background") or {}).get("interval", 1000) / 1000
+            query = urllib.parse.urlencode({"cacheKey": content["cacheKey"], "job": content["job"]})
+            while status == 200 and "response" not in content and time.perf_counter() - start < JOB_TIMEOUT:
+                time.sleep(interval)
+                status, content = self._request(f"_dash-update-component?{query}", body)
+            if status == 200 and "response" not in content:
+                status = 504
+
+        ok = status in (200, 204)
+        error = None if ok else f"HTTP {status}: {content[:200].decode(errors='replace') if isinstance(content, bytes) else content}"
+        self.recorder.record(name, time.perf_counter() - start, ok, error)
+        if not ok:
+            return None
+        return content.get("response", {}) if status == 200 else {}
+
+
+def _entry_id(kind, index):
+    return {"index": index, "type": kind}
+
+
+def run_session(client, rng, scans, edits, location=None, think_time=0.0):
+    def pause():
+        if think_time:
+            time.sleep(rng.uniform(0, 2 * think_time))
+
+    if not client.page_load():
+        return
+    client.callback("change_layout", {"breakpoints.widthBreakpoint": "lg", "breakpoints.width": 1280})
+    client.callback("display_headers", {})
+    pause()
+
+    # New kit: one row is appended per scanned sampler, then Done builds the table
+    kitid = f"EC-{rng.randrange(10_000):04d}"
+    samplers = [f"ECCC{rng.randrange(10_000):04d}" for _ in range(scans)]
+    client.callback("toggle_modal", {"btn-new.n_clicks": 1, "new-entry-modal.is_open": False})
+    for counter in range(2, scans + 2):
+        ids = [(_entry_id("entry-input", i), _entry_id("entry-input", i)) for i in range(1, counter)]
+        client.callback("append_entry_row", {"entry-row-request.data": counter, '{"index":["ALL"],"type":"entry-input"}.id': ids, "entry-counter.data": counter})
+    pause()
+
+    values = [(_entry_id("entry-input", i + 1), value) for i, value in enumerate(samplers + [""])]
+    radios = [(_entry_id("entry-radio", i + 1), "Blank" if i == scans - 1 else "Sample") for i in range(scans + 1)]
+    client.callback("validate_and_build_df", {
+        "new-done-button.n_clicks": 1,
+        "static-kit-id-input.value": kitid,
+        '{"index":["ALL"],"type":"entry-input"}.value': values,
+        '{"index":["ALL"],"type":"entry-radio"}.value': radios,
+    })
+    edit_cells(client, rng, scans, edits, pause)
+    upload(client)
+    pause()
+
+    # Update the same kit, edit it and upload again (the overwrite path)
+    client.callback("toggle_update_modal", {"btn-update.n_clicks": 1, "update-kitid-modal.is_open": False})
+    client.callback("validate_and_display_kitid", {
+        "update-done-button.n_clicks": 1, "update-kitid-textinput.value": kitid, "update-search-mode.value": "kit",
+    })
+    edit_cells(client, rng, scans, edits, pause)
+    upload(client)
+
+    if location:
+        client.callback("toggle_update_modal", {"btn-update.n_clicks": 2, "update-kitid-modal.is_open": False})
+        response = client.callback("validate_and_display_kitid", {
+            "update-done-button.n_clicks": 2, "update-kitid-dropdown.value": location, "update-search-mode.value": "location",
+        })
+        if response and response.get("grid-mode", {}).get("data") == "infinite":
+            client.callback("serve_location_block", {"location-table.getRowsRequest": {"startRow": 0, "endRow": 100}})
+
+
+def edit_cells(client, rng, rows, edits, pause):
+    for n in range(edits):
+        row = rng.randrange(rows)
+        change = {"rowIndex": row, "rowId": str(row), "colId": "note", "value": f"load test {n}", "oldValue": None}
+        client.callback("sync_table_edits", {"database-table.cellValueChanged": [change]})
+        pause()
+
+
+def upload(client):
+    response = client.callback("upload_data_to_database", {"btn-upload-data.n_clicks": 1})
+    duplicates = (response or {}).get("duplicate-rows", {}).get("data")
+    if duplicates:
+        client.callback("confirm_overwrite", {"confirm-overwrite.n_clicks": 1, "duplicate-rows.data": duplicates})
+
+
+def print_report(report, elapsed, sessions):
+    print(f"{sessions} sessions in {elapsed:.1f}s ({sessions / elapsed:.2f} sessions/s)")
+    print(f"{'callback':<28}{'count':>7}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, row in report.items():
+        print(f"{name:<28}{row['count']:>7}{row['error_rate']:>8.1%}"
+              f"{row['p50_s']:>9.3f}{row['p95_s']:>9.3f}{row['p99_s']:>9.3f}{row['max_s']:>9.3f}")
+    for name, row in report.items():
+        for message, count in row["error_messages"].items():
+            print(f"  {name} x{count}: {message}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay field sessions against a running app through _dash-update-component.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/", help="app URL including the routes prefix, e.g. http://host/app/AQPD/")
+    parser.add_argument("--users", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("--sessions", type=int, default=50, help="total sessions to run")
+    parser.add_argument("--scans", type=int, default=4, help="samplers scanned per new kit")
+    parser.add_argument("--edits", type=int, default=3, help="cell edits per table")
+    parser.add_argument("--location", help="shipped location searched at the end of each session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds between user actions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the per-callback report as JSON")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a non-local URL (sessions upload data)")
+    args = parser.parse_args(argv)
+
+    base_url = args.url if args.url.endswith("/") else args.url + "/"
+    if urllib.parse.urlparse(base_url).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        sys.exit("Sessions write to pas_tracking; pass --allow-remote to load test a non-local server")
+
+    recorder = Recorder()
+
+    def session(n):
+        client = DashClient(base_url, f"loadtest-{n % args.users}@example.ca", recorder)
+        try:
+            run_session(client, random.Random(args.seed + n), args.scans, args.edits, args.location, args.think_time)
+        except Exception as e:
+            recorder.record("session_error", 0.0, False)
+            print(f"Session {n} failed: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(session, range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    report = recorder.summary()
+    print_report(report, elapsed, args.sessions)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"users": args.users, "sessions": args.sessions, "elapsed_s": elapsed, "callbacks": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import event, text
+
+import queries
+from benchmarks.seed import seed_databases, synthetic_tracking
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# A latency more than this factor above the baseline is reported as a regression by --compare
+DEFAULT_TOLERANCE = 1.2
+
+# Differences smaller than this are timer noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.005
+
+# Rows of the synthetic batch used by the upload scenarios. Their ids never clash with the seeded data
+UPLOAD_PREFIX = "BM-"
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+class QueryCounter:
+    # Statements sent through SQLAlchemy (COPY through a raw cursor is not counted)
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._increment)
+
+    def _increment(self, *args):
+        self.count += 1
+
+
+def measure(run, setup=None, teardown=None, repeat=5, counter=None):
+    # The first run warms caches and measures peak Python memory under tracemalloc; the timed runs that
+    # follow run without it so tracing does not inflate the latencies. Without a counter, queries is None
+    latencies = []
+    peak = 0
+    query_count = None
+    for n in range(repeat + 1):
+        if setup:
+            setup()
+        if counter:
+            counter.count = 0
+        if n == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if n == 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if counter:
+                query_count = counter.count
+        else:
+            latencies.append(elapsed)
+        if teardown:
+            teardown()
+
+    return {
+        "latency_median_s": statistics.median(latencies),
+        "latency_min_s": min(latencies),
+        "latency_max_s": max(latencies),
+        "peak_memory_bytes": peak,
+        "queries": query_count,
+    }
+
+
+def upload_batch(app, rows):
+    # Grid-shaped rows (display strings, site labels), as the session dataframe holds them before an upload
+    df = synthetic_tracking(rows, seed=1)
+    df["kitid"] = UPLOAD_PREFIX + df["kitid"].str[3:]
+    df["sampleid"] = df["kitid"] + "_" + df["samplerid"]
+    return app.to_grid_frame(df)
+
+
+def expect(condition, scenario):
+    if not condition:
+        raise RuntimeError(f"Benchmark scenario '{scenario}' did not produce the expected result")
+
+
+def scenarios(app, upload_rows):
+    import export
+
+    engine = app.mercury_sql_engine
+    session_id = "benchmark"
+    no_progress = lambda value: None
+    batch = upload_batch(app, upload_rows)
+
+    with engine.connect() as conn:
+        locations = conn.execute(text(
+            "SELECT shipped_location FROM pas_tracking GROUP BY shipped_location ORDER BY count(*) DESC, shipped_location"
+        )).scalars().all()
+
+    def delete_batch():
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM pas_tracking WHERE kitid LIKE :prefix"), {"prefix": UPLOAD_PREFIX + "%"})
+
+    def load_batch():
+        delete_batch()
+        app.set_session_df(session_id, batch)
+        app.set_loaded_rows(session_id, None)
+
+    def insert_batch():
+        load_batch()
+        queries.upsert_tracking_rows(engine, app.prepare_upload(batch))
+
+    def update(search_mode, value):
+        def run():
+            text_value, dropdown_value = (None, value) if search_mode == "location" else (value, None)
+            result = app.validate_and_display_kitid(1, text_value, dropdown_value, search_mode, session_id)
+            expect(result[0] == "", f"update_by_{search_mode}")
+        return run
+
+    def upload_new():
+        result = app.upload_data_to_database(no_progress, 1, session_id)
+        expect(result[1] is False and result[0].style["color"] == "green", "upload_new")
+
+    duplicates = []
+
+    def upload_duplicates():
+        result = app.upload_data_to_database(no_progress, 1, session_id)
+        expect(result[1] is True, "upload_duplicates")
+        duplicates[:] = result[2]
+
+    def overwrite():
+        result = app.confirm_overwrite(no_progress, 1, duplicates or batch.to_dict("records"), session_id)
+        expect(result[0].style["color"] == "green", "confirm_overwrite")
+
+    def load_edited_batch():
+        # The stored batch as if loaded through Update, with one note edited
+        insert_batch()
+        loaded = app.to_grid_frame(queries.fetch_by_kitids(engine, batch["kitid"].unique()))
+        edited = loaded.drop(columns="row_version")
+        edited.loc[edited.index[0], "note"] = f"benchmark edit {time.time()}"
+        app.set_session_df(session_id, edited)
+        app.set_loaded_rows(session_id, loaded)
+
+    def save_one_edit():
+        result = app.upload_data_to_database(no_progress, 1, session_id)
+        expect(result[1] is True and len(result[2]) == 1, "save_one_edit")
+        result = app.confirm_overwrite(no_progress, 1, result[2], session_id)
+        expect(result[0].style["color"] == "green", "save_one_edit")
+
+    def first_location_block():
+        update("location", locations[0])()
+        block = app.serve_location_block({"startRow": 0, "endRow": app.GRID_BLOCK_ROWS}, session_id)
+        expect(len(block["rowData"]) > 0, "location_block")
+
+    def export_csv():
+        sql, params = export.build_export_query({})
+        expect(sum(len(chunk) for chunk in export.stream_csv(engine, sql, params)) > 0, "export_csv")
+
+    def export_parquet():
+        sql, params = export.build_export_query({})
+        expect(sum(len(chunk) for chunk in export.stream_parquet(engine, sql, params)) > 0, "export_parquet")
+
+    runs = {
+        "serve_layout": (app.serve_layout, None, None),
+        "change_layout": (lambda: app.change_layout("lg", 1200), None, None),
+        "update_by_kit": (update("kit", "EC-0042"), None, None),
+        "update_by_samplerid": (update("sampler", "ECCC0042"), None, None),
+        "update_by_location_smallest": (update("location", locations[-1]), None, None),
+        "update_by_location_largest": (update("location", locations[0]), None, None),
+        "location_first_block": (first_location_block, None, None),
+        "upload_new": (upload_new, load_batch, delete_batch),
+        "upload_duplicates": (upload_duplicates, insert_batch, None),
+        "confirm_overwrite": (overwrite, insert_batch, delete_batch),
+        "save_one_edit": (save_one_edit, load_edited_batch, delete_batch),
+        "export_csv": (export_csv, None, None),
+    }
+    try:
+        import pyarrow  # noqa: F401
+        runs["export_parquet"] = (export_parquet, None, None)
+    except ImportError:
+        logging.warning("pyarrow is not installed, skipping the Parquet export benchmark")
+    return runs
+
+
+def environment(app):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    with app.mercury_sql_engine.connect() as conn:
+        server_version = conn.execute(text("SHOW server_version")).scalar()
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "postgres": server_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Prints latency ratios against an earlier run; returns the regressions
+    regressions = []
+    for size, runs in results["sizes"].items():
+        for name, current in runs.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(name)
+            if previous is None:
+                continue
+            ratio = current["latency_median_s"] / max(previous["latency_median_s"], 1e-9)
+            slower = current["latency_median_s"] - previous["latency_median_s"] > MIN_REGRESSION_SECONDS
+            flag = "REGRESSION" if ratio > tolerance and slower else ""
+            print(f"{size:>9} {name:<30} {previous['latency_median_s']:9.4f}s -> {current['latency_median_s']:9.4f}s  x{ratio:5.2f} {flag}")
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Update, Upload and Download paths against synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="pas_tracking row counts to seed")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per scenario (after one warm-up run)")
+    parser.add_argument("--upload-rows", type=int, default=1000, help="rows in the uploaded batch")
+    parser.add_argument("--output", default="benchmarks/baseline.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier results file to compare latencies against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="latency ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    import app
+
+    # Seeding drops and recreates the tables, so only ever point this at a throwaway local server
+    host = app.datahub_connect_params()["host"]
+    if not (host in LOCAL_HOSTS or host.startswith("/")):
+        sys.exit(f"Refusing to seed '{host}': benchmarks only run against a local Postgres")
+    counter = QueryCounter(app.dcp_sql_engine, app.mercury_sql_engine)
+    results = {"environment": environment(app), "upload_rows": args.upload_rows, "repeat": args.repeat, "sizes": {}}
+
+    for size in args.sizes:
+        print(f"Seeding {size} rows")
+        seed_databases(app.dcp_sql_engine, app.mercury_sql_engine, size)
+        app.reference_cache.invalidate()
+        app.location_cache.invalidate()
+
+        results["sizes"][str(size)] = {}
+        for name, (run, setup, teardown) in scenarios(app, args.upload_rows).items():
+            result = measure(run, setup, teardown, args.repeat, counter)
+            results["sizes"][str(size)][name] = result
+            print(f"{size:>9} {name:<30} {result['latency_median_s']:9.4f}s  "
+                  f"{result['peak_memory_bytes'] / 2**20:8.1f} MiB  {result['queries']:4d} queries")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if baseline is not None and compare(results, baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
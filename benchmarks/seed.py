@@ -0,0 +1,111 @@
+import io
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import queries
+from migrate import migrate_tracking_indexes
+
+# Synthetic stand-ins for the production tables, shaped like the columns the app reads
+DCP_SCHEMA = [
+    "DROP TABLE IF EXISTS users",
+    "DROP TABLE IF EXISTS stations",
+    "CREATE TABLE users (id serial PRIMARY KEY, email text, name text)",
+    "CREATE TABLE stations (siteid text PRIMARY KEY, description text, projectid text)",
+]
+TRACKING_SCHEMA = [
+    "DROP TABLE IF EXISTS pas_tracking",
+    "CREATE TABLE pas_tracking ("
+    "sample_start timestamp, sample_end timestamp, sampleid text PRIMARY KEY, kitid text, samplerid text, "
+    "siteid text, shipped_location text, shipped_date date, return_date date, sample_type text, note text, "
+    "screen_sampling_rate double precision)",
+]
+
+# Mercury passive sites; location popularity is skewed so the busiest ones exceed INFINITE_ROW_THRESHOLD
+SITE_COUNT = 200
+SAMPLERS_PER_KIT = 4
+COPY_CHUNK_ROWS = 100_000
+BASE_START = pd.Timestamp("2015-01-01 09:00")
+
+
+def synthetic_stations():
+    mercury = pd.DataFrame({
+        "siteid": [f"S{i:03d}" for i in range(SITE_COUNT)],
+        "description": [f"Site {i:03d}" for i in range(SITE_COUNT)],
+        "projectid": "MERCURY_PASSIVE",
+    })
+    other = pd.DataFrame({"siteid": ["X001", "X002"], "description": ["Other 1", "Other 2"], "projectid": "OTHER"})
+    return pd.concat([mercury, other], ignore_index=True)
+
+
+def synthetic_users(count=50):
+    return pd.DataFrame({
+        "email": [f"tech{i:02d}@example.ca" for i in range(count)],
+        "name": [f"Tech {i:02d}" for i in range(count)],
+    })
+
+
+def synthetic_tracking(rows, seed=0):
+    # Kits of four samplers (three samples and a blank). Kit IDs wrap every 10,000 kits, so each wrap shifts
+    # the sampler numbers to keep (kitid, samplerid) and therefore sampleid unique
+    rng = np.random.default_rng(seed)
+    i = np.arange(rows)
+    kit = i // SAMPLERS_PER_KIT
+    slot = i % SAMPLERS_PER_KIT
+    wrap = kit // 10_000
+    kitid = pd.Series(kit % 10_000).map("EC-{:04d}".format)
+    samplerid = pd.Series((SAMPLERS_PER_KIT * (kit + wrap) + slot) % 10_000).map("ECCC{:04d}".format)
+
+    site = np.floor(SITE_COUNT * rng.random(len(np.unique(kit))) ** 3).astype(int)[kit]
+    start = BASE_START + pd.to_timedelta(kit * 30, unit="min")
+    end = pd.Series(start + pd.Timedelta(days=30)).where(rng.random(rows) > 0.05)
+    returned = (end + pd.Timedelta(days=7)).dt.normalize().where(rng.random(rows) > 0.2)
+
+    return pd.DataFrame({
+        "sample_start": start,
+        "sample_end": end,
+        "sampleid": kitid + "_" + samplerid,
+        "kitid": kitid,
+        "samplerid": samplerid,
+        "siteid": pd.Series(site).map("S{:03d}".format),
+        "shipped_location": pd.Series(site).map("Site {:03d}".format),
+        "shipped_date": (pd.Series(start) - pd.Timedelta(days=10)).dt.normalize(),
+        "return_date": returned,
+        "sample_type": np.where(slot == SAMPLERS_PER_KIT - 1, "Blank", "Sample"),
+        "note": pd.Series("synthetic note", index=i).where(rng.random(rows) < 0.1),
+        "screen_sampling_rate": pd.Series(rng.normal(0.12, 0.02, rows)).round(4).where(rng.random(rows) < 0.3),
+    })[queries.TRACKING_COLUMNS]
+
+
+def copy_frame(engine, table, df):
+    # COPY FROM STDIN in chunks; much faster than INSERT for the 1M row dataset
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            for start in range(0, len(df), COPY_CHUNK_ROWS):
+                buffer = io.StringIO()
+                df.iloc[start:start + COPY_CHUNK_ROWS].to_csv(buffer, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+
+def seed_databases(dcp_engine, tracking_engine, rows, seed=0):
+    # Recreates users, stations and pas_tracking with synthetic data. Destroys whatever was there
+    with dcp_engine.begin() as conn:
+        for statement in DCP_SCHEMA:
+            conn.execute(text(statement))
+    copy_frame(dcp_engine, "stations", synthetic_stations())
+    copy_frame(dcp_engine, "users", synthetic_users())
+
+    with tracking_engine.begin() as conn:
+        for statement in TRACKING_SCHEMA:
+            conn.execute(text(statement))
+    copy_frame(tracking_engine, "pas_tracking", synthetic_tracking(rows, seed))
+    migrate_tracking_indexes(tracking_engine)
+
+    with tracking_engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE pas_tracking"))
@@ -1,46 +1,164 @@
+import logging
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
-import os
-from dotenv import load_dotenv 
-
-def sql_engine_string_generator(datahub_host, datahub_db, datahub_user, datahub_pwd,local): 
-
-    # set a try except clause to grab the online credentials keys and if not, grab them locally as environment variables
-    try:
-        if local:
-            raise Exception("Working locally, attempting to load credentials from file")
-        
-        # set the key vault path
-        KEY_VAULT_URL = "https://fsdh-proj-aqpd-prd-kv.vault.azure.net/"
-        error_occur = False
-
-        # Retrieve the secrets containing DB connection details
-        credential = DefaultAzureCredential()
-        secret_client = SecretClient(vault_url=KEY_VAULT_URL, 
-                                     credential=credential)
-
-        # Retrieve the secrets containing DB connection details
-        DB_HOST = secret_client.get_secret(datahub_host).value
-        DB_NAME = datahub_db
-        DB_USER = secret_client.get_secret(datahub_user).value
-        DB_PASS = secret_client.get_secret(datahub_pwd).value
-        print ('Credentials loaded from FSDH')
-
-    except Exception as e:
-        # declare FSDH keys exception
-        error_occur = True
-        print(e)
-        
-        # load the .env file using the dotenv module remove this when running a powershell script to confirue system environment vars
-        parent_dir=os.getcwd()
-        load_dotenv(parent_dir+ '\\.env') # default is relative local directory 
-        DB_HOST = os.getenv(datahub_host)
-        DB_NAME = datahub_db
-        DB_USER = os.getenv(datahub_user)
-        DB_PASS = os.getenv(datahub_pwd)
-        print('Credentials loaded')
+from dotenv import load_dotenv
+
+from forking import after_fork
+
+# set the key vault path
+KEY_VAULT_URL = "https://fsdh-proj-aqpd-prd-kv.vault.azure.net/"
+
+# Seconds a resolved secret is reused before it is fetched again (picks up rotated passwords)
+SECRET_CACHE_TTL = float(os.getenv("SECRET_CACHE_TTL", "3600"))
+
+# Seconds a secret provider that failed (e.g. a Key Vault timeout) is skipped in favour of the next one, and how long
+# a stale secret is served before its provider is tried again. Jittered so workers do not retry in lockstep
+SECRET_RETRY_SECONDS = float(os.getenv("SECRET_RETRY_SECONDS", "30"))
+
+# .env file used when working locally or when Key Vault is unreachable
+DOTENV_PATH = os.getenv("DOTENV_PATH", os.path.join(os.getcwd(), ".env"))
+
+# Objects holding locks, so they can be given fresh ones after a fork
+_lock_holders = []
+
+
+class KeyVaultSecretProvider:
+    # One credential and client per process, created on the first lookup
+    def __init__(self, vault_url=KEY_VAULT_URL):
+        self.vault_url = vault_url
+        self._client = None
+        self._lock = threading.Lock()
+        _lock_holders.append(self)
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = SecretClient(vault_url=self.vault_url, credential=DefaultAzureCredential())
+            return self._client
+
+    def get(self, name):
+        return self._get_client().get_secret(name).value
+
+
+class EnvSecretProvider:
+    # Environment variables, with the .env file loaded once (offline/local stand-in for Key Vault)
+    def __init__(self, dotenv_path=DOTENV_PATH):
+        load_dotenv(dotenv_path)
+
+    def get(self, name):
+        value = os.getenv(name)
+        if value is None:
+            raise KeyError(f"Secret '{name}' is not set in the environment or {DOTENV_PATH}")
+        return value
+
+
+class FallbackSecretProvider:
+    # Tries each provider in order. A provider that fails is skipped for about retry_after seconds, so an
+    # unreachable Key Vault costs one timeout rather than one per secret. It is only skipped while a later provider
+    # has the value: if they all fail, the skipped ones are tried again
+    def __init__(self, *providers, retry_after=SECRET_RETRY_SECONDS):
+        self.providers = providers
+        self.retry_after = retry_after
+        self._skip_until = {}
+
+    def get(self, name):
+        now = time.monotonic()
+        skipped = [provider for provider in self.providers if self._skip_until.get(id(provider), 0) > now]
+        error = None
+        for provider in [p for p in self.providers if p not in skipped] + skipped:
+            try:
+                value = provider.get(name)
+            except Exception as e:
+                logging.warning(f"{type(provider).__name__} failed ({e}), falling back")
+                self._skip_until[id(provider)] = time.monotonic() + self.retry_after * random.uniform(0.5, 1.5)
+                error = e
+                continue
+            self._skip_until.pop(id(provider), None)
+            return value
+        raise error or KeyError(f"No secret provider available for '{name}'")
+
+
+class CachedSecretProvider:
+    # Resolves each secret once per TTL, shared by every engine and thread in the process. When the refresh
+    # fails, the last good value keeps being served (and the refresh retried every retry_after seconds)
+    def __init__(self, provider, ttl=SECRET_CACHE_TTL, retry_after=SECRET_RETRY_SECONDS):
+        self.provider = provider
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.fetch_seconds = 0.0
+        self._values = {}
+        self._lock = threading.Lock()
+        _lock_holders.append(self)
+
+    def get(self, name):
+        with self._lock:
+            cached = self._values.get(name)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl:
+                self.hits += 1
+                return cached[0]
+
+            self.misses += 1
+            start = time.perf_counter()
+            try:
+                value = self.provider.get(name)
+            except Exception as e:
+                if cached is None:
+                    raise
+                logging.error(f"Could not refresh secret '{name}' ({e}), using the cached value")
+                self.stale += 1
+                retry_at = time.monotonic() + self.retry_after * random.uniform(0.5, 1.5)
+                self._values[name] = (cached[0], retry_at - self.ttl)
+                return cached[0]
+            finally:
+                self.fetch_seconds += time.perf_counter() - start
+            self._values[name] = (value, time.monotonic())
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "fetch_seconds": self.fetch_seconds, "ttl": self.ttl}
+
+
+@after_fork
+def _reset_after_fork():
+    # A lock held by another thread at fork time (e.g. mid Key Vault lookup) would never be released in the child
+    for holder in _lock_holders:
+        holder._lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_secret_provider(local):
+    if local:
+        logging.info("Working locally, loading credentials from the environment")
+        return CachedSecretProvider(EnvSecretProvider())
+    return CachedSecretProvider(FallbackSecretProvider(KeyVaultSecretProvider(), EnvSecretProvider()))
+
+
+def connection_params(datahub_host, datahub_user, datahub_pwd, local):
+    # psycopg2 connect() keyword arguments, resolved through the cached provider
+    secrets = get_secret_provider(local)
+    return {
+        "host": secrets.get(datahub_host),
+        "user": secrets.get(datahub_user),
+        "password": secrets.get(datahub_pwd),
+    }
+
+
+def sql_engine_string_generator(datahub_host, datahub_db, datahub_user, datahub_pwd, local):
+    params = connection_params(datahub_host, datahub_user, datahub_pwd, local)
 
     # set the sql engine string
-    sql_engine_string=('postgresql://{}:{}@{}/{}?sslmode=require').format(DB_USER,DB_PASS,DB_HOST,DB_NAME)
+    sql_engine_string = ('postgresql://{}:{}@{}/{}?sslmode=require').format(params["user"], params["password"], params["host"], datahub_db)
     return sql_engine_string
-
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from forking import after_fork
+
+# Pool tuning, overridable per deployment
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Engines created in this process, so they can be reset after a fork
+_engines = []
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # Called with each checkout's wait in seconds (e.g. the /metrics histogram)
+        self.observers = []
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+        for observer in self.observers:
+            observer(seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+                "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a connection
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # Keep counters when the engine is disposed
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def create_pooled_engine(sql_engine_string, connect_params=None):
+    # With connect_params, sql_engine_string only names the database and the host/user/password come from
+    # connect_params() when a connection is opened. Creating the engine then needs no secrets at all
+    engine = create_engine(
+        sql_engine_string,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+    @event.listens_for(engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        engine.pool.stats.connects += 1
+
+    @event.listens_for(engine, "invalidate")
+    def count_invalidate(dbapi_connection, connection_record, exception):
+        engine.pool.stats.invalidations += 1
+
+    if connect_params is not None:
+        @event.listens_for(engine, "do_connect")
+        def provide_credentials(dialect, connection_record, cargs, cparams):
+            cparams.update(connect_params())
+
+    _engines.append(engine)
+    return engine
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = pool.stats.as_dict()
+    stats.update({
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    })
+    return stats
+
+
+@after_fork
+def _reset_after_fork():
+    # A forked worker must not reuse sockets opened by its parent (e.g. gunicorn --preload)
+    for engine in _engines:
+        engine.dispose(close=False)
+        engine.pool.stats._lock = threading.Lock()
@@ -0,0 +1,43 @@
+import pandas as pd
+
+# Datetime columns of pas_tracking and how each is shown in the grid. Values stay datetime64 between the
+# database and the grid; strings only exist at the UI edge
+DATETIME_COLUMNS = ["sample_start", "sample_end"]
+DATE_COLUMNS = ["shipped_date", "return_date"]
+DISPLAY_FORMATS = {
+    **{col: "%Y-%m-%d %H:%M" for col in DATETIME_COLUMNS},
+    **{col: "%Y-%m-%d" for col in DATE_COLUMNS},
+}
+
+
+def to_timestamps(series, fmt="ISO8601"):
+    # Naive datetime64[ns]; tz-aware values are converted to UTC first, unparseable values become NaT
+    if pd.api.types.is_datetime64_dtype(series):
+        return series
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_convert(None)
+    values = series.where(series.astype("string").str.strip().ne("").fillna(False), None)
+    return pd.to_datetime(values, errors="coerce", utc=True, format=fmt).dt.tz_localize(None)
+
+
+def normalize_datetimes(df, columns=None):
+    # Parse every datetime column of df in one pass, in place
+    for col in columns or DISPLAY_FORMATS:
+        if col in df.columns:
+            df[col] = to_timestamps(df[col])
+    return df
+
+
+def format_datetimes(df, columns=None):
+    # Display strings for the grid, None where empty, in place
+    for col in columns or DISPLAY_FORMATS:
+        if col in df.columns:
+            values = to_timestamps(df[col])
+            df[col] = values.dt.strftime(DISPLAY_FORMATS[col]).astype(object).where(values.notna(), None)
+    return df
+
+
+def format_value(value, col):
+    if value is None or pd.isna(value):
+        return ""
+    return pd.Timestamp(value).strftime(DISPLAY_FORMATS[col])
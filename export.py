@@ -0,0 +1,195 @@
+import io
+import logging
+import queue
+import threading
+import zlib
+from datetime import datetime
+
+import pandas as pd
+from flask import Response, request
+from sqlalchemy import Date, DateTime, Float, Integer, Numeric, text
+
+import datetimes
+import queries
+
+# Rows per chunk for the chunked (non-COPY) export paths
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Optional query string filters: ?kitid=EC-0001&location=Alert&start=2024-01-01&end=2024-12-31
+EXPORT_FILTERS = {
+    "kitid": "kitid = :kitid",
+    "location": "lower(trim(shipped_location)) = lower(trim(:location))",
+    "start": "sample_start >= CAST(:start AS date)",
+    "end": "sample_start < CAST(:end AS date) + 1",
+}
+
+
+def build_export_query(args):
+    params = {key: args[key].strip() for key in EXPORT_FILTERS if args.get(key, "").strip()}
+    sql = "SELECT * FROM pas_tracking"
+    if params:
+        sql += " WHERE " + " AND ".join(EXPORT_FILTERS[key] for key in params)
+    return sql + " ORDER BY sampleid", params
+
+
+def _arrow_schema(engine):
+    # Parquet column types come from the table definition, so every row group shares one schema
+    import pyarrow as pa
+
+    fields = []
+    for col in queries.tracking_table(engine).c:
+        if isinstance(col.type, (Date, DateTime)):
+            arrow_type = pa.timestamp("us")
+        elif isinstance(col.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(col.type, (Float, Numeric)):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(col.name, arrow_type))
+    return pa.schema(fields)
+
+
+class _QueueWriter:
+    # File-like sink handed to COPY; hands each chunk to the response generator
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=64)
+        self.cancelled = threading.Event()
+
+    def write(self, data):
+        while True:
+            if self.cancelled.is_set():
+                raise IOError("Export cancelled by client")
+            try:
+                self.queue.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+
+
+def stream_copy_csv(engine, sql, params):
+    # COPY ... TO STDOUT runs in a helper thread so rows are sent while Postgres is still producing them.
+    # COPY takes no bind parameters, so the driver quotes the filter values into the query text (mogrify); the
+    # compiled statement uses the driver's %(name)s placeholders, so a % in a filter value is data, not a placeholder
+    compiled = text(sql).bindparams(**params).compile(dialect=engine.dialect)
+    writer = _QueueWriter()
+    done = object()
+    errors = []
+
+    def run_copy():
+        raw_connection = engine.raw_connection()
+        try:
+            with raw_connection.cursor() as cursor:
+                query = cursor.mogrify(str(compiled), compiled.params).decode()
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", writer)
+            raw_connection.commit()
+        except Exception as e:
+            logging.error(f"Error exporting pas_tracking: {e}")
+            errors.append(e)
+        finally:
+            raw_connection.close()
+            writer.queue.put(done)
+
+    threading.Thread(target=run_copy, name="export-copy", daemon=True).start()
+
+    try:
+        while True:
+            chunk = writer.queue.get()
+            if chunk is done:
+                break
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+        if errors:
+            raise errors[0]
+    finally:
+        writer.cancelled.set()
+
+
+def _read_chunks(engine, sql, params):
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql_query(text(sql), conn, params=params, chunksize=EXPORT_CHUNK_ROWS)
+
+
+def stream_chunked_csv(engine, sql, params):
+    # Stand-in for drivers without COPY support
+    header = True
+    for chunk in _read_chunks(engine, sql, params):
+        yield chunk.to_csv(index=False, header=header, date_format="%Y-%m-%d %H:%M:%S").encode()
+        header = False
+
+
+def stream_csv(engine, sql, params):
+    if engine.dialect.driver == "psycopg2":
+        return stream_copy_csv(engine, sql, params)
+    return stream_chunked_csv(engine, sql, params)
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_parquet(engine, sql, params):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(engine)
+    sink = io.BytesIO()
+    parquet_writer = pq.ParquetWriter(sink, schema)
+    for chunk in _read_chunks(engine, sql, params):
+        for field in schema:
+            if pa.types.is_timestamp(field.type):
+                chunk[field.name] = datetimes.to_timestamps(chunk[field.name])
+            elif pa.types.is_string(field.type):
+                chunk[field.name] = chunk[field.name].astype("string")
+            else:
+                chunk[field.name] = pd.to_numeric(chunk[field.name], errors="coerce")
+        # One row group per chunk, sent as soon as it is written
+        parquet_writer.write_table(pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+
+    parquet_writer.close()
+    yield sink.getvalue()
+
+
+def register_export_route(server, engine, routes_pathname_prefix="/"):
+    @server.route(f"{routes_pathname_prefix}export/pas_tracking")
+    def export_pas_tracking():
+        export_format = request.args.get("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            return Response(f"Unknown export format '{export_format}'.", status=400)
+
+        sql, params = build_export_query(request.args)
+        if export_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                return Response("Parquet export requires pyarrow to be installed.", status=501)
+            body = stream_parquet(engine, sql, params)
+        elif export_format == "csv.gz":
+            body = gzip_stream(stream_csv(engine, sql, params))
+        else:
+            body = stream_csv(engine, sql, params)
+
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        now_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        logging.info(f"Streaming pas_tracking export ({export_format}, filters={params})")
+        return Response(
+            body,
+            mimetype=mimetype,
+            headers={"Content-Disposition": f'attachment; filename="pas_tracking_{now_str}.{extension}"'}
+        )
+
+    return export_pas_tracking
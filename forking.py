@@ -0,0 +1,26 @@
+import logging
+import os
+
+# Background jobs are forked from a gunicorn worker or from the job forkserver (see jobs.py). Only the forking thread
+# survives in the child, so locks other threads held at that moment stay locked forever, and threads, sockets and
+# queues set up by the parent are unusable. Each module registers a function resetting its own state here, and this
+# single os.register_at_fork hook runs them in the child, in registration order
+_resets = []
+
+
+def after_fork(reset):
+    # Usable as a decorator; returns reset unchanged
+    _resets.append(reset)
+    return reset
+
+
+def _run_resets():
+    for reset in _resets:
+        try:
+            reset()
+        except Exception as e:
+            logging.error(f"After-fork reset {reset.__module__}.{reset.__qualname__} failed: {e}")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_run_resets)
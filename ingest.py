@@ -0,0 +1,328 @@
+import base64
+import io
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import datetimes
+import queries
+import validation
+
+# Rows parsed and validated at a time
+INGEST_CHUNK_ROWS = 2000
+
+# Maximum number of row errors reported back to the user
+MAX_REPORTED_ERRORS = 20
+
+NUMERIC_COLUMNS = ["screen_sampling_rate"]
+
+# Columns a returned-kit sheet may update
+RETURN_COLUMNS = ["return_date", "sample_end", "note", "screen_sampling_rate"]
+
+
+def _normalize_header(header):
+    # "Kit ID", "kit_id" and "kitid" all map to kitid
+    return re.sub(r"[\s_]", "", str(header)).lower()
+
+
+HEADER_ALIASES = {_normalize_header(col): col for col in queries.TRACKING_COLUMNS}
+
+
+def decode_upload(contents):
+    # dcc.Upload contents look like "data:<mime>;base64,<payload>"
+    return base64.b64decode(contents.split(",", 1)[1])
+
+
+def _chunks_from_rows(rows, chunksize):
+    header = next(rows, None)
+    if header is None:
+        return
+    header = ["" if h is None else str(h) for h in header]
+    chunk = []
+    for row in rows:
+        chunk.append(["" if value is None else value for value in row])
+        if len(chunk) == chunksize:
+            yield pd.DataFrame(chunk, columns=header)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=header)
+
+
+def iter_file_chunks(data, filename, chunksize=INGEST_CHUNK_ROWS):
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        yield from pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, chunksize=chunksize)
+    elif extension == ".xlsx":
+        import openpyxl
+
+        # read_only streams rows from the sheet instead of loading the whole workbook
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            yield from _chunks_from_rows(workbook.active.iter_rows(values_only=True), chunksize)
+        finally:
+            workbook.close()
+    elif extension == ".xls":
+        import xlrd
+
+        workbook = xlrd.open_workbook(file_contents=data, on_demand=True)
+        sheet = workbook.sheet_by_index(0)
+        rows = (sheet.row_values(i) for i in range(sheet.nrows))
+        yield from _chunks_from_rows(rows, chunksize)
+    else:
+        raise ValueError(f"Unsupported file type '{extension}'. Expected .csv, .xlsx or .xls.")
+
+
+def _parse_datetime_column(df, col, errors, first_row):
+    # Spreadsheets carry dates in many formats, so the file edge parses with format="mixed"
+    provided = df[col].notna()
+    parsed = datetimes.to_timestamps(df[col], fmt="mixed")
+    for row in df.index[provided & parsed.isna()]:
+        errors.append(f"Row {first_row + row}: invalid {col} '{df.at[row, col]}'.")
+    return parsed
+
+
+def _format_datetimes(df, errors, first_row):
+    # Imported rows go to the grid, so they are formatted like rows loaded from the database
+    for col in datetimes.DISPLAY_FORMATS:
+        df[col] = _parse_datetime_column(df, col, errors, first_row)
+    datetimes.format_datetimes(df)
+
+
+def _select_columns(chunk, columns):
+    # Known columns only, stripped, with empty cells as None
+    df = pd.DataFrame({col: chunk[col] if col in chunk.columns else None for col in columns}, index=chunk.index)
+    df = df.astype(object)
+    for col in df.columns:
+        df[col] = df[col].map(lambda v: v.strip() if isinstance(v, str) else v).replace("", None)
+    return df
+
+
+def _rename_headers(chunk):
+    chunk = chunk.rename(columns=lambda c: HEADER_ALIASES.get(_normalize_header(c), c))
+    return chunk.reset_index(drop=True)
+
+
+def validate_kit_chunk(chunk, first_row):
+    # Returns the chunk in grid layout plus a list of row errors. first_row is the spreadsheet row of chunk.iloc[0]
+    errors = []
+    chunk = _rename_headers(chunk)
+
+    missing = [col for col in ["kitid", "samplerid"] if col not in chunk.columns]
+    if missing:
+        return None, [f"Missing required column(s): {', '.join(missing)}."]
+
+    df = _select_columns(chunk, queries.TRACKING_COLUMNS)
+
+    # Skip rows without a sampler (e.g. trailing blank lines)
+    df = df[df["samplerid"].notna()]
+
+    # Dates are parsed below rather than pattern-checked, since spreadsheets carry them in many formats
+    cell_errors = validation.validate_frame(df, ["kitid", "samplerid", "sample_type"], required=["kitid", "samplerid"])
+    errors.extend(validation.error_messages(df, cell_errors, first_row))
+
+    kitids = df["kitid"].astype("string")
+    samplerids = df["samplerid"].astype("string")
+    sample_types = df["sample_type"].astype("string").str.capitalize()
+    df["sample_type"] = sample_types.astype(object).where(df["sample_type"].notna(), None)
+    _format_datetimes(df, errors, first_row)
+
+    # Same sampleid format as the New flow
+    df["sampleid"] = kitids + "_" + samplerids
+    return df, errors
+
+
+def parse_kit_file(contents, filename):
+    # Parse and validate an uploaded kit spreadsheet chunk by chunk. Returns (dataframe, errors)
+    data = decode_upload(contents)
+    frames = []
+    errors = []
+    first_row = 2  # Row 1 is the header
+    for chunk in iter_file_chunks(data, filename):
+        df, chunk_errors = validate_kit_chunk(chunk, first_row)
+        errors.extend(chunk_errors)
+        if df is None:
+            break
+        frames.append(df)
+        first_row += len(chunk)
+
+    if not frames:
+        return pd.DataFrame(columns=queries.TRACKING_COLUMNS), errors or ["The file contains no rows."]
+
+    df = pd.concat(frames, ignore_index=True)
+    duplicated = df["sampleid"].duplicated(keep=False) & df["sampleid"].notna()
+    if duplicated.any():
+        errors.append(f"Duplicate sample IDs in file: {', '.join(sorted(df.loc[duplicated, 'sampleid'].unique()))}.")
+    if df.empty and not errors:
+        errors.append("The file contains no rows with a Sampler ID.")
+    return df, errors
+
+
+def validate_return_chunk(chunk, first_row):
+    # Returns sampleid plus the return columns present in the sheet, parsed to comparable types
+    errors = []
+    chunk = _rename_headers(chunk)
+
+    columns = [col for col in RETURN_COLUMNS if col in chunk.columns]
+    if not columns:
+        return None, [f"No return columns found. Expected at least one of: {', '.join(RETURN_COLUMNS)}."]
+    if "sampleid" not in chunk.columns and not {"kitid", "samplerid"} <= set(chunk.columns):
+        return None, ["Missing required column: Sample ID (or both Kit ID and Sampler ID)."]
+
+    df = _select_columns(chunk, ["sampleid", "kitid", "samplerid"] + columns)
+    if "sampleid" not in chunk.columns:
+        df["sampleid"] = df["kitid"].astype("string") + "_" + df["samplerid"].astype("string")
+    df = df[df["sampleid"].notna()]
+
+    for col in columns:
+        if col in datetimes.DISPLAY_FORMATS:
+            df[col] = _parse_datetime_column(df, col, errors, first_row)
+        elif col in NUMERIC_COLUMNS:
+            parsed = pd.to_numeric(df[col], errors="coerce")
+            for row in df.index[df[col].notna() & parsed.isna()]:
+                errors.append(f"Row {first_row + row}: invalid {col} '{df.at[row, col]}'.")
+            df[col] = parsed
+
+    return df[["sampleid"] + columns], errors
+
+
+def parse_return_file(contents, filename):
+    # Parse and validate a returned-kit sheet chunk by chunk. Returns (dataframe, columns, errors)
+    data = decode_upload(contents)
+    frames = []
+    errors = []
+    first_row = 2  # Row 1 is the header
+    for chunk in iter_file_chunks(data, filename):
+        df, chunk_errors = validate_return_chunk(chunk, first_row)
+        errors.extend(chunk_errors)
+        if df is None:
+            break
+        frames.append(df)
+        first_row += len(chunk)
+
+    if not frames:
+        return None, [], errors or ["The file contains no rows."]
+
+    df = pd.concat(frames, ignore_index=True)
+    columns = [col for col in df.columns if col != "sampleid"]
+    duplicated = df["sampleid"].duplicated(keep=False)
+    if duplicated.any():
+        errors.append(f"Duplicate sample IDs in file: {', '.join(sorted(df.loc[duplicated, 'sampleid'].unique()))}.")
+    if df.empty and not errors:
+        errors.append("The file contains no rows with a Sample ID.")
+    return df, columns, errors
+
+
+def _same_values(new, old, col):
+    if col in datetimes.DISPLAY_FORMATS:
+        new = datetimes.to_timestamps(new)
+        old = datetimes.to_timestamps(old)
+        if col in datetimes.DATE_COLUMNS:
+            new, old = new.dt.normalize(), old.dt.normalize()
+        return (new == old).to_numpy()
+    if col in NUMERIC_COLUMNS:
+        new = pd.to_numeric(new, errors="coerce").to_numpy(dtype=float)
+        old = pd.to_numeric(old, errors="coerce").to_numpy(dtype=float)
+        return np.isclose(new, old)
+    return (new.astype("string").str.strip() == old.astype("string").str.strip()).fillna(False).to_numpy(dtype=bool)
+
+
+def diff_return_sheet(incoming, current, columns):
+    # Join the sheet to the stored rows on sampleid. Blank cells in the sheet never overwrite stored values.
+    # Adds "<col>_current" and "<col>_changed" per column and a status of changed/unchanged/missing per row
+    diff = incoming.reset_index(drop=True).copy()
+    existing = current.set_index("sampleid").reindex(diff["sampleid"]).reset_index(drop=True)
+    found = diff["sampleid"].isin(current["sampleid"]).to_numpy()
+
+    for col in columns:
+        diff[f"{col}_current"] = existing[col]
+        diff[f"{col}_changed"] = found & diff[col].notna().to_numpy() & ~_same_values(diff[col], existing[col], col)
+
+    changed = diff[[f"{col}_changed" for col in columns]].any(axis=1).to_numpy()
+    diff["status"] = np.select([~found, changed], ["missing", "changed"], "unchanged")
+    return diff
+
+
+def diff_edited_rows(edited, loaded, columns):
+    # Join rows edited in the grid to the same rows as they were read from pas_tracking, on the index they share
+    # (the session dataframe's row), so a row whose sampleid, kitid or samplerid was edited is still the same row.
+    # Unlike diff_return_sheet, clearing a cell is a change. Adds "<col>_changed" per column, the loaded
+    # "row_version" and "loaded_sampleid" (the key the row is stored under) and a status of new/changed/unchanged
+    diff = edited.copy()
+    original = loaded.reindex(diff.index)
+    found = diff.index.isin(loaded.index)
+
+    for col in columns:
+        both_empty = (diff[col].isna() & original[col].isna()).to_numpy()
+        diff[f"{col}_changed"] = found & ~(both_empty | _same_values(diff[col], original[col], col))
+
+    diff["row_version"] = original["row_version"] if "row_version" in original else None
+    diff["loaded_sampleid"] = original["sampleid"]
+    changed = diff[[f"{col}_changed" for col in columns]].any(axis=1).to_numpy()
+    diff["status"] = np.select([~found, changed], ["new", "changed"], "unchanged")
+    return diff
+
+
+def grid_cells(df):
+    # Cell values as text, blanks as "", to compare rows the way the grid shows them
+    return df.astype(object).where(df.notna(), "").astype(str)
+
+
+def merge_refreshed_rows(rows, loaded, fresh, own=False, add_new=True):
+    # Merges rows just read from pas_tracking (`fresh`, as the grid shows them, with row_version) into a table's
+    # rows (`rows`, indexed like `loaded`, the rows as they were read). Returns (refreshed, added, loaded rows to
+    # store, cells kept, conflicts): the table rows that differ after the merge, fresh rows new to the table (when
+    # add_new, indexed after the table's last row) and the counts of locally edited cells kept and of those also
+    # changed in the database.
+    # A row is matched on the sampleid it was loaded with, so a row whose key was edited keeps its identity. Rows
+    # without one (new rows) are matched on their current sampleid, and so are rows whose edited key was just
+    # saved by this table (own)
+    fresh_ids = fresh["sampleid"].astype(str)
+    loaded_ids = loaded["sampleid"].astype(str).reindex(rows.index)
+    current_ids = rows["sampleid"].astype(str)
+    by_loaded = loaded_ids.isin(fresh_ids).to_numpy()
+    by_current = ~by_loaded & (loaded_ids.isna().to_numpy() | own) & current_ids.isin(fresh_ids).to_numpy()
+    row_for_sampleid = pd.concat([
+        pd.Series(rows.index[by_loaded], index=loaded_ids[by_loaded].to_numpy()),
+        pd.Series(rows.index[by_current], index=current_ids[by_current].to_numpy()),
+    ])
+    row_for_sampleid = row_for_sampleid[~row_for_sampleid.index.duplicated()].astype(object)
+    known = fresh_ids.isin(row_for_sampleid.index).to_numpy()
+
+    fresh = fresh.set_axis(pd.Index(row_for_sampleid.reindex(fresh_ids).to_numpy()))
+    replaced = fresh.loc[known, rows.columns].copy()
+    current = rows.loc[replaced.index]
+
+    # Cells edited locally keep their value. When the database changed the same cell to something else, that is a
+    # conflict: the row keeps its old loaded row (and row_version), so uploading it reports the conflict
+    compared = list(rows.columns)
+    original = loaded.reindex(index=current.index, columns=compared)
+    was_loaded = current.index.isin(loaded.index)
+    original_cells = grid_cells(original).to_numpy()
+    current_cells = grid_cells(current).to_numpy()
+    fresh_cells = grid_cells(replaced).to_numpy()
+    dirty = (current_cells != original_cells) | ~was_loaded[:, None]
+    conflicts = dirty & (fresh_cells != original_cells) & (fresh_cells != current_cells) & was_loaded[:, None]
+    replaced[compared] = replaced[compared].astype(object).where(~dirty, current[compared].astype(object))
+    refreshed = replaced[(grid_cells(replaced) != grid_cells(current)).any(axis=1)]
+
+    new_rows = ~known if add_new else np.zeros(len(fresh), dtype=bool)
+    # Only tables indexed by position get new rows (the infinite grid's rows are indexed by sampleid)
+    next_row = int(rows.index.max()) + 1 if add_new and not rows.empty else 0
+    added_loaded = fresh[new_rows].set_axis(pd.RangeIndex(next_row, next_row + int(new_rows.sum())))
+
+    # Rows without conflicts, and rows that match the database anyway (e.g. just uploaded), become loaded rows
+    in_sync = (was_loaded & ~conflicts.any(axis=1)) | (fresh_cells == current_cells).all(axis=1)
+    loaded_rows = pd.concat([fresh.loc[current.index[in_sync]], added_loaded])
+    kept = int((dirty & was_loaded[:, None]).sum())
+    return refreshed, added_loaded[rows.columns], loaded_rows, kept, int(conflicts.sum())
+
+
+def touches_location(fresh, location, locations=()):
+    # Whether a change to some kits concerns a location search, matched as queries matches it (trimmed, any case):
+    # one of the kits' rows (`fresh`, as just read) is at the location, or the change names it among the locations
+    # its rows had before
+    def keys(values):
+        return {str(value).strip().lower() for value in values if pd.notna(value)}
+    return str(location).strip().lower() in keys(fresh["shipped_location"]) | keys(locations or ())
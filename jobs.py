@@ -0,0 +1,72 @@
+import os
+
+import diskcache
+import multiprocess
+import psutil
+from dash import DiskcacheManager
+
+# Long database jobs (uploads, overwrites, returned-kit updates) run as Dash background callbacks in processes
+# started by this manager, so gunicorn request threads stay free. The cache directory holds job progress and
+# results and is shared by every worker on the host, so whichever worker is polled can answer
+BACKGROUND_CACHE_DIR = os.getenv("BACKGROUND_CACHE_DIR", "cache/background")
+
+# Shown/hidden by the `running` argument of each background callback
+JOB_PROGRESS_VISIBLE = {"display": "flex", "justifyContent": "center", "alignItems": "center", "marginTop": "10px"}
+JOB_PROGRESS_HIDDEN = {"display": "none"}
+
+
+# How job processes are started. "fork" copies the calling gunicorn worker, including locks and SQLite connections
+# that its request threads hold at that moment, which can leave the job waiting forever. "forkserver" forks each job
+# from a server process that imported the app once and serves no requests. Importing the app does start threads
+# there (the log queue listener, and the edit journal writer when EDIT_JOURNAL_PATH is set), but none of them holds
+# a lock for long, and the after-fork resets (forking.py) replace what they leave behind in the job
+JOB_START_METHOD = os.getenv("JOB_START_METHOD", "forkserver")
+
+
+class JobManager(DiskcacheManager):
+    def __init__(self, cache, start_method=JOB_START_METHOD, preload=()):
+        super().__init__(cache)
+        self.start_method = start_method
+        self.preload = list(preload)
+        self._context = None
+
+    def _get_context(self):
+        if self._context is None:
+            self._context = multiprocess.get_context(self.start_method)
+            if self.start_method == "forkserver":
+                self._context.set_forkserver_preload(self.preload)
+        return self._context
+
+    def call_job_fn(self, key, job_fn, args, context):
+        process = self._get_context().Process(target=job_fn, args=(key, self._make_progress_key(key), args, context))
+        process.start()
+        return process.pid
+
+    # The forkserver reaps jobs as soon as they exit, so a job can disappear between Dash's pid check and its kill
+    def terminate_job(self, job):
+        try:
+            super().terminate_job(job)
+        except psutil.NoSuchProcess:
+            pass
+
+    def job_running(self, job):
+        try:
+            return super().job_running(job)
+        except psutil.NoSuchProcess:
+            return False
+
+
+def create_background_manager(module_name, shared_state=True):
+    # module_name is the module defining the background callbacks; the forkserver imports it once, up front.
+    # Jobs are forked from the worker instead when the module runs as a script (__main__, it cannot be re-imported
+    # by name) or when the state they read only lives in the worker's memory (shared_state=False)
+    start_method = JOB_START_METHOD if module_name != "__main__" and shared_state else "fork"
+    return JobManager(diskcache.Cache(BACKGROUND_CACHE_DIR), start_method, preload=[module_name])
+
+
+def progress_reporter(set_progress, label):
+    # Adapts a background callback's set_progress to the (done, total) callbacks used in queries.py
+    def report(done, total):
+        percent = int(100 * done / total) if total else 100
+        set_progress((percent, f"{label} {done}/{total}"))
+    return report
@@ -0,0 +1,76 @@
+import atexit
+import csv
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Set EDIT_JOURNAL_PATH to record every table edit (replaces the old debug_database_df.csv dump)
+EDIT_JOURNAL_PATH = os.getenv("EDIT_JOURNAL_PATH")
+EDIT_JOURNAL_FLUSH_SECONDS = float(os.getenv("EDIT_JOURNAL_FLUSH_SECONDS", "2"))
+
+JOURNAL_FIELDS = ["timestamp", "session_id", "rowid", "column", "old_value", "new_value"]
+
+
+class EditJournal:
+    # Buffered CSV journal of cell edits. Requests only enqueue; a daemon thread appends to disk in batches
+    def __init__(self, path, flush_seconds=EDIT_JOURNAL_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="edit-journal", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def record(self, session_id, rowid, column, old_value, new_value):
+        self._queue.put({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "session_id": session_id,
+            "rowid": rowid,
+            "column": column,
+            "old_value": old_value,
+            "new_value": new_value,
+        })
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self._write(self._drain())
+
+    def _drain(self):
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return records
+
+    def _write(self, records):
+        if not records:
+            return
+        with self._write_lock:
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=JOURNAL_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(records)
+
+    def flush(self):
+        self._write(self._drain())
+
+
+class NullJournal:
+    def record(self, session_id, rowid, column, old_value, new_value):
+        pass
+
+    def flush(self):
+        pass
+
+
+def create_edit_journal():
+    if EDIT_JOURNAL_PATH:
+        return EditJournal(EDIT_JOURNAL_PATH)
+    return NullJournal()
@@ -0,0 +1,247 @@
+import collections
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from flask import Response, request
+from sqlalchemy import text
+
+from forking import after_fork
+
+# How changes to pas_tracking reach other open tabs: "postgres" (LISTEN/NOTIFY, every worker and host),
+# "memory" (this process only; single worker or local development) or "off"
+KIT_EVENTS = os.getenv("KIT_EVENTS", "postgres")
+KIT_EVENTS_CHANNEL = "pas_tracking_changes"
+
+# Each open stream holds a gunicorn thread for as long as its tab is open, so streams per worker are capped at the
+# worker's threads (GUNICORN_THREADS, as passed to --threads) minus those kept for requests. Browsers turned away
+# get a 204, which stops their EventSource, and poll events/recent instead. Without GUNICORN_THREADS every tab polls
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "0"))
+KIT_EVENTS_REQUEST_THREADS = int(os.getenv("KIT_EVENTS_REQUEST_THREADS", "8"))
+KIT_EVENTS_MAX_STREAMS = int(os.getenv("KIT_EVENTS_MAX_STREAMS", max(GUNICORN_THREADS - KIT_EVENTS_REQUEST_THREADS, 0)))
+
+# Events kept per worker, with the time they arrived, for the tabs that poll
+KIT_EVENTS_RECENT = int(os.getenv("KIT_EVENTS_RECENT", "1000"))
+
+# A comment line is sent on idle streams so proxies keep them open and closed tabs are noticed
+KIT_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("KIT_EVENTS_HEARTBEAT_SECONDS", "30"))
+
+# Browser reconnect delay after a dropped stream
+KIT_EVENTS_RETRY_MS = 10000
+
+# NOTIFY payloads are limited to 8000 bytes, so large uploads are announced in several notifications
+NOTIFY_KITS_PER_EVENT = 200
+NOTIFY_LOCATIONS_PER_EVENT = 50
+LISTEN_IDLE_CHECK_SECONDS = 60
+LISTEN_RETRY_SECONDS = 5
+
+# Hubs created in this process, so they can be reset after a fork
+_hubs = []
+
+
+def _events(kitids, origin, locations=()):
+    # Locations are the shipped locations the written rows have or had, for the tabs showing a location search
+    kitids = sorted({str(kitid) for kitid in kitids if kitid})
+    locations = sorted({str(location) for location in locations or () if location})
+    chunks = max(-(-len(kitids) // NOTIFY_KITS_PER_EVENT), -(-len(locations) // NOTIFY_LOCATIONS_PER_EVENT))
+    for n in range(chunks):
+        event = {"kitids": kitids[n * NOTIFY_KITS_PER_EVENT:(n + 1) * NOTIFY_KITS_PER_EVENT], "origin": origin}
+        if locations[n * NOTIFY_LOCATIONS_PER_EVENT:]:
+            event["locations"] = locations[n * NOTIFY_LOCATIONS_PER_EVENT:(n + 1) * NOTIFY_LOCATIONS_PER_EVENT]
+        yield event
+
+
+class KitEventHub:
+    # Fans events out to the streams open in this process. publish() only reaches this process
+    def __init__(self, max_streams=KIT_EVENTS_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._subscribers = []
+        self._recent = collections.deque(maxlen=KIT_EVENTS_RECENT)
+        self._lock = threading.Lock()
+        _hubs.append(self)
+
+    def subscribe(self):
+        # Returns a queue of events, or None when this worker already serves max_streams streams
+        with self._lock:
+            if len(self._subscribers) >= self.max_streams:
+                return None
+            subscription = queue.SimpleQueue()
+            self._subscribers.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def start(self):
+        pass
+
+    def publish(self, kitids, origin=None, locations=()):
+        for event in _events(kitids, origin, locations):
+            self._dispatch(event)
+
+    def recent(self, since=None):
+        # (now, events received since `since`), both as this server's time.time(). Without `since`, no events:
+        # the caller only learns where to start from
+        with self._lock:
+            now = time.time()
+            events = [event for received, event in self._recent if since is not None and received >= since]
+        return now, events
+
+    def _dispatch(self, event):
+        with self._lock:
+            self._recent.append((time.time(), event))
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def stats(self):
+        with self._lock:
+            return {"streams": len(self._subscribers), "max_streams": self.max_streams, "recent": len(self._recent)}
+
+
+class PostgresKitEventHub(KitEventHub):
+    # publish() sends a NOTIFY; a listener thread per worker (started with its first request) receives the
+    # notifications of every worker and host, this one included, and fans them out. Polling tabs may ask any
+    # worker, since each keeps the events it received
+    def __init__(self, engine, channel=KIT_EVENTS_CHANNEL, max_streams=KIT_EVENTS_MAX_STREAMS):
+        super().__init__(max_streams)
+        self.engine = engine
+        self.channel = channel
+        self._listener = None
+
+    def publish(self, kitids, origin=None, locations=()):
+        with self.engine.begin() as conn:
+            for event in _events(kitids, origin, locations):
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": json.dumps(event)})
+
+    def start(self):
+        # Events are only received (and kept for polling tabs) while the listener runs
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="kit-events", daemon=True)
+                self._listener.start()
+
+    def subscribe(self):
+        self.start()
+        return super().subscribe()
+
+    def recent(self, since=None):
+        self.start()
+        return super().recent(since)
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                # A dedicated connection, detached so it does not hold a pool slot
+                connection = self.engine.raw_connection()
+                conn = connection.driver_connection
+                connection.detach()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+
+                while True:
+                    if select.select([conn], [], [], LISTEN_IDLE_CHECK_SECONDS) == ([], [], []):
+                        # Nothing for a while: make sure the connection is still alive
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1")
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(json.loads(conn.notifies.pop(0).payload))
+            except Exception as e:
+                logging.error(f"Kit event listener failed ({e}), reconnecting in {LISTEN_RETRY_SECONDS}s")
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+
+class NullKitEventHub:
+    def start(self):
+        pass
+
+    def subscribe(self):
+        return None
+
+    def unsubscribe(self, subscription):
+        pass
+
+    def publish(self, kitids, origin=None, locations=()):
+        pass
+
+    def recent(self, since=None):
+        return None
+
+    def stats(self):
+        return {"streams": 0, "max_streams": 0, "recent": 0}
+
+
+@after_fork
+def _reset_after_fork():
+    # Neither the streams nor the listener thread exist in a forked child
+    for hub in _hubs:
+        hub._lock = threading.Lock()
+        hub._subscribers = []
+        hub._recent.clear()
+        if isinstance(hub, PostgresKitEventHub):
+            hub._listener = None
+
+
+def create_kit_event_hub(engine):
+    if KIT_EVENTS == "postgres":
+        return PostgresKitEventHub(engine)
+    if KIT_EVENTS == "memory":
+        return KitEventHub()
+    return NullKitEventHub()
+
+
+def register_events_route(server, hub, routes_pathname_prefix="/"):
+    # A polling tab may ask any worker for the events since its last poll, so workers listen from their first request
+    # (a page load, usually), not from their first poll
+    server.before_request(hub.start)
+
+    # Server-sent events: {"kitids": [...], "origin": session id} whenever kits are written. Nothing is sent
+    # to an idle browser except the heartbeat comment
+    @server.route(f"{routes_pathname_prefix}events")
+    def kit_events_stream():
+        subscription = hub.subscribe()
+        if subscription is None:
+            return Response(status=204)
+
+        def stream():
+            try:
+                yield f"retry: {KIT_EVENTS_RETRY_MS}\n\n"
+                while True:
+                    try:
+                        event = subscription.get(timeout=KIT_EVENTS_HEARTBEAT_SECONDS)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield f"data: {json.dumps(event)}\n\n"
+            finally:
+                hub.unsubscribe(subscription)
+
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # Polling fallback for tabs turned away from a stream: {"now": ..., "events": [...]} with the events received
+    # after `since` (the previous answer's "now"). 204 when live updates are off, which stops the polling
+    @server.route(f"{routes_pathname_prefix}events/recent")
+    def kit_events_recent():
+        recent = hub.recent(request.args.get("since", type=float))
+        if recent is None:
+            return Response(status=204)
+        now, events = recent
+        return Response(json.dumps({"now": now, "events": events}), mimetype="application/json", headers={"Cache-Control": "no-cache"})
+
+    return kit_events_stream
@@ -0,0 +1,132 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from datetime import datetime, timezone
+
+from forking import after_fork
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: a single process, no locking needed
+    fcntl = None
+
+# Log file and rotation, overridable per deployment. LOG_ROTATE_WHEN (e.g. "midnight") switches from size to time rotation
+LOG_PATH = os.getenv("LOG_PATH", "logs/log.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+
+# Fields copied onto every record logged while set, e.g. {"callback": ..., "user": ...} for the callback being run
+log_context = contextvars.ContextVar("log_context", default={})
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` or log_context
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _SharedFileMixin:
+    # Every gunicorn worker appends to the same file. An flock on a sidecar file serialises writes and rollovers
+    # between processes, and a process reopens the file when another one has already rotated it
+    def _open_lock(self):
+        self._lock_file = open(self.baseFilename + ".lock", "a") if fcntl else None
+
+    def _rotated_elsewhere(self):
+        try:
+            return os.fstat(self.stream.fileno()).st_ino != os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            return True
+
+    def emit(self, record):
+        if self._lock_file is None:
+            return super().emit(record)
+
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if self.stream is not None and self._rotated_elsewhere():
+                self.stream.close()
+                self.stream = None
+                if hasattr(self, "rolloverAt"):
+                    self.rolloverAt = self.computeRollover(int(time.time()))
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+
+class SharedRotatingFileHandler(_SharedFileMixin, logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self._open_lock()
+
+
+class SharedTimedRotatingFileHandler(_SharedFileMixin, logging.handlers.TimedRotatingFileHandler):
+    def __init__(self, filename, when=LOG_ROTATE_WHEN, backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding="utf-8", delay=True)
+        self._open_lock()
+
+
+_configured = None
+
+
+def configure_logging(path=LOG_PATH):
+    # Request threads only put records on a queue; a listener thread formats and writes them. Returns the listener
+    global _configured
+    if _configured is not None:
+        return _configured
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    file_handler = SharedTimedRotatingFileHandler(path) if LOG_ROTATE_WHEN else SharedRotatingFileHandler(path)
+    file_handler.setFormatter(JsonFormatter())
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(ContextFilter())
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    def swap_to_file_handler():
+        # The listener thread does not exist in a forked child (background jobs). Jobs end with os._exit, which
+        # would drop anything still queued, so the child writes its records directly instead
+        root.removeHandler(queue_handler)
+        file_handler.addFilter(ContextFilter())
+        root.addHandler(file_handler)
+
+    after_fork(swap_to_file_handler)
+
+    _configured = listener
+    return listener
@@ -0,0 +1,236 @@
+import bisect
+import json
+import logging
+import threading
+import time
+
+from flask import Response, has_request_context, request
+from sqlalchemy import event
+
+from forking import after_fork
+from logconfig import log_context
+
+# Latency buckets in seconds and payload buckets in bytes (1 KB to 64 MB)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+# Callback outputs whose serialized size is tracked separately
+PAYLOAD_OUTPUTS = {
+    "database-table.rowData",
+    "duplicate-rows.data",
+    "location-table.getRowsResponse",
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+CALLBACK_SECONDS = Histogram("dash_callback_duration_seconds", "Time spent in each Dash callback.", ("callback",))
+CALLBACK_RESPONSE_BYTES = Histogram(
+    "dash_callback_response_bytes", "Serialized size of each callback response.", ("callback",), BYTES_BUCKETS
+)
+PAYLOAD_BYTES = Histogram(
+    "dash_output_payload_bytes", "Serialized size of large grid and store outputs.", ("output",), BYTES_BUCKETS
+)
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement execution time.", ("database", "statement"))
+POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection.", ("database",))
+
+HISTOGRAMS = [CALLBACK_SECONDS, CALLBACK_RESPONSE_BYTES, PAYLOAD_BYTES, QUERY_SECONDS, POOL_WAIT_SECONDS]
+
+# One structured record per callback: name, user, duration and rows sent (see logconfig.py)
+_callback_logger = logging.getLogger("callbacks")
+
+# Functions returning [(metric name, help, type, labels, value)], read on every scrape (pool, caches, ...)
+_collectors = []
+CALLBACK_ERRORS = {}
+_errors_lock = threading.Lock()
+
+
+@after_fork
+def _reset_after_fork():
+    # Background jobs forked from a worker record their SQL timings too; a lock held at fork time would block them
+    global _errors_lock
+    for histogram in HISTOGRAMS:
+        histogram._lock = threading.Lock()
+    _errors_lock = threading.Lock()
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def _count_error(name):
+    with _errors_lock:
+        CALLBACK_ERRORS[name] = CALLBACK_ERRORS.get(name, 0) + 1
+
+
+def _timed_callback(func, name, payload_outputs):
+    def timed(*args, **kwargs):
+        # Records logged while the callback runs carry its name and user
+        user = request.headers.get("Dh-User") if has_request_context() else None
+        token = log_context.set({"callback": name, "user": user})
+        start = time.perf_counter()
+        response, failed = None, False
+        try:
+            response = func(*args, **kwargs)
+        except Exception as e:
+            # PreventUpdate and friends are expected control flow; only count real failures
+            if not type(e).__module__.startswith("dash"):
+                _count_error(name)
+                failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            CALLBACK_SECONDS.observe(elapsed, callback=name)
+            rows = None
+            if isinstance(response, str):
+                CALLBACK_RESPONSE_BYTES.observe(len(response), callback=name)
+                if payload_outputs:
+                    rows = _observe_payloads(response, payload_outputs)
+            _callback_logger.log(logging.ERROR if failed else logging.INFO, "Callback finished", extra={
+                "duration_ms": round(elapsed * 1000, 1), "rows": rows, "failed": failed,
+            })
+            log_context.reset(token)
+        return response
+
+    timed.__name__ = name
+    timed.__wrapped__ = func
+    timed.instrumented = True
+    return timed
+
+
+def _observe_payloads(response, payload_outputs):
+    # Returns the number of grid rows sent, or None when no payload output was in the response
+    try:
+        outputs = json.loads(response).get("response", {})
+    except ValueError:
+        return None
+    rows = None
+    for output in payload_outputs:
+        component_id, prop = output.rsplit(".", 1)
+        if prop in outputs.get(component_id, {}):
+            value = outputs[component_id][prop]
+            PAYLOAD_BYTES.observe(len(json.dumps(value, separators=(",", ":"))), output=output)
+            if isinstance(value, dict):
+                value = value.get("rowData")
+            if isinstance(value, list):
+                rows = (rows or 0) + len(value)
+    return rows
+
+
+def instrument_callbacks(app):
+    # Wrap every registered server-side callback. Call once, after the last @app.callback
+    for output, spec in app.callback_map.items():
+        func = spec.get("callback")
+        if func is None or getattr(func, "instrumented", False):
+            continue
+        name = getattr(func, "__name__", output)
+        payload_outputs = [o for o in PAYLOAD_OUTPUTS if o in output]
+        spec["callback"] = _timed_callback(func, name, payload_outputs)
+
+
+def instrument_engine(engine, pool_stats=None):
+    database = engine.url.database or "default"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        QUERY_SECONDS.observe(elapsed, database=database, statement=statement.lstrip().split(None, 1)[0].upper())
+
+    engine.pool.stats.observers.append(lambda seconds: POOL_WAIT_SECONDS.observe(seconds, database=database))
+
+    if pool_stats is not None:
+        def collect_pool():
+            stats = pool_stats(engine)
+            labels = {"database": database}
+            return [
+                ("db_pool_checked_out", "Connections currently checked out.", "gauge", labels, stats["checked_out"]),
+                ("db_pool_checked_in", "Idle connections in the pool.", "gauge", labels, stats["checked_in"]),
+                ("db_pool_overflow", "Connections open above the pool size.", "gauge", labels, stats["overflow"]),
+                ("db_pool_connects_total", "New database connections opened.", "counter", labels, stats["connects"]),
+                ("db_pool_invalidations_total", "Connections invalidated.", "counter", labels, stats["invalidations"]),
+            ]
+        register_collector(collect_pool)
+
+
+def register_stats(prefix, stats, labels=None):
+    # Expose the numeric fields of a stats() dict (caches, session store, secrets) as gauges named <prefix>_<field>
+    def collect():
+        return [
+            (f"{prefix}_{key}", f"{prefix.replace('_', ' ')} {key.replace('_', ' ')}.", "gauge", labels or {}, float(value))
+            for key, value in stats().items() if isinstance(value, (int, float))
+        ]
+    register_collector(collect)
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+
+    lines += ["# HELP dash_callback_errors_total Callbacks that raised an error.", "# TYPE dash_callback_errors_total counter"]
+    with _errors_lock:
+        lines += [f"dash_callback_errors_total{_format_labels({'callback': k})} {v}" for k, v in sorted(CALLBACK_ERRORS.items())]
+
+    declared = set()
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            logging.error(f"Metrics collector failed: {e}")
+            continue
+        for name, help_text, metric_type, labels, value in samples:
+            if name not in declared:
+                declared.add(name)
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def register_metrics_route(server, routes_pathname_prefix="/"):
+    # Metrics are per worker process; each gunicorn worker answers with its own counters
+    @server.route(f"{routes_pathname_prefix}metrics")
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+    return metrics
@@ -0,0 +1,83 @@
+import argparse
+import logging
+import sys
+
+from sqlalchemy import text
+
+from credentials import connection_params
+from database import create_pooled_engine
+from queries import SAMPLEID_UNIQUE_CHECK
+
+# One-off schema changes for pas_tracking, run by hand (or as a deploy step) outside the web process:
+#   python migrate.py [--local]
+# Indexes are built CONCURRENTLY, one statement per transaction, so writes to pas_tracking continue while they build.
+# Every statement is idempotent, so running it again is safe
+
+# Indexes backing the Update modal lookups
+TRACKING_INDEXES = {
+    "pas_tracking_kitid_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS pas_tracking_kitid_idx ON pas_tracking (kitid)",
+    "pas_tracking_samplerid_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS pas_tracking_samplerid_idx ON pas_tracking (samplerid, sample_start DESC NULLS LAST)",
+    "pas_tracking_location_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS pas_tracking_location_idx ON pas_tracking (lower(trim(shipped_location)))",
+    "pas_tracking_shipped_location_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS pas_tracking_shipped_location_idx ON pas_tracking (shipped_location)",
+}
+
+# Uploads rely on INSERT ... ON CONFLICT (sampleid), which needs a unique index on sampleid
+SAMPLEID_UNIQUE_INDEX = "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS pas_tracking_sampleid_key ON pas_tracking (sampleid)"
+
+# A CONCURRENTLY build that fails (e.g. a duplicate sampleid) leaves an invalid index behind, which IF NOT EXISTS
+# would then skip. Those are dropped and built again
+INVALID_INDEX_CHECK = """
+    SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = 'pas_tracking'::regclass AND NOT i.indisvalid
+"""
+
+DUPLICATE_SAMPLEIDS = """
+    SELECT sampleid, count(*) FROM pas_tracking WHERE sampleid IS NOT NULL
+    GROUP BY sampleid HAVING count(*) > 1 ORDER BY sampleid LIMIT 20
+"""
+
+
+def migrate_tracking_indexes(engine):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block, hence AUTOCOMMIT
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        for name in conn.execute(text(INVALID_INDEX_CHECK)).scalars():
+            if name in TRACKING_INDEXES or name == "pas_tracking_sampleid_key":
+                logging.warning(f"Dropping invalid index {name} left by an earlier failed build")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+        for name, statement in TRACKING_INDEXES.items():
+            logging.info(f"Building {name}")
+            conn.execute(text(statement))
+
+        if conn.execute(text(SAMPLEID_UNIQUE_CHECK)).first() is None:
+            duplicates = conn.execute(text(DUPLICATE_SAMPLEIDS)).all()
+            if duplicates:
+                listed = ", ".join(f"{sampleid} ({count})" for sampleid, count in duplicates)
+                raise RuntimeError(f"pas_tracking has duplicate sampleids, remove them before migrating: {listed}")
+            logging.info("Building pas_tracking_sampleid_key")
+            conn.execute(text(SAMPLEID_UNIQUE_INDEX))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the pas_tracking indexes the app relies on.")
+    parser.add_argument("--local", action="store_true", help="read credentials from the environment/.env instead of Key Vault")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    def connect_params():
+        return connection_params('DATAHUB_PSQL_SERVER', 'DATAHUB_PSQL_USER', 'DATAHUB_PSQL_PASSWORD', args.local)
+
+    engine = create_pooled_engine("postgresql:///mercury_passive?sslmode=require", connect_params)
+    try:
+        migrate_tracking_indexes(engine)
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        sys.exit(1)
+    logging.info("pas_tracking indexes are up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import os
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import MetaData, Table, literal_column, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+# Columns of pas_tracking edited through the app, in table display order
+TRACKING_COLUMNS = [
+    'sample_start', 'sample_end', 'sampleid', 'kitid', 'samplerid',
+    'siteid', 'shipped_location', 'shipped_date', 'return_date',
+    'sample_type', 'note', 'screen_sampling_rate'
+]
+
+# Rows sent per INSERT ... ON CONFLICT statement
+UPSERT_BATCH_SIZE = 1000
+
+# xmin changes every time a row is written, so it serves as a row version for optimistic concurrency checks
+# without a schema change. Rows are read with it and edits are only saved if it is still the same
+ROW_VERSION = "xmin::text AS row_version"
+TRACKING_VERSION_CHECK = os.getenv("TRACKING_VERSION_CHECK", "true").lower() in ("1", "true", "yes")
+
+# Any valid single column unique index (or primary key) on sampleid satisfies ON CONFLICT (sampleid)
+SAMPLEID_UNIQUE_CHECK = """
+    SELECT 1 FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = 'pas_tracking'::regclass AND i.indisunique AND i.indisvalid AND i.indnatts = 1
+        AND i.indpred IS NULL AND a.attname = 'sampleid'
+"""
+
+# Engines on which the unique sampleid index was found, so the check runs once per process
+_sampleid_key_found = set()
+
+
+def require_sampleid_key(conn):
+    # Read-only. The index is created by migrate.py, never by the app; without it every upsert would fail with
+    # Postgres' "no unique or exclusion constraint matching the ON CONFLICT specification"
+    if conn.engine in _sampleid_key_found:
+        return
+    if conn.execute(text(SAMPLEID_UNIQUE_CHECK)).first() is None:
+        raise RuntimeError("pas_tracking has no unique index on sampleid: run `python migrate.py` before uploading")
+    _sampleid_key_found.add(conn.engine)
+
+
+@lru_cache(maxsize=None)
+def tracking_table(engine):
+    return Table("pas_tracking", MetaData(), autoload_with=engine)
+
+
+def fetch_by_kitid(engine, kitid):
+    query = text(f"SELECT *, {ROW_VERSION} FROM pas_tracking WHERE kitid = :kitid")
+    return pd.read_sql_query(query, engine, params={"kitid": kitid})
+
+
+def fetch_by_kitids(engine, kitids):
+    query = text(f"SELECT *, {ROW_VERSION} FROM pas_tracking WHERE kitid = ANY(:kitids)")
+    return pd.read_sql_query(query, engine, params={"kitids": [str(kitid) for kitid in kitids]})
+
+
+def fetch_latest_kit_for_samplerid(engine, samplerid):
+    # All rows of the kit that most recently used the sampler (by sample_start), in one round trip.
+    # The inner lookup is a single probe of the (samplerid, sample_start DESC NULLS LAST) index
+    query = text(
+        f"SELECT *, {ROW_VERSION} FROM pas_tracking WHERE kitid = ("
+        "SELECT kitid FROM pas_tracking "
+        "WHERE samplerid = :samplerid AND kitid IS NOT NULL "
+        "ORDER BY sample_start DESC NULLS LAST LIMIT 1)"
+    )
+    return pd.read_sql_query(query, engine, params={"samplerid": samplerid})
+
+
+def fetch_by_location(engine, location):
+    # Case and whitespace insensitive match, served by the lower(trim()) expression index
+    query = text(f"SELECT *, {ROW_VERSION} FROM pas_tracking WHERE lower(trim(shipped_location)) = lower(trim(:location))")
+    return pd.read_sql_query(query, engine, params={"location": location})
+
+
+def count_by_location(engine, location):
+    query = text("SELECT count(*) FROM pas_tracking WHERE lower(trim(shipped_location)) = lower(trim(:location))")
+    with engine.connect() as conn:
+        return conn.execute(query, {"location": location}).scalar()
+
+
+# AG Grid text filter operators, applied to the column cast to text. Values are bound parameters
+GRID_TEXT_FILTERS = {
+    "contains": ("{col} ILIKE :{param}", "%{value}%"),
+    "notContains": ("({col} IS NULL OR {col} NOT ILIKE :{param})", "%{value}%"),
+    "equals": ("{col} ILIKE :{param}", "{value}"),
+    "notEqual": ("({col} IS NULL OR {col} NOT ILIKE :{param})", "{value}"),
+    "startsWith": ("{col} ILIKE :{param}", "{value}%"),
+    "endsWith": ("{col} ILIKE :{param}", "%{value}"),
+}
+
+# AG Grid date filter operators, compared on the date part
+GRID_DATE_FILTERS = {
+    "equals": "=",
+    "notEqual": "<>",
+    "lessThan": "<",
+    "greaterThan": ">",
+}
+
+
+def _escape_like(value):
+    return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _grid_filter_sql(col, model, params):
+    # Translate one column of an AG Grid filter model into a SQL condition. Column names are checked against
+    # TRACKING_COLUMNS before they reach the SQL text; everything typed by the user is a bound parameter
+    if col not in TRACKING_COLUMNS:
+        raise ValueError(f"Unknown column '{col}'")
+
+    if "conditions" in model:
+        joiner = " OR " if model.get("operator") == "OR" else " AND "
+        return "(" + joiner.join(_grid_filter_sql(col, condition, params) for condition in model["conditions"]) + ")"
+
+    as_text = f"CAST({col} AS text)"
+    op = model.get("type")
+    if op == "blank":
+        return f"({col} IS NULL OR trim({as_text}) = '')"
+    if op == "notBlank":
+        return f"({col} IS NOT NULL AND trim({as_text}) <> '')"
+
+    param = f"f{len(params)}"
+    if model.get("filterType") == "date":
+        as_date = f"CAST({col} AS date)"
+        if op == "inRange":
+            params[param], params[param + "_to"] = model["dateFrom"], model["dateTo"]
+            return f"({as_date} > CAST(:{param} AS date) AND {as_date} < CAST(:{param}_to AS date))"
+        if op not in GRID_DATE_FILTERS:
+            raise ValueError(f"Unsupported date filter '{op}'")
+        params[param] = model["dateFrom"]
+        return f"{as_date} {GRID_DATE_FILTERS[op]} CAST(:{param} AS date)"
+
+    if op not in GRID_TEXT_FILTERS:
+        raise ValueError(f"Unsupported text filter '{op}'")
+    condition, pattern = GRID_TEXT_FILTERS[op]
+    params[param] = pattern.format(value=_escape_like(model.get("filter", "")))
+    return condition.format(col=as_text, param=param)
+
+
+def _grid_order_sql(sort_model):
+    order = [
+        f"{sort['colId']} {'DESC' if sort.get('sort') == 'desc' else 'ASC'} NULLS LAST"
+        for sort in sort_model or [] if sort.get("colId") in TRACKING_COLUMNS
+    ]
+    # sampleid is unique, so block boundaries are stable between requests
+    return ", ".join(order + ["sampleid"])
+
+
+def fetch_location_block(engine, location, start_row, end_row, sort_model=None, filter_model=None):
+    # One block of a location search for the grid's infinite row model: only rows start_row..end_row are read.
+    # Returns (rows, total matching rows); the total is None when the block is past the end
+    params = {"location": location, "limit": max(end_row - start_row, 0), "offset": start_row}
+    conditions = ["lower(trim(shipped_location)) = lower(trim(:location))"]
+    conditions += [_grid_filter_sql(col, model, params) for col, model in (filter_model or {}).items()]
+    query = text(
+        "SELECT *, count(*) OVER () AS total_rows FROM pas_tracking "
+        f"WHERE {' AND '.join(conditions)} ORDER BY {_grid_order_sql(sort_model)} LIMIT :limit OFFSET :offset"
+    )
+    df = pd.read_sql_query(query, engine, params=params)
+    total = int(df["total_rows"].iloc[0]) if not df.empty else None
+    return df.drop(columns="total_rows"), total
+
+
+def fetch_shipped_locations(engine):
+    query = text(
+        "SELECT DISTINCT shipped_location FROM pas_tracking "
+        "WHERE shipped_location IS NOT NULL ORDER BY shipped_location"
+    )
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(query)]
+
+
+def fetch_existing_sampleids(engine, sampleids):
+    # Only the candidate ids are sent, so the check scales with the batch rather than the table
+    sampleids = list(dict.fromkeys(str(sid) for sid in sampleids))
+    if not sampleids:
+        return set()
+
+    query = text("SELECT sampleid FROM pas_tracking WHERE sampleid = ANY(:ids)")
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(query, {"ids": sampleids})}
+
+
+def _upsert_rows(conn, table, df, progress=None):
+    # Returns (sampleid, inserted) per row written
+    columns = [col for col in df.columns if col in table.c]
+    df = df[columns].drop_duplicates(subset="sampleid", keep="last")
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    if not records:
+        return []
+    require_sampleid_key(conn)
+
+    stmt = pg_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["sampleid"],
+        set_={col: stmt.excluded[col] for col in columns if col != "sampleid"}
+    ).returning(table.c.sampleid, literal_column("xmax = 0").label("inserted"))
+
+    written = []
+    conn = conn.execution_options(insertmanyvalues_page_size=UPSERT_BATCH_SIZE)
+    for start in range(0, len(records), UPSERT_BATCH_SIZE):
+        result = conn.execute(stmt, records[start:start + UPSERT_BATCH_SIZE])
+        written += [(row.sampleid, row.inserted) for row in result]
+        if progress:
+            progress(len(written), len(records))
+    return written
+
+
+def upsert_tracking_rows(engine, df, progress=None):
+    # Insert new rows and overwrite existing ones (matched on sampleid) in a single transaction.
+    # progress(done, total) is called after each batch. Returns (inserted, updated) counts
+    with engine.begin() as conn:
+        written = _upsert_rows(conn, tracking_table(engine), df, progress)
+
+    inserted = sum(flag for sampleid, flag in written)
+    return inserted, len(written) - inserted
+
+
+def fetch_by_sampleids(engine, sampleids, columns=None):
+    columns = [col for col in (columns or TRACKING_COLUMNS) if col in TRACKING_COLUMNS and col != "sampleid"]
+    query = text(f"SELECT sampleid, {', '.join(columns)}, {ROW_VERSION} FROM pas_tracking WHERE sampleid = ANY(:ids)")
+    return pd.read_sql_query(query, engine, params={"ids": [str(sid) for sid in sampleids]})
+
+
+def _as_text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat(sep=" ")
+    return str(value)
+
+
+class StaleRowsError(Exception):
+    # Rows changed (or deleted) by someone else since they were read; nothing was saved
+    def __init__(self, sampleids):
+        super().__init__(f"{len(sampleids)} entries were changed by someone else since they were loaded")
+        self.sampleids = sampleids
+
+
+def _update_changed_columns(conn, table, updates, columns, check_versions=False):
+    # One UPDATE statement; see update_changed_columns. Only columns changed in at least one row are set.
+    # Rows are matched on "loaded_sampleid" when given, so sampleid itself can be one of the changed columns.
+    # Returns the keys of the rows updated
+    columns = [col for col in columns if updates[f"{col}_changed"].any()]
+    keys = updates["loaded_sampleid"] if "loaded_sampleid" in updates.columns else updates["sampleid"]
+    params = {"key": keys.astype(str).tolist()}
+    arrays = ["CAST(:key AS text[])"]
+    aliases = ["key"]
+    set_clauses = []
+    for i, col in enumerate(columns):
+        sql_type = table.c[col].type.compile(dialect=conn.dialect)
+        params[f"v{i}"] = [_as_text(value) for value in updates[col].tolist()]
+        params[f"c{i}"] = updates[f"{col}_changed"].astype(bool).tolist()
+        arrays += [f"CAST(:v{i} AS text[])", f"CAST(:c{i} AS boolean[])"]
+        aliases += [f"v{i}", f"c{i}"]
+        set_clauses.append(f"{col} = CASE WHEN v.c{i} THEN CAST(v.v{i} AS {sql_type}) ELSE t.{col} END")
+
+    where = "t.sampleid = v.key"
+    if check_versions:
+        # Rows without a known version (not read through the app) are not checked
+        params["version"] = [_as_text(value) for value in updates["row_version"].tolist()]
+        arrays.append("CAST(:version AS text[])")
+        aliases.append("version")
+        where += " AND (v.version IS NULL OR t.xmin::text = v.version)"
+
+    query = text(
+        f"UPDATE pas_tracking AS t SET {', '.join(set_clauses)} "
+        f"FROM unnest({', '.join(arrays)}) AS v({', '.join(aliases)}) "
+        f"WHERE {where} RETURNING v.key"
+    )
+    return [row[0] for row in conn.execute(query, params)]
+
+
+def update_changed_columns(engine, updates, columns):
+    # Column-level UPDATE of existing rows in one statement and transaction. `updates` has a sampleid column and,
+    # for every name in `columns`, the new value plus a boolean "<col>_changed"; unchanged cells keep their value.
+    # Returns the number of rows updated
+    columns = [col for col in columns if col in TRACKING_COLUMNS and col != "sampleid"]
+    if updates.empty or not columns:
+        return 0
+
+    with engine.begin() as conn:
+        return len(_update_changed_columns(conn, tracking_table(engine), updates, columns))
+
+
+def save_tracking_changes(engine, new_rows, updates, columns, check_versions=TRACKING_VERSION_CHECK, progress=None):
+    # Edits to rows read from pas_tracking (`updates`, as for update_changed_columns, plus their row_version and
+    # the loaded_sampleid they were read with) are written column by column in batches, key columns included;
+    # other rows (`new_rows`) are upserted. One transaction: if any edited row was changed by someone else since
+    # it was read, StaleRowsError is raised and nothing is saved. Returns (inserted, overwritten, updated) counts
+    table = tracking_table(engine)
+    columns = [col for col in columns if col in TRACKING_COLUMNS]
+    check_versions = check_versions and "row_version" in updates.columns
+    total = len(new_rows) + len(updates)
+
+    with engine.begin() as conn:
+        updated = []
+        if columns:
+            for start in range(0, len(updates), UPSERT_BATCH_SIZE):
+                batch = updates.iloc[start:start + UPSERT_BATCH_SIZE]
+                updated += _update_changed_columns(conn, table, batch, columns, check_versions)
+                if progress:
+                    progress(start + len(batch), total)
+
+        keys = updates["loaded_sampleid"] if "loaded_sampleid" in updates.columns else updates["sampleid"]
+        stale = sorted(set(keys.astype(str)) - set(updated)) if columns else []
+        if stale:
+            raise StaleRowsError(stale)
+
+        report = (lambda done, _: progress(len(updates) + done, total)) if progress else None
+        written = _upsert_rows(conn, table, new_rows, report)
+
+    inserted = sum(flag for sampleid, flag in written)
+    return inserted, len(written) - inserted, len(updated)
@@ -0,0 +1,131 @@
+import bisect
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import queries
+from forking import after_fork
+
+# Seconds before users/stations are re-read from the dcp database
+REFERENCE_DATA_TTL = float(os.getenv("REFERENCE_DATA_TTL", "300"))
+
+# Seconds before the distinct shipped locations are re-read from pas_tracking
+LOCATION_CACHE_TTL = float(os.getenv("LOCATION_CACHE_TTL", "60"))
+
+# Caches created in this process, so they can be given fresh locks after a fork
+_caches = []
+
+
+@dataclass(frozen=True)
+class ReferenceData:
+    users: pd.DataFrame
+    stations: pd.DataFrame
+    site_labels: list = field(default_factory=list)
+    label_to_siteid: dict = field(default_factory=dict)
+    siteid_to_label: dict = field(default_factory=dict)
+
+
+def load_reference_data(engine):
+    users = pd.read_sql_table("users", engine)
+    stations = pd.read_sql_query("select * from stations", engine)
+
+    # Site labels shown in the grid look like "Description (SITEID)". Both directions are indexed once here,
+    # so the grid (siteid -> label) and uploads (label -> siteid) map whole columns with a dict lookup
+    mercury_sites = stations.query("projectid == 'MERCURY_PASSIVE'")
+    labels = mercury_sites["description"].astype(str) + " (" + mercury_sites["siteid"].astype(str) + ")"
+    label_to_siteid = dict(zip(labels, mercury_sites["siteid"]))
+    siteid_to_label = dict(zip(mercury_sites["siteid"], labels))
+
+    return ReferenceData(
+        users=users,
+        stations=stations,
+        site_labels=sorted(label_to_siteid),
+        label_to_siteid=label_to_siteid,
+        siteid_to_label=siteid_to_label,
+    )
+
+
+class ReferenceDataCache:
+    def __init__(self, engine, ttl=REFERENCE_DATA_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def get(self):
+        with self._lock:
+            if self._data is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self.hits += 1
+                return self._data
+
+            self.misses += 1
+            self._data = load_reference_data(self.engine)
+            self._loaded_at = time.monotonic()
+            return self._data
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "ttl": self.ttl, "loaded": self._data is not None}
+
+
+class LocationCache:
+    # Distinct shipped locations for the Update modal typeahead. Invalidated on upload; the TTL bounds
+    # staleness for uploads handled by other worker processes
+    def __init__(self, engine, ttl=LOCATION_CACHE_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def _get_index(self):
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self.hits += 1
+                return self._index
+
+            self.misses += 1
+            locations = queries.fetch_shipped_locations(self.engine)
+            # Sorted case-insensitive keys, so prefix searches are a bisect instead of a scan
+            pairs = sorted((loc.strip().lower(), loc) for loc in locations)
+            self._index = ([key for key, _ in pairs], [loc for _, loc in pairs])
+            self._loaded_at = time.monotonic()
+            return self._index
+
+    def get(self):
+        return self._get_index()[1]
+
+    def search(self, prefix="", limit=None):
+        keys, locations = self._get_index()
+        prefix = (prefix or "").strip().lower()
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff") if prefix else len(keys)
+        matches = locations[start:end]
+        return matches[:limit] if limit else matches
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "ttl": self.ttl, "loaded": self._index is not None}
+
+
+@after_fork
+def _reset_after_fork():
+    # The reference data lock is held for a whole database read, so a fork can easily catch it taken
+    for cache in _caches:
+        cache._lock = threading.Lock()
@@ -0,0 +1,348 @@
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from forking import after_fork
+
+# Backend selection and limits, overridable per deployment
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions/sessions.sqlite")
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "500"))
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# The SQLite store checks its limits every this many writes (per process) rather than on each one
+SESSION_STORE_EVICT_EVERY = int(os.getenv("SESSION_STORE_EVICT_EVERY", "50"))
+
+# SQLite bound parameters per statement are limited, so row lookups are sent in chunks
+ROW_LOOKUP_CHUNK = 500
+
+
+# Memory stores created in this process, so a forked background job gets usable locks
+_memory_stores = []
+
+
+def _sizeof(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return sys.getsizeof(value)
+
+
+def _row_key(value):
+    # Index values as plain Python objects, so numpy and Python ints of the same row pickle identically
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class MemorySessionStore:
+    # Per-process LRU of {session_id: {key: value}}. Only safe with a single worker process
+    def __init__(self, max_sessions=SESSION_STORE_MAX_SESSIONS, max_bytes=SESSION_STORE_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._session_locks = {}
+        _memory_stores.append(self)
+
+    @contextmanager
+    def lock(self, session_id):
+        # Serialises read-modify-write of one session between request threads (callbacks of the same tab can
+        # overlap). Reentrant, so helpers may take it again
+        with self._lock:
+            session_lock = self._session_locks.setdefault(session_id, threading.RLock())
+        with session_lock:
+            yield
+
+    def get(self, session_id, key, default=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or key not in session:
+                return default
+            self._sessions.move_to_end(session_id)
+            return session[key]
+
+    def set(self, session_id, key, value):
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {})
+            session[key] = value
+            self._sizes[session_id] = sum(_sizeof(v) for v in session.values())
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def get_rows(self, session_id, key, index):
+        # The rows of a stored dataframe whose index is in `index`, in stored order; None when there is no dataframe
+        with self._lock:
+            frame = self._sessions.get(session_id, {}).get(key)
+            if not isinstance(frame, pd.DataFrame):
+                return None
+            self._sessions.move_to_end(session_id)
+            return frame[frame.index.isin(list(index))].copy()
+
+    def set_rows(self, session_id, key, rows):
+        # Replaces the rows of a stored dataframe with the same index and appends the others. Only the new rows
+        # are added to the session size
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {})
+            frame = session.get(key)
+            if not isinstance(frame, pd.DataFrame):
+                frame = rows.iloc[:0]
+            rows = rows.reindex(columns=frame.columns)
+            present = rows.index.isin(frame.index)
+            if present.any():
+                # Cells may change type (e.g. a date typed into an empty float column)
+                frame = frame.astype({col: object for col in frame.columns if frame[col].dtype != object})
+                frame.loc[rows.index[present]] = rows[present].astype(object).to_numpy()
+            if not present.all():
+                frame = pd.concat([frame, rows[~present]]) if len(frame) else rows[~present]
+            session[key] = frame
+            self._sizes[session_id] = self._sizes.get(session_id, 0) + _sizeof(rows[~present])
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._sizes.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+
+    def _evict(self):
+        # Drop least recently used sessions, but never the one just written
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or sum(self._sizes.values()) > self.max_bytes
+        ):
+            session_id, _ = self._sessions.popitem(last=False)
+            self._sizes.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": sum(self._sizes.values()),
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteSessionStore:
+    # Session state in a local SQLite file, shared by every worker process and thread on the host. A dataframe is
+    # kept one pickled row per table row (keyed by its index), so editing a few cells reads and writes those rows
+    # only; other values are pickled whole
+    def __init__(self, path=SESSION_STORE_PATH, max_sessions=SESSION_STORE_MAX_SESSIONS, max_bytes=SESSION_STORE_MAX_BYTES,
+                 evict_every=SESSION_STORE_EVICT_EVERY):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.evictions = 0
+        self._writes = 0
+        # Connection of the lock() block the current thread is in, if any
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Whole-session pickles of earlier versions; sessions do not survive an upgrade
+            conn.execute("DROP TABLE IF EXISTS session_state")
+            # One row per value; for a dataframe, `value` is its column list and `frame` is 1
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_values ("
+                "session_id TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, frame INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (session_id, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_rows ("
+                "session_id TEXT NOT NULL, key TEXT NOT NULL, row_key BLOB NOT NULL, position INTEGER NOT NULL, "
+                "value BLOB NOT NULL, size INTEGER NOT NULL, PRIMARY KEY (session_id, key, row_key))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @contextmanager
+    def _connection(self):
+        # Inside lock() every read and write runs on the lock's connection and transaction
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        with self._connect() as conn:
+            yield conn
+
+    @contextmanager
+    def lock(self, session_id):
+        # Serialises read-modify-write of session state between threads and worker processes. BEGIN IMMEDIATE takes
+        # the database's write lock (SQLite has no finer one) until the block ends, so keep slow work such as
+        # Postgres queries outside it. Reentrant
+        if getattr(self._local, "conn", None) is not None:
+            yield
+            return
+        conn = self._connect()
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.conn = conn
+        try:
+            yield
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.conn = None
+            conn.close()
+
+    def _header(self, conn, session_id, key):
+        return conn.execute(
+            "SELECT value, frame FROM session_values WHERE session_id = ? AND key = ?", (session_id, key)
+        ).fetchone()
+
+    @staticmethod
+    def _frame(columns, rows):
+        if not rows:
+            return pd.DataFrame(columns=columns)
+        index = pd.Index([pickle.loads(row_key) for row_key, _ in rows])
+        return pd.DataFrame([pickle.loads(value) for _, value in rows], columns=columns, index=index)
+
+    def get(self, session_id, key, default=None):
+        # Reads do not write. Eviction goes by each session's latest set(), which every load and edit goes through
+        with self._connection() as conn:
+            header = self._header(conn, session_id, key)
+            if header is None:
+                return default
+            if not header[1]:
+                return pickle.loads(header[0])
+            rows = conn.execute(
+                "SELECT row_key, value FROM session_rows WHERE session_id = ? AND key = ? ORDER BY position",
+                (session_id, key)
+            ).fetchall()
+        return self._frame(pickle.loads(header[0]), rows)
+
+    def get_rows(self, session_id, key, index):
+        # The rows of a stored dataframe whose index is in `index`, in stored order; None when there is no dataframe
+        row_keys = [pickle.dumps(_row_key(value), protocol=pickle.HIGHEST_PROTOCOL) for value in index]
+        with self._connection() as conn:
+            header = self._header(conn, session_id, key)
+            if header is None or not header[1]:
+                return None
+            rows = []
+            for start in range(0, len(row_keys), ROW_LOOKUP_CHUNK):
+                chunk = row_keys[start:start + ROW_LOOKUP_CHUNK]
+                rows += conn.execute(
+                    "SELECT row_key, value, position FROM session_rows WHERE session_id = ? AND key = ? "
+                    f"AND row_key IN ({', '.join('?' * len(chunk))})",
+                    (session_id, key, *chunk)
+                ).fetchall()
+        rows.sort(key=lambda row: row[2])
+        return self._frame(pickle.loads(header[0]), [row[:2] for row in rows])
+
+    def _write_rows(self, conn, session_id, key, rows, first_position):
+        # Upsert: rows already stored keep their position
+        records = []
+        for position, (index, values) in enumerate(zip(rows.index, rows.itertuples(index=False, name=None)), first_position):
+            blob = pickle.dumps(tuple(_row_key(value) for value in values), protocol=pickle.HIGHEST_PROTOCOL)
+            row_key = pickle.dumps(_row_key(index), protocol=pickle.HIGHEST_PROTOCOL)
+            records.append((session_id, key, row_key, position, blob, len(blob)))
+        conn.executemany(
+            "INSERT INTO session_rows (session_id, key, row_key, position, value, size) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_id, key, row_key) DO UPDATE SET value = excluded.value, size = excluded.size",
+            records
+        )
+
+    def _write_header(self, conn, session_id, key, value, frame):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn.execute(
+            "INSERT OR REPLACE INTO session_values (session_id, key, value, frame, size, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, key, blob, int(frame), len(blob), time.time())
+        )
+
+    def _replace(self, conn, session_id, key, value):
+        conn.execute("DELETE FROM session_rows WHERE session_id = ? AND key = ?", (session_id, key))
+        if isinstance(value, pd.DataFrame):
+            self._write_header(conn, session_id, key, list(value.columns), frame=True)
+            self._write_rows(conn, session_id, key, value, 0)
+        else:
+            self._write_header(conn, session_id, key, value, frame=False)
+
+    def set(self, session_id, key, value):
+        with self._connection() as conn:
+            self._replace(conn, session_id, key, value)
+            self._count_write(conn, session_id)
+
+    def set_rows(self, session_id, key, rows):
+        # Replaces the rows of a stored dataframe with the same index and appends the others
+        with self._connection() as conn:
+            header = self._header(conn, session_id, key)
+            if header is None or not header[1]:
+                self._replace(conn, session_id, key, rows)
+            else:
+                last = conn.execute(
+                    "SELECT COALESCE(MAX(position), -1) FROM session_rows WHERE session_id = ? AND key = ?", (session_id, key)
+                ).fetchone()[0]
+                self._write_rows(conn, session_id, key, rows.reindex(columns=pickle.loads(header[0])), last + 1)
+                conn.execute(
+                    "UPDATE session_values SET accessed_at = ? WHERE session_id = ? AND key = ?", (time.time(), session_id, key)
+                )
+            self._count_write(conn, session_id)
+
+    def clear(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM session_values WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_rows WHERE session_id = ?", (session_id,))
+
+    def _count_write(self, conn, session_id):
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self._evict(conn, session_id)
+
+    def _session_sizes(self, conn):
+        # (session_id, bytes) per session, least recently written first
+        return conn.execute(
+            "SELECT v.session_id, SUM(v.size) + COALESCE((SELECT SUM(r.size) FROM session_rows r WHERE r.session_id = v.session_id), 0) "
+            "FROM session_values v GROUP BY v.session_id ORDER BY MAX(v.accessed_at)"
+        ).fetchall()
+
+    def _evict(self, conn, current_session_id):
+        sessions = self._session_sizes(conn)
+        total_bytes = sum(size for _, size in sessions)
+        remaining = len(sessions)
+
+        for session_id, size in sessions:
+            if remaining <= self.max_sessions and total_bytes <= self.max_bytes:
+                break
+            if session_id == current_session_id:
+                continue
+            conn.execute("DELETE FROM session_values WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_rows WHERE session_id = ?", (session_id,))
+            total_bytes -= size
+            remaining -= 1
+            self.evictions += 1
+
+    def stats(self):
+        with self._connect() as conn:
+            sessions = self._session_sizes(conn)
+        return {"backend": "sqlite", "sessions": len(sessions), "bytes": sum(size for _, size in sessions), "evictions": self.evictions}
+
+
+@after_fork
+def _reset_after_fork():
+    # A lock held by another request thread at fork time would never be released in the child
+    for store in _memory_stores:
+        store._lock = threading.Lock()
+        store._session_locks = {}
+
+
+def create_session_store():
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore()
+    return MemorySessionStore()
@@ -0,0 +1,23 @@
+from sqlalchemy import create_engine, text
+
+from benchmarks.run import QueryCounter, measure
+
+
+def test_measure_without_counter():
+    calls = []
+    result = measure(lambda: calls.append(1), setup=lambda: calls.append(0), repeat=3)
+    assert calls == [0, 1] * 4
+    assert result["queries"] is None
+    assert result["latency_min_s"] <= result["latency_median_s"] <= result["latency_max_s"]
+
+
+def test_measure_counts_queries_of_first_run():
+    engine = create_engine("sqlite://")
+    counter = QueryCounter(engine)
+
+    def run():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+
+    assert measure(run, repeat=2, counter=counter)["queries"] == 2
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import export
+
+# COPY needs a real Postgres; e.g. TEST_DATABASE_URL=postgresql://postgres@/mercury_passive?host=/tmp/pgdata
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE export_copy_test (kitid text, note text)"))
+        conn.execute(text(
+            "INSERT INTO export_copy_test VALUES ('EC-100%', 'percent'), ('EC-1000', 'plain'), ('O''Hara', 'quote')"
+        ))
+    yield engine
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE export_copy_test"))
+    engine.dispose()
+
+
+def copy_csv(engine, sql, params):
+    return b"".join(export.stream_copy_csv(engine, sql, params)).decode().splitlines()
+
+
+def test_copy_filter_with_percent(engine):
+    sql = "SELECT * FROM export_copy_test WHERE kitid = :kitid"
+    assert copy_csv(engine, sql, {"kitid": "EC-100%"}) == ["kitid,note", "EC-100%,percent"]
+
+
+def test_copy_filter_is_quoted(engine):
+    sql = "SELECT * FROM export_copy_test WHERE kitid = :kitid"
+    assert copy_csv(engine, sql, {"kitid": "O'Hara"}) == ["kitid,note", "O'Hara,quote"]
+
+
+def test_copy_without_filters(engine):
+    # A literal % in the query text itself survives too
+    sql = "SELECT kitid FROM export_copy_test WHERE kitid LIKE 'EC-%' ORDER BY note"
+    assert copy_csv(engine, sql, {}) == ["kitid", "EC-100%", "EC-1000"]
+
+
+def test_build_export_query_skips_blank_filters():
+    sql, params = export.build_export_query({"kitid": " EC-0001 ", "location": " ", "start": "2024-01-01"})
+    assert params == {"kitid": "EC-0001", "start": "2024-01-01"}
+    assert sql == (
+        "SELECT * FROM pas_tracking WHERE kitid = :kitid AND sample_start >= CAST(:start AS date) ORDER BY sampleid"
+    )
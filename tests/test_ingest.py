@@ -0,0 +1,251 @@
+import base64
+
+import pandas as pd
+
+import ingest
+
+COLUMNS = ["sampleid", "kitid", "samplerid", "note", "return_date"]
+
+
+def loaded_rows():
+    return pd.DataFrame({
+        "sampleid": ["EC-0001_ECCC0001", "EC-0001_ECCC0002", "EC-0001_ECCC0003"],
+        "kitid": ["EC-0001"] * 3,
+        "samplerid": ["ECCC0001", "ECCC0002", "ECCC0003"],
+        "note": ["a", None, "c"],
+        "return_date": pd.to_datetime(["2024-01-02", None, "2024-01-04"]),
+        "row_version": ["10", "11", "12"],
+    })
+
+
+def test_diff_edited_rows_unchanged():
+    loaded = loaded_rows()
+    diff = ingest.diff_edited_rows(loaded.drop(columns="row_version"), loaded, COLUMNS)
+    assert diff["status"].tolist() == ["unchanged"] * 3
+
+
+def test_diff_edited_rows_flags_edited_and_cleared_cells():
+    loaded = loaded_rows()
+    edited = loaded.drop(columns="row_version")
+    edited.loc[0, "note"] = "edited"
+    edited.loc[2, "note"] = None
+    diff = ingest.diff_edited_rows(edited, loaded, COLUMNS)
+    assert diff["status"].tolist() == ["changed", "unchanged", "changed"]
+    assert diff["note_changed"].tolist() == [True, False, True]
+    assert not diff["return_date_changed"].any()
+    assert diff["row_version"].tolist() == ["10", "11", "12"]
+
+
+def test_diff_edited_rows_same_date_in_another_format():
+    loaded = loaded_rows()
+    edited = loaded.drop(columns="row_version").astype({"return_date": object})
+    edited.loc[0, "return_date"] = "2024-01-02 00:00"
+    assert not ingest.diff_edited_rows(edited, loaded, COLUMNS)["return_date_changed"].any()
+
+
+def test_diff_edited_rows_key_edit_is_an_update_of_the_loaded_row():
+    # The samplerid (and so the sampleid) of the second row was edited: it is still the row read as ECCC0002
+    loaded = loaded_rows()
+    edited = loaded.drop(columns="row_version")
+    edited.loc[1, ["samplerid", "sampleid"]] = ["ECCC0009", "EC-0001_ECCC0009"]
+    diff = ingest.diff_edited_rows(edited, loaded, COLUMNS)
+    assert diff["status"].tolist() == ["unchanged", "changed", "unchanged"]
+    assert diff.loc[1, ["sampleid_changed", "samplerid_changed", "kitid_changed"]].tolist() == [True, True, False]
+    assert diff.loc[1, "loaded_sampleid"] == "EC-0001_ECCC0002"
+    assert diff.loc[1, "row_version"] == "11"
+
+
+def test_diff_edited_rows_rows_not_loaded_are_new():
+    loaded = loaded_rows().iloc[:2]
+    edited = loaded_rows().drop(columns="row_version")
+    diff = ingest.diff_edited_rows(edited, loaded, COLUMNS)
+    assert diff["status"].tolist() == ["unchanged", "unchanged", "new"]
+    assert pd.isna(diff.loc[2, "loaded_sampleid"])
+
+
+def test_diff_edited_rows_joins_on_index_not_position():
+    # Rows are matched by their session index, whatever their order
+    loaded = loaded_rows().set_axis(["a", "b", "c"])
+    edited = loaded.drop(columns="row_version").iloc[::-1]
+    edited.loc["a", "note"] = "edited"
+    diff = ingest.diff_edited_rows(edited, loaded, COLUMNS)
+    assert diff["status"].to_dict() == {"c": "unchanged", "b": "unchanged", "a": "changed"}
+
+
+def refresh_case():
+    # Two rows loaded from the database, as the session dataframe and its loaded rows hold them
+    loaded = loaded_rows().iloc[:2].drop(columns="return_date")
+    rows = loaded.drop(columns="row_version").copy()
+    fresh = loaded.copy()
+    fresh["row_version"] = ["20", "21"]
+    return rows, loaded, fresh
+
+
+def test_merge_refreshed_rows_keeps_local_edit():
+    rows, loaded, fresh = refresh_case()
+    rows.loc[0, "note"] = "local"
+    fresh.loc[1, "note"] = "remote"
+    refreshed, added, new_loaded, kept, conflicts = ingest.merge_refreshed_rows(rows, loaded, fresh)
+    assert refreshed["note"].to_dict() == {1: "remote"}
+    assert added.empty
+    assert (kept, conflicts) == (1, 0)
+    # Both rows are in sync with the database again: the next upload checks the new versions
+    assert new_loaded["row_version"].to_dict() == {0: "20", 1: "21"}
+    assert new_loaded.loc[0, "note"] == "a"
+
+
+def test_merge_refreshed_rows_counts_conflict():
+    rows, loaded, fresh = refresh_case()
+    rows.loc[0, "note"] = "local"
+    fresh.loc[0, "note"] = "remote"
+    refreshed, added, new_loaded, kept, conflicts = ingest.merge_refreshed_rows(rows, loaded, fresh)
+    assert refreshed.empty and added.empty
+    assert (kept, conflicts) == (1, 1)
+    # The conflicting row keeps its old loaded row and version, so uploading it is refused
+    assert new_loaded.index.tolist() == [1]
+
+
+def test_merge_refreshed_rows_adds_new_row():
+    rows, loaded, fresh = refresh_case()
+    new = fresh.iloc[[0]].assign(sampleid="EC-0001_ECCC0007", samplerid="ECCC0007", row_version="30")
+    fresh = pd.concat([fresh, new], ignore_index=True)
+    refreshed, added, new_loaded, kept, conflicts = ingest.merge_refreshed_rows(rows, loaded, fresh)
+    assert refreshed.empty
+    assert added["sampleid"].to_dict() == {2: "EC-0001_ECCC0007"}
+    assert new_loaded.loc[2, "row_version"] == "30"
+
+    # Not after the table's own upload, nor in the infinite grid
+    assert ingest.merge_refreshed_rows(rows, loaded, fresh, add_new=False)[1].empty
+
+
+def test_merge_refreshed_rows_matches_renamed_row_by_loaded_key():
+    rows, loaded, fresh = refresh_case()
+    rows.loc[0, ["samplerid", "sampleid"]] = ["ECCC0009", "EC-0001_ECCC0009"]
+    fresh.loc[0, "note"] = "remote"
+    refreshed, added, new_loaded, kept, conflicts = ingest.merge_refreshed_rows(rows, loaded, fresh)
+    assert refreshed.loc[0, ["sampleid", "note"]].tolist() == ["EC-0001_ECCC0009", "remote"]
+    assert added.empty
+    assert new_loaded.loc[0, "sampleid"] == "EC-0001_ECCC0001"
+
+
+def test_merge_refreshed_rows_own_upload_of_renamed_row():
+    # This table saved the rename: the database now holds the new key
+    rows, loaded, fresh = refresh_case()
+    rows.loc[0, ["samplerid", "sampleid"]] = ["ECCC0009", "EC-0001_ECCC0009"]
+    fresh.loc[0, ["samplerid", "sampleid"]] = ["ECCC0009", "EC-0001_ECCC0009"]
+    refreshed, added, new_loaded, kept, conflicts = ingest.merge_refreshed_rows(rows, loaded, fresh, own=True, add_new=False)
+    assert refreshed.empty and added.empty
+    assert new_loaded.loc[0, ["sampleid", "row_version"]].tolist() == ["EC-0001_ECCC0009", "20"]
+
+
+def test_foreign_event_reaching_an_infinite_grid_tab():
+    # The tab pages through a location search and holds no edited rows; another session saved kit EC-0001
+    _, loaded, fresh = refresh_case()
+    fresh["shipped_location"] = [" alert ", "Eureka"]
+    rows = pd.DataFrame(columns=loaded.columns.drop("row_version"))
+    no_loaded = pd.DataFrame(columns=loaded.columns)
+
+    # One of the kit's rows is at the searched location (matched like the search), so the tab reloads its blocks
+    assert ingest.touches_location(fresh, "Alert")
+    # A row moved out of the location is only known from the event's locations
+    assert ingest.touches_location(fresh, "Resolute", ["Resolute"])
+    assert not ingest.touches_location(fresh, "Resolute", ["Iqaluit"])
+    assert not ingest.touches_location(fresh.iloc[0:0], "Alert", None)
+
+    # Without edited rows, nothing is merged into the session
+    refreshed, added, new_loaded, kept, conflicts = ingest.merge_refreshed_rows(rows, no_loaded, fresh, add_new=False)
+    assert refreshed.empty and added.empty and new_loaded.empty
+    assert (kept, conflicts) == (0, 0)
+
+
+def test_validate_kit_chunk_maps_headers_and_builds_sampleid():
+    chunk = pd.DataFrame({
+        "Kit ID": [" EC-0001 ", "EC-0001"],
+        "sampler_id": ["ECCC0001", "ECCC0002"],
+        "Sample Type": ["sample", "BLANK"],
+        "Sample Start": ["2024-01-02 10:00", "2024/01/03"],
+        "Unknown": ["x", "y"],
+    })
+    df, errors = ingest.validate_kit_chunk(chunk, first_row=2)
+    assert errors == []
+    assert list(df.columns) == ingest.queries.TRACKING_COLUMNS
+    assert df["sampleid"].tolist() == ["EC-0001_ECCC0001", "EC-0001_ECCC0002"]
+    assert df["sample_type"].tolist() == ["Sample", "Blank"]
+    assert df["sample_start"].tolist() == ["2024-01-02 10:00", "2024-01-03 00:00"]
+
+
+def test_validate_kit_chunk_reports_rows_by_spreadsheet_row():
+    chunk = pd.DataFrame({
+        "kitid": ["EC-0001", "EC-01", "", "EC-0002"],
+        "samplerid": ["ECCC0001", "ECCC0002", "", "ECCC0003"],
+        "sample_type": ["Sample", "Blank", "", "Other"],
+        "return_date": ["2024-01-05", "", "", "not a date"],
+    })
+    df, errors = ingest.validate_kit_chunk(chunk, first_row=10)
+    # The blank line is skipped, not reported
+    assert len(df) == 3
+    assert errors == [
+        "Row 11: invalid Kit ID 'EC-01'. Expected EC-####.",
+        "Row 13: invalid Sample Type 'Other'. Expected Sample or Blank.",
+        "Row 13: invalid return_date 'not a date'.",
+    ]
+
+
+def test_validate_kit_chunk_requires_kit_and_sampler():
+    df, errors = ingest.validate_kit_chunk(pd.DataFrame({"Kit ID": ["EC-0001"]}), first_row=2)
+    assert df is None
+    assert errors == ["Missing required column(s): samplerid."]
+
+
+def test_parse_kit_file_reports_duplicate_sampleids():
+    csv = "Kit ID,Sampler ID\nEC-0001,ECCC0001\nEC-0001,ECCC0001\nEC-0001,ECCC0002\n"
+    contents = "data:text/csv;base64," + base64.b64encode(csv.encode()).decode()
+    df, errors = ingest.parse_kit_file(contents, "kits.csv")
+    assert len(df) == 3
+    assert errors == ["Duplicate sample IDs in file: EC-0001_ECCC0001."]
+
+
+def test_diff_return_sheet():
+    incoming = pd.DataFrame({
+        "sampleid": ["A", "B", "C", "D"],
+        "return_date": [pd.Timestamp("2024-01-05"), pd.NaT, pd.Timestamp("2024-02-01"), pd.Timestamp("2024-03-01")],
+        "screen_sampling_rate": [1.5, None, None, 2.0],
+        "note": ["new note", "same", None, None],
+    })
+    current = pd.DataFrame({
+        "sampleid": ["A", "B", "D"],
+        "return_date": [pd.Timestamp("2024-01-05 13:00"), pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-01")],
+        "screen_sampling_rate": [1.5000000001, 3.0, 2.0],
+        "note": ["old note", " same ", "kept"],
+    })
+    diff = ingest.diff_return_sheet(incoming, current, ["return_date", "screen_sampling_rate", "note"])
+    assert diff["status"].tolist() == ["changed", "unchanged", "missing", "changed"]
+    # Dates compare on the day, numbers within tolerance, text without surrounding blanks
+    assert diff["return_date_changed"].tolist() == [False, False, False, True]
+    assert diff["screen_sampling_rate_changed"].tolist() == [False, False, False, False]
+    assert diff["note_changed"].tolist() == [True, False, False, False]
+    # Blank cells in the sheet never overwrite stored values
+    assert diff.loc[3, "note_current"] == "kept"
+
+
+def test_validate_return_chunk_builds_sampleid_and_parses_values():
+    chunk = pd.DataFrame({
+        "Kit ID": ["EC-0001", "EC-0001"],
+        "Sampler ID": ["ECCC0001", "ECCC0002"],
+        "Return Date": ["2024-01-05", "later"],
+        "Screen Sampling Rate": ["1.5", "fast"],
+    })
+    df, errors = ingest.validate_return_chunk(chunk, first_row=2)
+    assert list(df.columns) == ["sampleid", "return_date", "screen_sampling_rate"]
+    assert df["sampleid"].tolist() == ["EC-0001_ECCC0001", "EC-0001_ECCC0002"]
+    assert df.loc[0, "return_date"] == pd.Timestamp("2024-01-05")
+    assert errors == ["Row 3: invalid return_date 'later'.", "Row 3: invalid screen_sampling_rate 'fast'."]
+
+
+def test_validate_return_chunk_needs_a_key_and_a_return_column():
+    assert ingest.validate_return_chunk(pd.DataFrame({"sampleid": ["A"]}), 2)[1] == [
+        "No return columns found. Expected at least one of: return_date, sample_end, note, screen_sampling_rate."
+    ]
+    assert ingest.validate_return_chunk(pd.DataFrame({"kitid": ["EC-0001"], "note": ["x"]}), 2)[1] == [
+        "Missing required column: Sample ID (or both Kit ID and Sampler ID)."
+    ]
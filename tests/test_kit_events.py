@@ -0,0 +1,43 @@
+from kit_events import KitEventHub, NullKitEventHub
+
+
+def test_streams_are_capped():
+    hub = KitEventHub(max_streams=1)
+    first = hub.subscribe()
+    assert first is not None
+    assert hub.subscribe() is None
+    hub.unsubscribe(first)
+    assert hub.subscribe() is not None
+
+
+def test_recent_returns_events_after_since():
+    hub = KitEventHub(max_streams=0)
+    now, events = hub.recent()
+    assert events == []
+    hub.publish(["EC-0002", "EC-0001"], "tab-a")
+    later, events = hub.recent(now)
+    assert events == [{"kitids": ["EC-0001", "EC-0002"], "origin": "tab-a"}]
+    assert hub.recent(later)[1] == []
+
+
+def test_recent_reaches_polling_tabs_and_streams():
+    hub = KitEventHub(max_streams=1)
+    stream = hub.subscribe()
+    since, _ = hub.recent()
+    hub.publish(["EC-0001"])
+    assert stream.get_nowait() == {"kitids": ["EC-0001"], "origin": None}
+    assert hub.recent(since)[1] == [{"kitids": ["EC-0001"], "origin": None}]
+
+
+def test_locations_travel_with_the_first_events():
+    hub = KitEventHub(max_streams=0)
+    since, _ = hub.recent()
+    hub.publish([f"EC-{n:04d}" for n in range(250)], "tab-a", ["Eureka", "Alert", None])
+    first, second = hub.recent(since)[1]
+    assert first["locations"] == ["Alert", "Eureka"]
+    assert len(first["kitids"]) + len(second["kitids"]) == 250
+    assert "locations" not in second
+
+
+def test_null_hub_turns_polling_away():
+    assert NullKitEventHub().recent(0) is None
@@ -0,0 +1,52 @@
+import pytest
+
+import queries
+
+
+def test_grid_filter_binds_user_text():
+    params = {}
+    sql = queries._grid_filter_sql("note", {"filterType": "text", "type": "contains", "filter": "50%_off'; --"}, params)
+    assert sql == "CAST(note AS text) ILIKE :f0"
+    # LIKE wildcards typed by the user are escaped; nothing typed reaches the SQL text
+    assert params == {"f0": "%50\\%\\_off'; --%"}
+
+
+def test_grid_filter_combined_conditions():
+    params = {}
+    model = {
+        "filterType": "text", "operator": "OR",
+        "conditions": [{"type": "startsWith", "filter": "EC-0"}, {"type": "blank"}],
+    }
+    sql = queries._grid_filter_sql("kitid", model, params)
+    assert sql == "(CAST(kitid AS text) ILIKE :f0 OR (kitid IS NULL OR trim(CAST(kitid AS text)) = ''))"
+    assert params == {"f0": "EC-0%"}
+
+
+def test_grid_filter_dates():
+    params = {}
+    sql = queries._grid_filter_sql(
+        "sample_start", {"filterType": "date", "type": "inRange", "dateFrom": "2024-01-01", "dateTo": "2024-02-01"}, params
+    )
+    assert sql == "(CAST(sample_start AS date) > CAST(:f0 AS date) AND CAST(sample_start AS date) < CAST(:f0_to AS date))"
+    assert params == {"f0": "2024-01-01", "f0_to": "2024-02-01"}
+
+
+@pytest.mark.parametrize("col, model", [
+    ("note; DROP TABLE pas_tracking", {"filterType": "text", "type": "contains", "filter": "x"}),
+    ("row_version", {"filterType": "text", "type": "contains", "filter": "x"}),
+    ("note", {"filterType": "text", "type": "regex", "filter": "x"}),
+    ("return_date", {"filterType": "date", "type": "between", "dateFrom": "2024-01-01"}),
+])
+def test_grid_filter_rejects_unknown_columns_and_operators(col, model):
+    with pytest.raises(ValueError):
+        queries._grid_filter_sql(col, model, {})
+
+
+def test_grid_order_whitelists_columns():
+    sort_model = [
+        {"colId": "sample_start", "sort": "desc"},
+        {"colId": "kitid; DROP TABLE pas_tracking", "sort": "asc"},
+        {"colId": "note", "sort": "asc"},
+    ]
+    assert queries._grid_order_sql(sort_model) == "sample_start DESC NULLS LAST, note ASC NULLS LAST, sampleid"
+    assert queries._grid_order_sql(None) == "sampleid"
@@ -0,0 +1,39 @@
+import pandas as pd
+from sqlalchemy import create_engine
+
+import reference_data
+
+
+def dcp_engine():
+    engine = create_engine("sqlite://")
+    pd.DataFrame({"email": ["a@x"]}).to_sql("users", engine, index=False)
+    pd.DataFrame({
+        "siteid": ["ALT", "EUR", "XYZ"],
+        "description": ["Alert", "Eureka", "Other project"],
+        "projectid": ["MERCURY_PASSIVE", "MERCURY_PASSIVE", "OTHER"],
+    }).to_sql("stations", engine, index=False)
+    return engine
+
+
+def test_site_labels_map_both_ways():
+    data = reference_data.load_reference_data(dcp_engine())
+    assert data.site_labels == ["Alert (ALT)", "Eureka (EUR)"]
+    assert data.siteid_to_label == {"ALT": "Alert (ALT)", "EUR": "Eureka (EUR)"}
+    assert data.label_to_siteid == {"Alert (ALT)": "ALT", "Eureka (EUR)": "EUR"}
+
+
+def test_reference_data_cache_reads_once_per_ttl():
+    cache = reference_data.ReferenceDataCache(dcp_engine(), ttl=60)
+    assert cache.get() is cache.get()
+    cache.invalidate()
+    cache.get()
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 2)
+
+
+def test_location_search_is_a_case_insensitive_prefix_match(monkeypatch):
+    monkeypatch.setattr(reference_data.queries, "fetch_shipped_locations", lambda engine: ["Eureka", "alert ", "Alert North", "Resolute"])
+    cache = reference_data.LocationCache(None, ttl=60)
+    assert cache.search("AL") == ["alert ", "Alert North"]
+    assert cache.search("  res") == ["Resolute"]
+    assert cache.search("", limit=2) == ["alert ", "Alert North"]
+    assert cache.search("zz") == []
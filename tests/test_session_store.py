@@ -0,0 +1,89 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+def frame():
+    return pd.DataFrame({"sampleid": ["A", "B", "C"], "note": ["a", None, "c"], "rate": [1.0, None, 3.0]})
+
+
+def test_memory_store_evicts_least_recently_used_session():
+    store = MemorySessionStore(max_sessions=2)
+    store.set("s1", "k", 1)
+    store.set("s2", "k", 2)
+    assert store.get("s1", "k") == 1  # s1 is now the most recently used
+    store.set("s3", "k", 3)
+    assert store.get("s2", "k") is None
+    assert (store.get("s1", "k"), store.get("s3", "k")) == (1, 3)
+    assert store.stats()["evictions"] == 1
+
+
+def test_memory_store_evicts_by_size_but_keeps_session_just_written():
+    store = MemorySessionStore(max_bytes=1)
+    store.set("s1", "df", frame())
+    assert store.get("s1", "df") is not None
+    store.set("s2", "df", frame())
+    assert store.get("s1", "df") is None
+    assert store.get("s2", "df") is not None
+
+
+def test_memory_store_clear():
+    store = MemorySessionStore()
+    store.set("s1", "k", 1)
+    store.clear("s1")
+    assert store.get("s1", "k", "missing") == "missing"
+    assert store.stats()["sessions"] == 0
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite"))
+
+
+def test_rows_replace_and_append_in_order(store):
+    store.set("s1", "df", frame())
+    assert store.get_rows("s1", "df", [2, 0])["sampleid"].tolist() == ["A", "C"]
+    assert store.get_rows("s1", "missing", [0]) is None
+
+    edited = pd.DataFrame({"sampleid": ["B", "D"], "note": ["edited", "new"], "rate": ["2024-01-01", 4.0]}, index=[1, 3])
+    store.set_rows("s1", "df", edited)
+    df = store.get("s1", "df")
+    assert df.index.tolist() == [0, 1, 2, 3]
+    assert df["note"].tolist() == ["a", "edited", "c", "new"]
+    assert df.loc[1, "rate"] == "2024-01-01"
+
+
+def test_rows_start_a_frame(store):
+    rows = frame().set_axis(["x", "y", "z"])
+    store.set_rows("s1", "df", rows)
+    assert store.get("s1", "df")["sampleid"].to_dict() == {"x": "A", "y": "B", "z": "C"}
+
+
+def test_lock_serialises_read_modify_write(store):
+    store.set("s1", "count", 0)
+
+    def increment():
+        for _ in range(50):
+            with store.lock("s1"):
+                store.set("s1", "count", store.get("s1", "count") + 1)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get("s1", "count") == 200
+
+
+def test_sqlite_store_evicts_least_recently_written_session(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite"), max_sessions=2, evict_every=1)
+    for session_id in ["s1", "s2", "s3"]:
+        store.set(session_id, "df", frame())
+    assert store.get("s1", "df") is None
+    assert store.get("s3", "df") is not None
+    assert store.stats()["sessions"] == 2
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import validation
+
+
+@pytest.mark.parametrize("column, valid, invalid", [
+    ("kitid", ["EC-0001", " EC-1234 "], ["EC-01", "ec-0001", "EC-00011", "XEC-0001"]),
+    ("samplerid", ["ECCC0001"], ["ECC0001", "ECCC00012", "eccc0001"]),
+    ("sample_type", ["Sample", "blank", "BLANK"], ["Samples", "Other"]),
+    ("sample_start", ["2024-01-02 10:00"], ["2024-01-02", "2024-01-02 10:00:00", "02/01/2024 10:00"]),
+    ("shipped_date", ["2024-01-02"], ["2024-01-02 10:00", "2024/01/02"]),
+])
+def test_rules(column, valid, invalid):
+    assert all(validation.is_valid(column, value) for value in valid)
+    assert not any(validation.is_valid(column, value) for value in invalid)
+    # The vectorized check agrees with the single-value one
+    flagged = validation.validate_column(pd.Series(valid + invalid), column)
+    assert flagged.tolist() == [False] * len(valid) + [True] * len(invalid)
+
+
+def test_every_rule_has_label_and_hint():
+    for rule in validation.RULES.values():
+        assert rule.label and rule.hint.startswith("Expected")
+
+
+def test_blank_cells_fail_only_when_required():
+    series = pd.Series(["", None, "  "])
+    assert not validation.validate_column(series, "kitid").any()
+    assert validation.validate_column(series, "kitid", required=True).all()
+    assert not validation.is_valid("kitid", "")
+
+
+def test_validate_frame_and_error_messages():
+    df = pd.DataFrame({"kitid": ["EC-0001", "bad"], "samplerid": [None, "ECCC0001"], "note": ["x", "y"]})
+    errors = validation.validate_frame(df, required=["samplerid"])
+    assert list(errors.columns) == ["kitid", "samplerid"]
+    assert validation.error_messages(df, errors, first_row=2) == [
+        "Row 3: invalid Kit ID 'bad'. Expected EC-####.",
+        "Row 2: invalid Sampler ID ''. Expected ECCC####.",
+    ]
+
+
+def test_validate_changes_checks_each_cell_against_its_column():
+    changes = pd.DataFrame({
+        "colId": ["kitid", "note", "samplerid", "kitid"],
+        "value": ["EC-0001", "anything", "ECCC1", ""],
+    })
+    assert validation.validate_changes(changes).tolist() == [False, False, True, False]
@@ -0,0 +1,76 @@
+import re
+from dataclasses import dataclass
+
+import pandas as pd
+
+# Patterns are compiled once at import and shared by every entry path (New modal, grid edits, Update search, file import)
+KITID_PATTERN = re.compile(r"EC-\d{4}")
+SAMPLERID_PATTERN = re.compile(r"ECCC\d{4}")
+SAMPLE_TYPE_PATTERN = re.compile(r"Sample|Blank", re.IGNORECASE)
+DATETIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}")
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+@dataclass(frozen=True)
+class Rule:
+    pattern: re.Pattern
+    label: str
+    hint: str
+
+
+RULES = {
+    "kitid": Rule(KITID_PATTERN, "Kit ID", "Expected EC-####."),
+    "samplerid": Rule(SAMPLERID_PATTERN, "Sampler ID", "Expected ECCC####."),
+    "sample_type": Rule(SAMPLE_TYPE_PATTERN, "Sample Type", "Expected Sample or Blank."),
+    "sample_start": Rule(DATETIME_PATTERN, "Sample Start", "Expected format: YYYY-MM-DD HH:MM."),
+    "sample_end": Rule(DATETIME_PATTERN, "Sample End", "Expected format: YYYY-MM-DD HH:MM."),
+    "shipped_date": Rule(DATE_PATTERN, "Shipped Date", "Expected format: YYYY-MM-DD."),
+    "return_date": Rule(DATE_PATTERN, "Return Date", "Expected format: YYYY-MM-DD."),
+}
+
+
+def _strip(series):
+    return series.astype("string").str.strip()
+
+
+def validate_column(series, column, required=False):
+    # Boolean Series, True where the cell breaks the column's rule. Blank cells only fail when required
+    values = _strip(series)
+    blank = values.isna() | values.eq("")
+    invalid = ~values.str.fullmatch(RULES[column].pattern).fillna(False).astype(bool)
+    return (invalid & ~blank) | (blank & required)
+
+
+def validate_frame(df, columns=None, required=()):
+    # Per-cell error matrix: same index as df, one boolean column per validated column
+    columns = [col for col in (columns or RULES) if col in df.columns and col in RULES]
+    return pd.DataFrame(
+        {col: validate_column(df[col], col, required=col in required) for col in columns},
+        index=df.index,
+        dtype=bool,
+    )
+
+
+def validate_changes(changes):
+    # Grid edits arrive as one row per changed cell (colId, value); each is checked against its column's rule
+    invalid = pd.Series(False, index=changes.index)
+    for column, group in changes.groupby("colId"):
+        if column in RULES:
+            invalid[group.index] = validate_column(group["value"], column)
+    return invalid
+
+
+def is_valid(column, value):
+    return bool(value) and RULES[column].pattern.fullmatch(str(value).strip()) is not None
+
+
+def error_messages(df, errors, first_row=1):
+    # One message per failing cell. df has a 0-based positional index; first_row is the row number of label 0
+    messages = []
+    for column in errors.columns:
+        rule = RULES[column]
+        for row in errors.index[errors[column]]:
+            value = df.at[row, column]
+            value = "" if pd.isna(value) else value
+            messages.append(f"Row {first_row + row}: invalid {rule.label} '{value}'. {rule.hint}")
+    return messages